@@ -0,0 +1,311 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# Times the client's hot paths one at a time. Everything that needs a device
+# talks to zrna.emulator over a pty, and the framing benchmarks read from an
+# in-memory loopback, so timings cover the client (plus the emulator for the
+# round trips) and not a USB link. The emulator runs in a thread of the same
+# process, so round trip timings are only comparable between runs on the same
+# machine.
+#
+#   python benchmarks/client.py [--schema schema.json] results.json
+#   python benchmarks/client.py --compare baseline.json results.json [tolerance]
+#
+# --compare lists every benchmark whose median time per call grew by more
+# than tolerance (0.1 by default, i.e. 10%) and exits with status 1 if there
+# are any.
+
+from cobs import cobs
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+from zrna.__version__ import __version__
+from zrna.api import Client
+from zrna.emulator import Emulator
+from zrna.session import ReplayPort
+from zrna.util import FrameReader, read_framed
+import zrna.zr_pb2 as zr
+
+REPEAT = 7
+# the circuit the add, sync and parse benchmarks work with
+CIRCUIT = ['AudioIn', 'GainInv', 'FilterLowpass', 'SumTwo', 'OscillatorSine', 'AudioOut']
+# nets of the patch building benchmarks, as (output module, output, input
+# module, input) with modules given by their position in CIRCUIT
+NETS = [(0, 'output1', 1, 'input'), (1, 'output', 2, 'input'), (2, 'output', 3, 'input1'),
+        (4, 'output', 3, 'input2'), (3, 'output', 5, 'input1')]
+DEFAULT_TOLERANCE = 0.1
+
+def usage():
+    print('usage: python benchmarks/client.py [--schema /path/to/schema.json] /path/to/results.json')
+    print('       python benchmarks/client.py --compare /path/to/baseline.json /path/to/results.json [tolerance]')
+    sys.exit()
+
+def measure(f, number, repeat=REPEAT, setup=None):
+    # seconds per call of f, over `repeat` runs of `number` calls; setup
+    # runs before each run and isn't timed
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        for _ in range(number):
+            f()
+        times.append((default_timer() - start) / number)
+    times.sort()
+    return {
+        'number': number,
+        'repeat': repeat,
+        'best': times[0],
+        'median': times[len(times) // 2]
+    }
+
+class Loopback(object):
+    # Replays one encoded frame forever, standing in for the serial port
+    # FrameReader reads from.
+    def __init__(self, frame, count=64):
+        self.data = bytes(frame) * count
+        self.in_waiting = len(self.data)
+
+    def read(self, size):
+        return self.data
+
+def _close(client):
+    client.connection.connection.close()
+
+def _circuit_modules(client):
+    return [getattr(client, name)() for name in CIRCUIT]
+
+def _build_patch(client):
+    client.clear()
+    modules = _circuit_modules(client)
+    for module in modules:
+        client.add(module)
+    for output_index, output_id, input_index, input_id in NETS:
+        getattr(modules[output_index], output_id).connect(
+            getattr(modules[input_index], input_id))
+
+def encoding_benchmarks(client):
+    results = {}
+    connection = client.connection
+    url = '/circuit/module/3/parameter/gain/requested'
+    results['build_protobuf_url'] = measure(
+        lambda: connection._build_protobuf_url(url), 20000)
+
+    results['serialize_parameter_request'] = measure(
+        lambda: connection._put_request(url, 1.5).SerializeToString(), 5000)
+
+    circuit = client.get('/circuit').circuit
+    circuit_request = connection._post_request('/circuit', circuit)
+    payload = circuit_request.SerializeToString()
+    results['serialize_circuit_request'] = measure(
+        lambda: circuit_request.SerializeToString(), 2000)
+    results['cobs_encode'] = measure(lambda: cobs.encode(payload), 5000)
+
+    frame = bytearray(cobs.encode(payload))
+    frame.append(0x00)
+    loopback = Loopback(frame)
+    reader = FrameReader(loopback)
+    results['read_framed'] = measure(lambda: read_framed(loopback, reader), 5000)
+
+    response = zr.Response()
+    response.circuit.CopyFrom(circuit)
+    raw = response.SerializeToString()
+    results['parse_circuit_response'] = measure(
+        lambda: zr.Response().ParseFromString(raw), 2000)
+    return results
+
+def module_benchmarks(client):
+    results = {}
+    schema = client.module_schema()
+    results['define_module_classes'] = measure(
+        lambda: [client._define_module_class(s) for s in schema], 50)
+
+    m = client.GainInv()
+    results['parameter_get'] = measure(lambda: m.gain, 20000)
+
+    def set_gain():
+        m.gain = 2.0
+    results['parameter_set_local'] = measure(set_gain, 20000)
+
+    client.clear()
+    client.add(m)
+    results['parameter_set_device'] = measure(set_gain, 500)
+    results['parameter_realized'] = measure(lambda: m.gain.realized, 500)
+
+    def add():
+        client.add(client.GainInv())
+    results['add'] = measure(add, 20, setup=client.clear)
+
+    results['build_patch'] = measure(lambda: _build_patch(client), 20)
+    results['sync'] = measure(client._sync, 100)
+    return results
+
+def connect_benchmarks(device_path):
+    results = {}
+
+    def connect(schema_cache):
+        client = Client()
+        client.connect(device_path=device_path, schema_cache=schema_cache)
+        _close(client)
+
+    results['connect_uncached'] = measure(lambda: connect(None), 5)
+    cache = tempfile.mkdtemp()
+    try:
+        connect(cache)
+        results['connect_cached'] = measure(lambda: connect(cache), 20)
+
+        # the same connect replayed from a recording, without the emulator
+        # competing for the interpreter
+        session = os.path.join(cache, 'connect.zrs')
+        client = Client()
+        client.connect(device_path=device_path, schema_cache=None, record=session)
+        _close(client)
+
+        def replay():
+            Client().connect(device_path=ReplayPort(session, speed=None),
+                             interface='replay', schema_cache=None)
+        results['connect_replayed'] = measure(replay, 20)
+    finally:
+        shutil.rmtree(cache)
+    return results
+
+def _replay(device_path, session, prepare, f, number):
+    # Records prepare(client) and `number` calls of f(client), then times
+    # f against the recording. Every run replays the session from the start.
+    client = Client()
+    client.connect(device_path=device_path, record=session)
+    if prepare is not None:
+        prepare(client)
+    for _ in range(number):
+        f(client)
+    _close(client)
+
+    replaying = []
+    def setup():
+        client = Client()
+        client.connect(device_path=ReplayPort(session, speed=None), interface='replay')
+        if prepare is not None:
+            prepare(client)
+        replaying[:] = [client]
+    return measure(lambda: f(replaying[0]), number, setup=setup)
+
+def replay_benchmarks(device_path):
+    # load and patch building replayed from recordings, like connect_replayed
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        def store(client):
+            _build_patch(client)
+            client.store('benchmark')
+        results['load_replayed'] = _replay(
+            device_path, os.path.join(directory, 'load.zrs'),
+            store, lambda client: client.load('benchmark'), 50)
+        results['build_patch_replayed'] = _replay(
+            device_path, os.path.join(directory, 'build_patch.zrs'),
+            None, _build_patch, 20)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def run(schema=None):
+    results = {}
+    with Emulator(schema) as emulator:
+        client = Client()
+        client.connect(device_path=emulator.device_path, schema_cache=None)
+        try:
+            missing = [name for name in CIRCUIT if not hasattr(client, name)]
+            if missing:
+                raise ValueError('schema is missing modules: %s' % ', '.join(missing))
+            for module in _circuit_modules(client):
+                client.add(module)
+            results.update(encoding_benchmarks(client))
+            results.update(module_benchmarks(client))
+        finally:
+            _close(client)
+        results.update(connect_benchmarks(emulator.device_path))
+        results.update(replay_benchmarks(emulator.device_path))
+    return {
+        'zrna': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': results
+    }
+
+def compare(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    # returns the names of the benchmarks that regressed
+    regressions = []
+    before = baseline['benchmarks']
+    after = results['benchmarks']
+    print('%-30s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'change'))
+    for name in sorted(set(before) | set(after)):
+        if name not in before or name not in after:
+            print('%-30s %s' % (name, 'only in current' if name in after else 'only in baseline'))
+            continue
+        ratio = after[name]['median'] / before[name]['median']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = 'faster'
+        print('%-30s %10.2fus %10.2fus %+7.1f%% %s' % (
+            name, before[name]['median'] * 1e6, after[name]['median'] * 1e6,
+            (ratio - 1) * 100, flag))
+    return regressions
+
+def main():
+    if len(sys.argv) < 2:
+        usage()
+
+    if sys.argv[1] == '--compare':
+        if len(sys.argv) < 4:
+            usage()
+        with open(sys.argv[2]) as f:
+            baseline = json.load(f)
+        with open(sys.argv[3]) as f:
+            results = json.load(f)
+        tolerance = float(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_TOLERANCE
+        if compare(baseline, results, tolerance):
+            sys.exit(1)
+        return
+
+    schema = None
+    args = sys.argv[1:]
+    if args[0] == '--schema':
+        if len(args) < 3:
+            usage()
+        schema = args[1]
+        args = args[2:]
+
+    results = run(schema)
+    with open(args[0], 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    for name, result in sorted(results['benchmarks'].items()):
+        print('%-30s %10.2fus' % (name, result['median'] * 1e6))
+
+if __name__ == "__main__":
+    main()
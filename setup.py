@@ -23,6 +23,7 @@ REQUIRED = [
     'cobs',
     'future',
     'inflection',
+    'numpy',
     'protobuf',
     'pyserial'
 ]
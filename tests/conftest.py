@@ -0,0 +1,41 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Every test that needs a device talks to a fresh zrna.emulator. Clients
+# connect with schema_cache=None so the user's cache is never read or
+# written.
+
+import pytest
+
+from zrna.api import Client
+from zrna.emulator import Emulator
+
+@pytest.fixture
+def emulator():
+    with Emulator() as emulator:
+        yield emulator
+
+def connect(emulator, **kwargs):
+    client = Client()
+    client.connect(device_path=emulator.device_path, schema_cache=None, **kwargs)
+    return client
+
+def close(client):
+    client.connection.connection.close()
+
+@pytest.fixture
+def client(emulator):
+    client = connect(emulator)
+    yield client
+    close(client)
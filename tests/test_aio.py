@@ -0,0 +1,135 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import asyncio
+import numpy
+import pytest
+
+from zrna.aio import AsyncClient
+from zrna.api import ZrnaException
+import zrna.zr_pb2 as zr
+
+def run(emulator, test):
+    async def main():
+        client = AsyncClient()
+        await client.connect(device_path=emulator.device_path, schema_cache=None)
+        try:
+            await test(client)
+        finally:
+            client.close()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+def test_parameter_state(emulator):
+    async def test(client):
+        g = client.GainInv(gain=2.0)
+        await client.add(g)
+        assert await g.gain.realized == 2.0
+        assert await g.gain.minimum < await g.gain.maximum
+        await client.set_parameter(g, 'gain', 3.0)
+        assert await g.gain.realized == 3.0
+        snapshot = await client.snapshot()
+        assert list(snapshot.realized) == [3.0]
+    run(emulator, test)
+
+def test_nets(emulator):
+    async def test(client):
+        a = client.AudioIn()
+        g = client.GainInv()
+        o = client.AudioOut()
+        for m in (a, g, o):
+            await client.add(m)
+        assert await g.output.phase == 'PHASE1'
+        await client.prefetch_phases()
+        await a.output1.connect(g.input)
+        await g.output.connect(o.input1)
+        assert g.output.connected_to is o.input1
+        assert await client.net_count() == 2
+        assert len((await client.nets())['nets']['net']) == 2
+        await g.output.disconnect()
+        assert await client.net_count() == 1
+
+        await client.set_option(g, 'output_phase', zr.Option.Value.Value('PHASE2'))
+        assert await g.output.phase == 'PHASE2'
+        with pytest.raises(ZrnaException):
+            await g.output.connect(o.input1)
+    run(emulator, test)
+
+def test_responses_read_by_coroutines(emulator):
+    async def test(client):
+        t = client.TransferFunction()
+        await client.add(t)
+        assert await client.version == '0.0.0'
+        assert (await client.circuit())['modules'][0]['type'] == 'TRANSFER_FUNCTION'
+        assert 'TransferFunction' in await client.modules()
+        assert await t.can_add()
+        assert await t.lookup_table.bounds is not None
+        assert len(await t.lookup_table.realized) == 256
+    run(emulator, test)
+
+def test_unawaited_write_errors(emulator):
+    async def test(client):
+        g = client.GainInv()
+        await client.add(g)
+        await client.delete('/circuit/module/0')
+        g.gain = 2.0
+        with pytest.raises(ZrnaException):
+            await client.drain()
+        g.gain = 3.0
+        await asyncio.sleep(0.1)
+        with pytest.raises(ZrnaException):
+            client.ping()
+        await client.ping()
+    run(emulator, test)
+
+def test_failed_table_push_stays_dirty(emulator):
+    async def test(client):
+        t = client.TransferFunction()
+        await client.add(t)
+        t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+        pending = t.lookup_table.push()
+        assert t.lookup_table.dirty
+        await pending
+        assert not t.lookup_table.dirty
+
+        await client.delete('/circuit/module/0')
+        t.lookup_table.requested = numpy.zeros(256)
+        with pytest.raises(ZrnaException):
+            await t.lookup_table.push()
+        assert t.lookup_table.dirty
+    run(emulator, test)
+
+def test_apply(emulator):
+    async def test(client):
+        g = client.GainInv(gain=2.0)
+        await client.add(g)
+        desired = (await client.get('/circuit')).circuit
+        await client.set_parameter(g, 'gain', 5.0)
+        await client.add(client.FilterLowpass())
+        await client.apply(desired)
+        assert [m.type_name for m in client.module_instances] == ['GainInv']
+        assert client.module_instances[0].gain == 2.0
+        assert await client.diff(desired) == []
+    run(emulator, test)
+
+def test_sync_only_features_are_refused(emulator):
+    async def test(client):
+        for refused in (client.pipeline, client.transaction, client.coalesce,
+                        client.instrument):
+            with pytest.raises(ZrnaException):
+                refused()
+    run(emulator, test)
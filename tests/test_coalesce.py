@@ -0,0 +1,74 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import pytest
+
+def gain(emulator):
+    return emulator.circuit.modules[0].parameters[0].requested
+
+@pytest.fixture
+def g(client):
+    g = client.GainInv()
+    client.add(g)
+    # The first write goes out at once. Flushing it starts the interval,
+    # so later writes stay pending until the next flush.
+    client.coalesce(max_rate=0.01)
+    g.gain = 2.0
+    client.flush()
+    return g
+
+def test_superseded_values_are_not_sent(client, emulator, g):
+    before = emulator.request_count
+    for value in (3.0, 4.0, 5.0):
+        g.gain = value
+    assert emulator.request_count == before
+    assert gain(emulator) == 2.0
+    client.flush()
+    assert emulator.request_count == before + 1
+    assert gain(emulator) == 5.0
+
+def test_writer_supersedes_pending_value(client, emulator, g):
+    w = g.gain.bind_writer()
+    g.gain = 3.0
+    w(5.0)
+    client.flush()
+    assert gain(emulator) == 5.0
+    assert g.gain == 5.0
+
+def test_pending_value_supersedes_writer(client, emulator, g):
+    w = g.gain.bind_writer()
+    w(5.0)
+    g.gain = 6.0
+    client.flush()
+    assert gain(emulator) == 6.0
+    assert g.gain == 6.0
+
+def test_sweep_sends_pending_value_first(client, emulator, g):
+    g.gain = 3.0
+    g.gain.sweep(target=7.0, duration_ms=10, steps=4)
+    client.flush()
+    assert gain(emulator) == 7.0
+
+def test_clock_change_sends_pending_values_first(client, emulator, g):
+    g.gain = 3.0
+    g.set_clock(1)
+    assert gain(emulator) == 3.0
+
+def test_stop_coalescing_sends_pending_values(client, emulator, g):
+    g.gain = 3.0
+    client.stop_coalescing()
+    assert gain(emulator) == 3.0
+    g.gain = 4.0
+    assert gain(emulator) == 4.0
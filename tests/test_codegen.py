@@ -0,0 +1,65 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import types
+
+from conftest import close, connect
+from zrna.codegen import generate
+import zrna.zr_pb2 as zr
+
+def generated(client, version=None):
+    module = types.ModuleType('modules')
+    exec(generate(version or client.version, list(client._module_types.values()),
+                  client.module_schema()), module.__dict__)
+    return module
+
+def test_generated_classes_match_runtime_classes(client, emulator):
+    modules = generated(client)
+    static = connect(emulator, module_classes=modules)
+    try:
+        for name in client._module_types:
+            runtime_class = getattr(client, name)
+            static_class = getattr(static, name)
+            assert issubclass(static_class, getattr(modules, name))
+            for attr in ('type', 'parameters', 'options', 'outputs'):
+                assert getattr(static_class, attr) == getattr(runtime_class, attr)
+            assert static_class().inputs == runtime_class().inputs
+    finally:
+        close(static)
+
+def test_generated_classes_talk_to_the_device(client, emulator):
+    modules = generated(client)
+    static = connect(emulator, module_classes=modules)
+    try:
+        a = static.AudioIn()
+        g = static.GainInv(gain=2.0)
+        static.add(a)
+        static.add(g)
+        a.output1.connect(g.input)
+        g.gain = 3.0
+        g.output_phase = zr.Option.Value.Value('PHASE2')
+        module = emulator.circuit.modules[1]
+        assert module.parameters[0].requested == 3.0
+        assert module.options[0].value == zr.Option.Value.Value('PHASE2')
+        assert static.net_count() == 1
+    finally:
+        close(static)
+
+def test_other_firmware_versions_are_ignored(client, emulator):
+    modules = generated(client, version='0.0.1')
+    static = connect(emulator, module_classes=modules)
+    try:
+        assert not issubclass(static.GainInv, modules.GainInv)
+    finally:
+        close(static)
@@ -0,0 +1,101 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import numpy
+
+from zrna.diff import diff_circuits
+import zrna.zr_pb2 as zr
+
+def summary(circuit):
+    return ([(m.type,
+              sorted((p.id, p.requested) for p in m.parameters),
+              sorted((o.id, o.value) for o in m.options))
+             for m in circuit.modules],
+            sorted((n.output_address.module_id, n.output_address.output_id,
+                    n.input_address.module_id, n.input_address.input_id)
+                   for n in circuit.nets),
+            list(circuit.lookup_table.data))
+
+def build(client):
+    a = client.AudioIn()
+    g = client.GainInv(gain=2.0)
+    t = client.TransferFunction()
+    o = client.AudioOut()
+    for m in (a, g, t, o):
+        client.add(m)
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    t.lookup_table.push()
+    a.output1.connect(g.input)
+    g.output.connect(t.input)
+    t.output.connect(o.input1)
+    return a, g, t, o
+
+def test_unchanged_circuit_has_no_changes(client):
+    build(client)
+    assert client.diff(client.get('/circuit').circuit) == []
+
+def test_parameter_change(client):
+    a, g, t, o = build(client)
+    desired = client.get('/circuit').circuit
+    desired.modules[1].parameters[0].requested = 4.0
+    changes = client.diff(desired)
+    assert [(c.method, c.url) for c in changes] == [
+        ('PUT', '/circuit/module/1/parameter/gain/requested')]
+    client.apply(desired)
+    assert g.gain == 4.0
+    assert client.diff(desired) == []
+
+def test_apply_round_trip(client):
+    build(client)
+    desired = zr.Circuit()
+    desired.CopyFrom(client.get('/circuit').circuit)
+
+    # change a parameter, the table and the wiring, then drop the last
+    # two modules and add a different one in their place
+    a, g, t, o = client.module_instances
+    g.gain = 0.5
+    t.lookup_table.requested = numpy.zeros(256)
+    t.lookup_table.push()
+    g.output.disconnect()
+    client.remove(o)
+    client.remove(t)
+    client.add(client.FilterLowpass())
+    assert summary(client.get('/circuit').circuit) != summary(desired)
+
+    changes = client.apply(desired)
+    assert changes
+    assert summary(client.get('/circuit').circuit) == summary(desired)
+    assert [m.type_name for m in client.module_instances] == [
+        'AudioIn', 'GainInv', 'TransferFunction', 'AudioOut']
+    assert client.diff(desired) == []
+
+def test_removed_net_keeps_other_nets_into_the_input():
+    current = zr.Circuit()
+    for _ in range(3):
+        current.modules.add().type = zr.AnalogModule.Type.Value('GAIN_INV')
+    for output_module in (0, 1):
+        n = current.nets.add()
+        n.output_address.module_id = output_module
+        n.output_address.output_id = zr.OutputId.Value('OUTPUT')
+        n.input_address.module_id = 2
+        n.input_address.input_id = zr.InputId.Value('INPUT')
+    desired = zr.Circuit()
+    desired.CopyFrom(current)
+    del desired.nets[0]
+
+    changes = diff_circuits(current, desired, lambda m: False)
+    assert [(c.method, c.url) for c in changes] == [
+        ('POST', '/circuit/module/2/inputs/input/disconnect'),
+        ('POST', '/circuit/nets')]
+    assert changes[1].payload == desired.nets[0]
@@ -0,0 +1,65 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import pytest
+
+from zrna.api import ZrnaException
+import zrna.zr_pb2 as zr
+
+def test_add_and_write_parameter(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    g.gain = 2.5
+    assert len(emulator.circuit.modules) == 1
+    assert emulator.circuit.modules[0].parameters[0].requested == 2.5
+    assert g.gain.realized == 2.5
+
+def test_error_status_raises(client):
+    with pytest.raises(ZrnaException):
+        client.get('/circuit/module/3')
+
+def test_store_and_load(client, emulator):
+    client.add(client.GainInv())
+    client.store('saved')
+    assert 'saved' in emulator.stored
+    client.clear()
+    assert client.module_instances == []
+    client.load('saved')
+    assert [m.type_name for m in client.module_instances] == ['GainInv']
+
+def test_endpoints(client):
+    endpoints = client.endpoints().endpoint
+    assert endpoints
+    assert all(len(e.method) == 1 for e in endpoints)
+    assert '/circuit' in [e.docstring for e in endpoints]
+
+def test_phase_mismatch(client):
+    g = client.GainInv(output_phase=zr.Option.Value.Value('PHASE2'))
+    g2 = client.GainInv()
+    client.add(g)
+    client.add(g2)
+    with pytest.raises(ZrnaException):
+        g.output.connect(g2.input)
+    g2.output.connect(g.input)
+    assert client.net_count() == 1
+
+def test_patch_rejects_invalid_option_values(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    with pytest.raises(ZrnaException):
+        g.update(gain=2.0, output_phase=12345)
+    assert emulator.circuit.modules[0].options[0].value != 12345
+    assert emulator.circuit.modules[0].parameters[0].requested == 1.0
+    client._sync()
+    assert client.module_instances[0].output_phase == g.output_phase
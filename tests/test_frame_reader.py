@@ -0,0 +1,80 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import os
+
+from cobs import cobs
+from zrna.util import FrameReader
+import zrna.zr_pb2 as zr
+
+class ChunkedPort(object):
+    # Hands out one chunk per read(). An empty chunk is a read that timed
+    # out without data.
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        self.reads += 1
+        chunk = self.chunks.pop(0)
+        if len(chunk) > size:
+            self.chunks.insert(0, chunk[size:])
+        return chunk[:size]
+
+def framed(payload):
+    return cobs.encode(payload) + b'\x00'
+
+def test_frame_split_across_reads():
+    payload = os.urandom(100)
+    data = framed(payload)
+    reader = FrameReader(ChunkedPort(data[:1], data[1:40], data[40:-1], data[-1:]))
+    assert reader.read() == payload
+
+def test_several_frames_in_one_read():
+    payloads = [b'\x01\x02', b'', b'\x00\x00\x03']
+    data = b''.join(framed(p) for p in payloads)
+    last = framed(b'\x04')
+    port = ChunkedPort(data + last[:1], last[1:])
+    reader = FrameReader(port)
+    assert [reader.read() for _ in payloads] == payloads
+    assert port.reads == 1
+    assert reader.read() == b'\x04'
+    assert port.reads == 2
+    assert not reader.buffer
+
+def test_empty_reads_are_retried():
+    payload = b'\x05' * 10
+    data = framed(payload)
+    port = ChunkedPort(b'', data[:4], b'', b'', data[4:])
+    reader = FrameReader(port)
+    assert reader.read() == payload
+    assert port.reads == 5
+
+def test_maximum_length_frames():
+    # COBS splits data into blocks of at most 254 bytes, so the sizes
+    # around that boundary are the ones worth covering, along with the
+    # largest response the client reads: a full lookup table.
+    response = zr.Response()
+    response.lookup_table.data[:] = [0.5] * 256
+    payloads = [b'\x01' * n for n in (253, 254, 255, 508, 509)]
+    payloads.append(response.SerializeToString())
+    data = b''.join(framed(p) for p in payloads)
+    reader = FrameReader(ChunkedPort(data[:300], data[300:]))
+    assert [reader.read() for _ in payloads] == payloads
+    assert not reader.buffer
@@ -0,0 +1,105 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import os
+
+from zrna.instrument import BUCKETS, Aggregator, PrometheusFile, Sample
+
+def ping(wire):
+    return Sample('GET /ping', 4, 10, 0.0, wire, 0.25)
+
+def put(wire):
+    return Sample('PUT /circuit/module/<n>/parameter/gain/requested', 20, 2, 0.0, wire, 0.0)
+
+def test_aggregator_counters_and_timings():
+    aggregator = Aggregator()
+    for sample in (ping(0.5), ping(0.5), put(2.0)):
+        aggregator(sample)
+    [(slowest, put_stats), (fastest, ping_stats)] = aggregator.by_total_time()
+    assert slowest == 'PUT /circuit/module/<n>/parameter/gain/requested'
+    assert fastest == 'GET /ping'
+    assert (ping_stats.count, ping_stats.bytes_sent, ping_stats.bytes_received) == (2, 8, 20)
+    assert (put_stats.count, put_stats.bytes_sent, put_stats.bytes_received) == (1, 20, 2)
+    assert ping_stats.timings['wire'].sum == 1.0
+    assert ping_stats.timings['decode'].sum == 0.5
+    assert ping_stats.timings['total'].sum == 1.5
+    assert ping_stats.timings['total'].count == 2
+    assert ping_stats.timings['total'].quantile(0.99) == 1.0
+    assert put_stats.timings['total'].quantile(0.5) == float('inf')
+    lines = aggregator.report().splitlines()
+    assert lines[0].split() == ['endpoint', 'count', 'sent', 'received', 'total',
+                                'ms', 'wire', 'ms', 'p99', 'ms']
+    assert lines[2].split() == ['GET', '/ping', '2', '8', '20', '1500.00', '1000.00', '1000.00']
+    aggregator.reset()
+    assert aggregator.by_total_time() == []
+
+def test_requests_are_recorded(client):
+    aggregator = Aggregator()
+    client.instrument(aggregator)
+    g = client.GainInv()
+    client.add(g)
+    g.gain = 2.0
+    g.gain.bind_writer()(3.0)
+    client.stop_instrumenting()
+    client.ping()
+    stats = dict(aggregator.by_total_time())
+    assert stats['PUT /circuit/module/<n>/parameter/gain/requested'].count == 2
+    assert stats['POST /circuit/modules'].count == 1
+    assert 'GET /ping' not in stats
+    put = client.connection._put_request('/circuit/module/0/parameter/gain/requested', 2.0)
+    assert (stats['PUT /circuit/module/<n>/parameter/gain/requested'].bytes_sent ==
+            2 * len(put.SerializeToString()))
+
+def histogram(labels, first_bucket, count, total):
+    # count observations, all in the bucket at index first_bucket
+    bounds = ['0.0001', '0.00025', '0.0005', '0.001', '0.0025', '0.005', '0.01',
+              '0.025', '0.05', '0.1', '0.25', '0.5', '1.0', '+Inf']
+    assert len(bounds) == len(BUCKETS)
+    lines = ['zrna_client_request_seconds_bucket{%s,le="%s"} %d' % (
+        labels, bound, count if i >= first_bucket else 0) for i, bound in enumerate(bounds)]
+    lines.append('zrna_client_request_seconds_sum{%s} %s' % (labels, total))
+    lines.append('zrna_client_request_seconds_count{%s} %d' % (labels, count))
+    return lines
+
+def test_prometheus_text(tmp_path):
+    path = str(tmp_path / 'zrna.prom')
+    prometheus = PrometheusFile(path, interval=3600)
+    prometheus(ping(0.5))
+    prometheus(ping(0.5))
+    labels = 'endpoint="GET /ping",phase="%s"'
+    expected = '\n'.join([
+        '# HELP zrna_client_requests_total Requests sent.',
+        '# TYPE zrna_client_requests_total counter',
+        'zrna_client_requests_total{endpoint="GET /ping"} 2',
+        '# HELP zrna_client_sent_bytes_total Serialized request bytes.',
+        '# TYPE zrna_client_sent_bytes_total counter',
+        'zrna_client_sent_bytes_total{endpoint="GET /ping"} 8',
+        '# HELP zrna_client_received_bytes_total Serialized response bytes.',
+        '# TYPE zrna_client_received_bytes_total counter',
+        'zrna_client_received_bytes_total{endpoint="GET /ping"} 20',
+        '# HELP zrna_client_request_seconds Request latency by phase.',
+        '# TYPE zrna_client_request_seconds histogram'] +
+        histogram(labels % 'encode', 0, 2, '0.0') +
+        histogram(labels % 'wire', 11, 2, '1.0') +
+        histogram(labels % 'decode', 10, 2, '0.5') +
+        histogram(labels % 'total', 12, 2, '1.5')) + '\n'
+    assert prometheus.exposition() == expected
+    # the first sample writes the file; the second is within the interval
+    with open(path) as f:
+        assert 'zrna_client_requests_total{endpoint="GET /ping"} 1\n' in f.read()
+    prometheus.write()
+    with open(path) as f:
+        assert f.read() == expected
+    assert os.listdir(str(tmp_path)) == ['zrna.prom']
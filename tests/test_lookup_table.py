@@ -0,0 +1,92 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import numpy
+import pytest
+
+from zrna.api import LookupTable, ZrnaException
+import zrna.zr_pb2 as zr
+
+@pytest.mark.parametrize('table', [
+    numpy.zeros(255), numpy.zeros(257), numpy.zeros((2, 256)), numpy.zeros((256, 1)),
+    numpy.full(256, numpy.nan), numpy.full(256, numpy.inf), 0.5])
+def test_requested_rejects_malformed_tables(table):
+    lookup_table = LookupTable(None, None)
+    with pytest.raises(ValueError):
+        lookup_table.requested = table
+    assert not lookup_table.requested.any()
+
+def test_requested_is_packed_float32():
+    lookup_table = LookupTable(None, None)
+    lookup_table.requested = [0.25] * 256
+    assert lookup_table.requested.dtype == numpy.dtype('<f4')
+    assert lookup_table.requested.flags['C_CONTIGUOUS']
+
+def test_push_matches_put(client, emulator):
+    t = client.TransferFunction()
+    client.add(t)
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    message = zr.LookupTable()
+    message.data[:] = t.lookup_table.requested.tolist()
+    expected = client.connection._put_request(
+        '/circuit/module/0/lookup-table', message).SerializeToString()
+    assert t.lookup_table._serialize(0, t.lookup_table.requested.tobytes()) == expected
+    t.lookup_table.push()
+    assert emulator.lookup_tables[0] == message.data[:]
+
+def test_push_if_changed(client, emulator):
+    t = client.TransferFunction()
+    client.add(t)
+    assert not t.lookup_table.dirty
+    before = emulator.request_count
+    t.lookup_table.push_if_changed()
+    assert emulator.request_count == before
+
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    assert t.lookup_table.dirty
+    t.lookup_table.push_if_changed()
+    assert emulator.request_count == before + 1
+    assert not t.lookup_table.dirty
+    assert numpy.allclose(t.lookup_table.realized, numpy.linspace(-1, 1, 256))
+
+def test_failed_push_stays_dirty(client):
+    t = client.TransferFunction()
+    client.add(t)
+    client.delete('/circuit/module/%d' % t.id)
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    with pytest.raises(ZrnaException):
+        t.lookup_table.push()
+    assert t.lookup_table.dirty
+
+def test_sync_records_the_device_table(client):
+    t = client.TransferFunction()
+    client.add(t)
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    t.lookup_table.push()
+    client.store('table')
+    client.clear()
+    client.load('table')
+    t = client.module_instances[0]
+    assert t.lookup_table.dirty
+    t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+    assert not t.lookup_table.dirty
+
+def test_remove_renumbers_pushed_tables(client):
+    g = client.GainInv()
+    t = client.TransferFunction()
+    client.add(g)
+    client.add(t)
+    client.remove(g)
+    assert t.id == 0
+    assert not t.lookup_table.dirty
@@ -0,0 +1,58 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import pytest
+
+from zrna.api import ZrnaException
+
+def test_matches_put(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    w = g.gain.bind_writer()
+    w(2.5)
+    assert emulator.circuit.modules[0].parameters[0].requested == 2.5
+    assert g.gain == 2.5
+    expected = client.connection._put_request(
+        '/circuit/module/0/parameter/gain/requested', 2.5).SerializeToString()
+    assert w.prefix + w.requested_format.pack(2.5) == expected
+
+def test_module_not_added(client):
+    w = client.GainInv().gain.bind_writer()
+    with pytest.raises(ZrnaException):
+        w(2.0)
+
+def test_follows_renumbered_module(client, emulator):
+    a = client.GainInv()
+    g = client.GainInv()
+    client.add(a)
+    client.add(g)
+    w = g.gain.bind_writer()
+    w(2.0)
+    client.remove(a)
+    w(3.0)
+    assert emulator.circuit.modules[0].parameters[0].requested == 3.0
+
+def test_joins_transaction(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    w = g.gain.bind_writer()
+    before = emulator.request_count
+    with client.transaction():
+        w(4.0)
+        assert emulator.circuit.modules[0].parameters[0].requested == 1.0
+    # GET /circuit on entry, POST /circuit and the resync on exit
+    assert emulator.request_count - before == 3
+    assert emulator.circuit.modules[0].parameters[0].requested == 4.0
+    assert client.module_instances[0].gain == 4.0
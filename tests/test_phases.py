@@ -0,0 +1,53 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import zrna.zr_pb2 as zr
+
+def test_phases_are_cached(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    assert g.output.phase == 'PHASE1'
+    before = emulator.request_count
+    assert g.output.phase == 'PHASE1'
+    assert emulator.request_count == before
+
+def test_option_write_changes_the_phase(client):
+    g = client.GainInv()
+    client.add(g)
+    assert g.output.phase == 'PHASE1'
+    g.output_phase = zr.Option.Value.Value('PHASE2')
+    assert g.output.phase == 'PHASE2'
+    g.update(output_phase=zr.Option.Value.Value('PHASE1'))
+    assert g.output.phase == 'PHASE1'
+
+def test_prefetch_then_wire_without_phase_requests(client, emulator):
+    a = client.AudioIn()
+    g = client.GainInv()
+    o = client.AudioOut()
+    for m in (a, g, o):
+        client.add(m)
+    client.prefetch_phases()
+    before = emulator.request_count
+    a.output1.connect(g.input)
+    g.output.connect(o.input1)
+    # only the two POST /circuit/nets
+    assert emulator.request_count - before == 2
+
+def test_clear_drops_cached_phases(client):
+    g = client.GainInv()
+    client.add(g)
+    client.prefetch_phases()
+    assert client._phases
+    client.clear()
+    assert client._phases == {}
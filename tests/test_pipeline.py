@@ -0,0 +1,120 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+from collections import deque
+import pytest
+import threading
+
+from cobs import cobs
+from zrna.util import FrameReader, Pipeline
+import zrna.zr_pb2 as zr
+
+class NumberingPort(object):
+    # Answers the nth request written with a response carrying n in
+    # module_count. read() hands out one response frame per call. Once
+    # fail_at responses have been read, the next read raises and drops
+    # whatever was still queued.
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.written = 0
+        self.read_count = 0
+        self.max_outstanding = 0
+        self.responses = deque()
+
+    def write(self, data):
+        request = zr.Request()
+        request.ParseFromString(cobs.decode(bytes(data[:-1])))
+        self.written += 1
+        response = zr.Response()
+        response.module_count = self.written
+        self.responses.append(cobs.encode(response.SerializeToString()) + b'\x00')
+        self.max_outstanding = max(self.max_outstanding, self.written - self.read_count)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.responses[0]) if self.responses else 0
+
+    def read(self, size=1):
+        assert self.responses, 'read with no response due'
+        if self.read_count == self.fail_at:
+            self.fail_at = None
+            self.responses.clear()
+            raise IOError('port closed')
+        self.read_count += 1
+        return self.responses.popleft()
+
+class FakeConnection(object):
+    def __init__(self, port):
+        self.connection = port
+        self.reader = FrameReader(port)
+        self.lock = threading.RLock()
+        self.instrument = None
+
+def request():
+    r = zr.Request()
+    r.method = zr.Method.Value('GET')
+    return r
+
+def lock_is_free(lock):
+    # RLock.acquire always succeeds on the thread that holds it
+    free = []
+    def try_acquire():
+        if lock.acquire(False):
+            lock.release()
+            free.append(True)
+    t = threading.Thread(target=try_acquire)
+    t.start()
+    t.join()
+    return bool(free)
+
+def test_responses_resolve_in_request_order():
+    port = NumberingPort()
+    with Pipeline(FakeConnection(port), window=4) as p:
+        pending = [p.submit(request()) for _ in range(10)]
+    assert [r.result().module_count for r in pending] == list(range(1, 11))
+
+@pytest.mark.parametrize('window', [1, 3, 8])
+def test_window_limits_requests_in_flight(window):
+    port = NumberingPort()
+    connection = FakeConnection(port)
+    p = Pipeline(connection, window)
+    pending = [p.submit(request()) for _ in range(20)]
+    assert not lock_is_free(connection.lock)
+    p.flush()
+    assert port.max_outstanding == window
+    assert all(r.done() for r in pending)
+    assert lock_is_free(connection.lock)
+
+def test_read_error_drops_requests_in_flight():
+    port = NumberingPort(fail_at=2)
+    connection = FakeConnection(port)
+    p = Pipeline(connection, window=8)
+    pending = [p.submit(request()) for _ in range(5)]
+    assert pending[1].result().module_count == 2
+    with pytest.raises(IOError):
+        pending[2].result()
+    assert not p.in_flight
+    assert lock_is_free(connection.lock)
+    for r in pending[2:]:
+        assert r.done()
+        with pytest.raises(IOError):
+            r.result()
+    # later requests pair with their own responses
+    assert p.submit(request()).result().module_count == 6
+
+def test_window_must_be_positive():
+    with pytest.raises(ValueError):
+        Pipeline(FakeConnection(NumberingPort()), window=0)
@@ -0,0 +1,88 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import os
+
+from conftest import close
+from zrna.api import Client
+from zrna.util import (ModuleSchema, load_module_schema, save_module_schema,
+                       schema_cache_path)
+import zrna.zr_pb2 as zr
+
+VERSION = '1.2.3'
+
+def gain_inv():
+    module = zr.AnalogModule()
+    module.type = zr.AnalogModule.Type.Value('GAIN_INV')
+    p = module.parameters.add()
+    p.id = zr.Parameter.Id.Value('GAIN')
+    p.requested = 1.0
+    inputs = zr.Inputs()
+    inputs.input.add().id = zr.InputId.Value('INPUT')
+    outputs = zr.Outputs()
+    outputs.output.append(zr.OutputId.Value('OUTPUT'))
+    return ModuleSchema(module.type, module, inputs, outputs)
+
+def test_hit(tmp_path):
+    directory = str(tmp_path / 'cache')
+    schema = [gain_inv()]
+    module_types = [s.type for s in schema]
+    save_module_schema(directory, VERSION, module_types, schema)
+    assert load_module_schema(directory, VERSION) == (module_types, schema)
+
+def test_miss(tmp_path):
+    assert load_module_schema(str(tmp_path / 'cache'), VERSION) is None
+
+def test_firmware_version_change(tmp_path):
+    directory = str(tmp_path)
+    schema = [gain_inv()]
+    save_module_schema(directory, VERSION, [s.type for s in schema], schema)
+    assert load_module_schema(directory, '1.2.4') is None
+    # a file that doesn't hold the version its name says is ignored too
+    os.rename(schema_cache_path(directory, VERSION), schema_cache_path(directory, '1.2.4'))
+    assert load_module_schema(directory, '1.2.4') is None
+
+def test_corrupt_cache_file(tmp_path):
+    directory = str(tmp_path)
+    schema = [gain_inv()]
+    save_module_schema(directory, VERSION, [s.type for s in schema], schema)
+    path = schema_cache_path(directory, VERSION)
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text[:len(text) // 2])
+    assert load_module_schema(directory, VERSION) is None
+    with open(path, 'w') as f:
+        f.write(text.replace('GAIN_INV', 'NOT_A_MODULE'))
+    assert load_module_schema(directory, VERSION) is None
+
+def connect(emulator, schema_cache):
+    client = Client()
+    client.connect(device_path=emulator.device_path, schema_cache=schema_cache)
+    return client
+
+def requests_for_class(client, emulator):
+    before = emulator.request_count
+    client.GainInv()
+    close(client)
+    return emulator.request_count - before
+
+def test_client_uses_the_cache(emulator, tmp_path):
+    cache = str(tmp_path)
+    assert requests_for_class(connect(emulator, cache), emulator) > 0
+    assert os.path.exists(schema_cache_path(cache, emulator.version))
+    assert requests_for_class(connect(emulator, cache), emulator) == 0
+    emulator.version = '0.0.1'
+    assert requests_for_class(connect(emulator, cache), emulator) > 0
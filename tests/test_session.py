@@ -0,0 +1,85 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import pytest
+
+from conftest import close, connect
+from zrna.api import Client
+from zrna.session import REQUEST, RESPONSE, ReplayError, ReplayPort, read_session
+
+def patch(client):
+    a = client.AudioIn()
+    g = client.GainInv()
+    for m in (a, g):
+        client.add(m)
+    a.output1.connect(g.input)
+    g.gain = 2.0
+    return g.gain.realized, str(client.circuit())
+
+@pytest.fixture
+def session(emulator, tmp_path):
+    path = str(tmp_path / 'session.zrs')
+    client = connect(emulator, record=path)
+    recorded = patch(client)
+    close(client)
+    return path, recorded
+
+def replay(path, **kwargs):
+    client = Client()
+    client.connect(device_path=ReplayPort(path, speed=None), interface='replay', **kwargs)
+    return client
+
+def test_every_request_has_a_response(session):
+    # pipelined requests are logged ahead of their responses
+    path, _ = session
+    directions = [direction for direction, _, _ in read_session(path)]
+    assert directions[0] == REQUEST
+    assert directions.count(REQUEST) == directions.count(RESPONSE)
+
+def test_replay(session):
+    path, recorded = session
+    assert patch(replay(path)) == recorded
+
+def test_replay_ignores_the_schema_cache(session, tmp_path):
+    path, recorded = session
+    cache = str(tmp_path / 'cache')
+    assert patch(replay(path, schema_cache=cache)) == recorded
+
+def test_replay_at_recorded_speed(session):
+    path, recorded = session
+    client = Client()
+    client.connect(device_path=path, interface='replay')
+    assert patch(client) == recorded
+
+def test_mismatch(session):
+    path, _ = session
+    client = replay(path)
+    a = client.AudioIn()
+    g = client.GainInv()
+    client.add(a)
+    client.add(g)
+    a.output1.connect(g.input)
+    with pytest.raises(ReplayError) as e:
+        g.gain = 3.0
+    message = str(e.value)
+    assert 'PUT /circuit/module/1/parameter/gain/requested' in message
+    assert 'requested: 3.0' in message
+    assert 'requested: 2.0' in message
+
+def test_past_the_end(session):
+    path, _ = session
+    client = replay(path)
+    patch(client)
+    with pytest.raises(ReplayError):
+        client.ping()
@@ -0,0 +1,72 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import zrna.zr_pb2 as zr
+
+def requests(emulator, f):
+    before = emulator.request_count
+    result = f()
+    return result, emulator.request_count - before
+
+def test_reads_are_served_from_the_shadow(client, emulator):
+    g = client.GainInv(gain=2.0)
+    client.add(g)
+    client.refresh_parameters()
+    assert requests(emulator, lambda: g.gain.realized) == (2.0, 0)
+    assert requests(emulator, lambda: g.gain.maximum) == (100.0, 0)
+
+def test_parameter_write_invalidates(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    client.refresh_parameters()
+    g.gain = 3.0
+    assert requests(emulator, lambda: g.gain.realized) == (3.0, 1)
+    assert requests(emulator, lambda: g.gain.realized) == (3.0, 0)
+
+def test_update_and_writer_invalidate(client):
+    g = client.GainInv()
+    client.add(g)
+    client.refresh_parameters()
+    g.update(gain=4.0)
+    assert g.gain.realized == 4.0
+    write = g.gain.bind_writer()
+    write(5.0)
+    assert g.gain.realized == 5.0
+
+def test_option_write_invalidates_the_module(client):
+    g = client.GainInv()
+    f = client.FilterLowpass()
+    client.add(g)
+    client.add(f)
+    client.refresh_parameters()
+    g.output_phase = zr.Option.Value.Value('PHASE2')
+    assert (g.id, 'gain') not in client._shadow
+    assert (f.id, 'corner_frequency') in client._shadow
+
+def test_listened_parameters_are_always_fetched(client, emulator):
+    g = client.GainInv()
+    client.add(g)
+    g.gain.listen(midi=client.CC, min=0.0, max=2.0)
+    client.refresh_parameters()
+    assert requests(emulator, lambda: g.gain.realized)[1] == 1
+    assert requests(emulator, lambda: g.gain.realized)[1] == 1
+
+def test_remove_renumbers_the_shadow(client, emulator):
+    g = client.GainInv(gain=2.0)
+    g2 = client.GainInv(gain=7.0)
+    client.add(g)
+    client.add(g2)
+    client.refresh_parameters()
+    client.remove(g)
+    assert requests(emulator, lambda: g2.gain.realized) == (7.0, 0)
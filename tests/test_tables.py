@@ -0,0 +1,66 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+
+import numpy
+import pytest
+
+from zrna import tables
+from zrna.api import LookupTable
+
+BOUNDS = (-0.5, 0.5)
+
+@pytest.mark.parametrize('table', [
+    lambda bounds: tables.polynomial([0.0, 2.0], bounds=bounds),
+    lambda bounds: tables.chebyshev([0.0, 2.0], bounds=bounds),
+    lambda bounds: tables.piecewise([(-1.0, -2.0), (1.0, 2.0)], bounds=bounds),
+    lambda bounds: tables.sampled(lambda x: 2 * x, bounds=bounds),
+    lambda bounds: tables.interpolate(numpy.full(256, -2.0), numpy.full(256, 2.0),
+                                      0.9, bounds=bounds)])
+def test_clamped_to_bounds(table):
+    unclamped = table(None)
+    clamped = table(BOUNDS)
+    assert unclamped.max() > BOUNDS[1]
+    assert clamped.dtype == numpy.float32
+    assert clamped.min() >= BOUNDS[0] and clamped.max() <= BOUNDS[1]
+    assert clamped.max() == numpy.float32(BOUNDS[1])
+    inside = (unclamped >= BOUNDS[0]) & (unclamped <= BOUNDS[1])
+    assert numpy.array_equal(clamped[inside], unclamped[inside])
+
+def test_scalar_function_is_vectorized():
+    assert numpy.allclose(tables.sampled(lambda x: max(x, 0.0)),
+                          numpy.maximum(tables.inputs(), 0.0))
+
+@pytest.mark.parametrize('batch, expected', [
+    (lambda: tables.polynomial([[0, 1], [1, 0], [0, -1]]), [tables.inputs(), 1, -tables.inputs()]),
+    (lambda: tables.chebyshev([[0, 0, 1], [0, 1, 0]]), [2 * tables.inputs() ** 2 - 1, tables.inputs()]),
+    (lambda: tables.interpolate(numpy.zeros(256), numpy.ones(256), [0, 0.5, 1]), [0, 0.5, 1])])
+def test_batch_gives_one_table_per_row(batch, expected):
+    result = batch()
+    assert result.shape == (len(expected), tables.TABLE_SIZE)
+    assert result.dtype == numpy.float32
+    for row, e in zip(result, expected):
+        assert numpy.allclose(row, e)
+
+def test_single_table_shape():
+    assert tables.polynomial([0, 1]).shape == (tables.TABLE_SIZE,)
+    assert tables.interpolate(numpy.zeros(256), numpy.ones(256), 0.5).shape == (tables.TABLE_SIZE,)
+
+def test_lookup_table_takes_one_row_of_a_batch():
+    batch = tables.polynomial([[0, 1], [0, 0.25]], bounds=BOUNDS)
+    lookup_table = LookupTable(None, None)
+    with pytest.raises(ValueError):
+        lookup_table.requested = batch
+    lookup_table.requested = batch[1]
+    assert numpy.array_equal(lookup_table.requested, batch[1])
@@ -0,0 +1,84 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import numpy
+import pytest
+
+from zrna.api import ZrnaException
+
+def test_commit_uploads_once(client, emulator):
+    a = client.AudioIn()
+    client.add(a)
+    # built first, since building a class can fetch its schema
+    g = client.GainInv()
+    o = client.AudioOut()
+    before = emulator.request_count
+    with client.transaction():
+        client.add(g)
+        client.add(o)
+        a.output1.connect(g.input)
+        g.output.connect(o.input1)
+        g.gain = 3.0
+    # GET /circuit on entry, POST /circuit and the resync on exit
+    assert emulator.request_count - before == 3
+    assert [m.type_name for m in client.module_instances] == ['AudioIn', 'GainInv', 'AudioOut']
+    assert client.net_count() == 2
+    assert emulator.circuit.modules[1].parameters[0].requested == 3.0
+
+def test_rollback(client, emulator):
+    g = client.GainInv(gain=2.0)
+    client.add(g)
+    with pytest.raises(RuntimeError):
+        with client.transaction():
+            f = client.FilterLowpass()
+            client.add(f)
+            g.gain = 5.0
+            raise RuntimeError()
+    assert len(emulator.circuit.modules) == 1
+    assert client.module_instances == [g]
+    assert f.id is None
+    assert g.gain == 2.0
+    assert emulator.circuit.modules[0].parameters[0].requested == 2.0
+
+def test_lookup_table_push_joins_transaction(client):
+    with client.transaction():
+        t = client.TransferFunction()
+        client.add(t)
+        t.lookup_table.requested = numpy.linspace(-1, 1, 256)
+        t.lookup_table.push()
+    assert numpy.allclose(t.lookup_table.realized, numpy.linspace(-1, 1, 256))
+    assert not t.lookup_table.dirty
+
+def test_unsupported_inside_transaction(client):
+    g = client.GainInv()
+    client.add(g)
+    with client.transaction():
+        with pytest.raises(ZrnaException):
+            client.remove(g)
+        with pytest.raises(ZrnaException):
+            client.transaction().__enter__()
+
+def test_rejected_commit_resyncs(client, emulator):
+    g = client.GainInv(gain=2.0)
+    client.add(g)
+    with pytest.raises(ZrnaException):
+        with client.transaction():
+            client.add(client.FilterLowpass())
+            g.gain = 5.0
+            g.output_phase = 12345
+    assert len(emulator.circuit.modules) == 1
+    assert [m.type_name for m in client.module_instances] == ['GainInv']
+    g = client.module_instances[0]
+    assert g.gain == 2.0
+    assert g.output_phase == emulator.circuit.modules[0].options[0].value
@@ -0,0 +1,89 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import os
+import pytest
+import struct
+
+from zrna.update_firmware import FirmwareUpdateError, upload
+
+class FakeBootloader(object):
+    # Takes the size header, then acknowledges each packet once it has been
+    # written in full. read() returns nothing, like a serial read timing
+    # out, when no acknowledgement is due or after ack_limit of them.
+    def __init__(self, packet_size, ack_limit=None):
+        self.packet_size = packet_size
+        self.ack_limit = ack_limit
+        self.size = None
+        self.received = bytearray()
+        self.packets_written = 0
+        self.acked = 0
+        self.max_outstanding = 0
+
+    def write(self, data):
+        if self.size is None:
+            self.size = struct.unpack('>I', data)[0]
+            return len(data)
+        assert len(data) <= self.packet_size
+        self.received.extend(data)
+        self.packets_written += 1
+        self.max_outstanding = max(self.max_outstanding, self.packets_written - self.acked)
+        return len(data)
+
+    def _due(self):
+        complete = len(self.received) // self.packet_size
+        if len(self.received) == self.size and len(self.received) % self.packet_size:
+            complete += 1
+        if self.ack_limit is not None:
+            complete = min(complete, self.ack_limit)
+        return complete - self.acked
+
+    @property
+    def in_waiting(self):
+        return self._due()
+
+    def read(self, size=1):
+        count = min(size, self._due())
+        self.acked += count
+        return b'\x01' * count
+
+@pytest.mark.parametrize('size', [1, 64, 1000, 1024 + 1])
+@pytest.mark.parametrize('window', [1, 3, 16])
+def test_upload(size, window):
+    image = os.urandom(size)
+    port = FakeBootloader(64)
+    progress = []
+    acked = upload(port, image, window, packet_size=64,
+                   progress=lambda done, total: progress.append((done, total)))
+    packet_count = (size + 63) // 64
+    assert acked == packet_count
+    assert port.size == size
+    assert bytes(port.received) == image
+    assert port.max_outstanding == min(window, packet_count)
+    assert progress[-1] == (packet_count, packet_count)
+
+def test_missing_acknowledgement():
+    port = FakeBootloader(64, ack_limit=3)
+    with pytest.raises(FirmwareUpdateError) as e:
+        upload(port, os.urandom(640), 4, packet_size=64)
+    assert 'packet 4 of 10' in str(e.value)
+
+def test_window_must_be_positive():
+    with pytest.raises(ValueError):
+        upload(FakeBootloader(64), b'x', 0)
+
+def test_default_is_lockstep():
+    port = FakeBootloader(64)
+    assert upload(port, os.urandom(640), packet_size=64) == 10
+    assert port.max_outstanding == 1
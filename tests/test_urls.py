@@ -0,0 +1,94 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from zrna.util import compile_url, enum_value_inflect, to_path_name
+import zrna.zr_pb2 as zr
+
+def build_url(url_string):
+    # the uncached builder compile_url replaced
+    url = zr.URL()
+    for url_substring in filter(None, url_string.split('/')):
+        enum_inflected = enum_value_inflect(url_substring)
+        path_component_type = [
+            ('resource_id', (lambda: zr.PathComponent.ResourceId.Value(enum_inflected))),
+            ('module_type', (lambda: zr.AnalogModule.Type.Value(enum_inflected.replace('Lf', 'LF')))),
+            ('parameter_id', (lambda: zr.Parameter.Id.Value(enum_inflected))),
+            ('option_id', (lambda: zr.Option.Id.Value(enum_inflected))),
+            ('input_id', (lambda: zr.InputId.Value(enum_inflected))),
+            ('output_id', (lambda: zr.OutputId.Value(enum_inflected))),
+            ('system_option_id', (lambda: zr.SystemOption.Id.Value(enum_inflected))),
+            ('integer_argument', (lambda: int(url_substring)))
+        ]
+        component = url.path_components.add()
+        for name, from_string in path_component_type:
+            try:
+                setattr(component, name, from_string())
+                break
+            except ValueError:
+                continue
+        else:
+            component.string_argument = url_substring
+    return url
+
+IDS = (0, 1, 9, 10, 255, 256, 65535)
+CIRCUIT_NAMES = ('default', 'my-patch', 'patch1', '42')
+
+def names(enum_type):
+    return [to_path_name(name) for name in enum_type.keys()]
+
+def urls():
+    for url in ('/circuit', '/circuit/bytestream', '/circuit/default',
+                '/circuit/midi/listener', '/circuit/midi/listeners',
+                '/circuit/modules', '/circuit/modules/count', '/circuit/nets',
+                '/circuit/nets/count', '/circuit/update-bytestream', '/endpoints',
+                '/modules', '/ping', '/storage/circuit/startup', '/storage/circuits',
+                '/storage/debug', '/system/options', '/system/resource/analog',
+                '/system/resource/analog/clock', '/system/resource/analog/clock/default',
+                '/system/resource/analog/debug', '/system/resource/heap',
+                '/system/resource/storage', '/system/state', '/version'):
+        yield url
+    for module_type in names(zr.AnalogModule.Type):
+        for suffix in ('', '/inputs', '/outputs', '/analog', '/analog/fits'):
+            yield '/module/%s%s' % (module_type, suffix)
+    for name in CIRCUIT_NAMES:
+        yield '/storage/circuit/%s' % name
+        yield '/storage/circuit/%s/load' % name
+        yield '/storage/circuit/startup/%s' % name
+    for module_id in IDS:
+        module = '/circuit/module/%d' % module_id
+        for suffix in ('', '/clock', '/lookup-table'):
+            yield module + suffix
+        for parameter in names(zr.Parameter.Id):
+            for field in ('requested', 'realized', 'minimum', 'maximum', 'sweep'):
+                yield '%s/parameter/%s/%s' % (module, parameter, field)
+        for option in names(zr.Option.Id):
+            yield '%s/option/%s/value' % (module, option)
+        for input_id in names(zr.InputId):
+            yield '%s/inputs/%s/phase' % (module, input_id)
+            yield '%s/inputs/%s/disconnect' % (module, input_id)
+        for output_id in names(zr.OutputId):
+            yield '%s/outputs/%s/phase' % (module, output_id)
+            yield '%s/outputs/%s/disconnect' % (module, output_id)
+
+def test_compiled_urls_match_the_uncached_builder():
+    # twice, so the second pass is served from the caches
+    for _ in range(2):
+        for url in urls():
+            assert compile_url(url) == build_url(url), url
+
+def test_compiled_urls_are_not_shared_between_ids():
+    first = compile_url('/circuit/module/1/parameter/gain/requested')
+    second = compile_url('/circuit/module/2/parameter/gain/requested')
+    assert first.path_components[2].integer_argument == 1
+    assert second.path_components[2].integer_argument == 2
@@ -1 +1,6 @@
+import sys
+
 from .api import Client
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncClient
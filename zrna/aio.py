@@ -0,0 +1,458 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import asyncio
+import errno
+import os
+from cobs import cobs
+from collections import deque
+from google.protobuf.json_format import MessageToDict
+import numpy
+import serial
+
+from .api import CircuitSnapshot, Client, Storage, ZrnaException, table_bounds
+from .diff import diff_circuits
+from .util import Connection, ConnectionError, FrameReader, ModuleSchema
+from .util import DEFAULT_SCHEMA_CACHE
+from .util import find_device, ping_ok, to_class_name, to_path_name, version_string
+import zrna.zr_pb2 as zr
+
+class AsyncConnection(Connection):
+    # Shares the request builders with Connection, but every request
+    # returns a future instead of blocking. Frames are decoded from a
+    # loop.add_reader callback and resolve the oldest in-flight future.
+    # At most `window` requests are written ahead of their responses;
+    # the rest wait in a backlog.
+    def __init__(self, device_path=None, debug=False, window=8, loop=None):
+        self.debug = debug
+        # requests resolve from the reader callback, so they aren't
+        # instrumented
+        self.instrument = None
+        self.window = window
+        self.loop = loop or asyncio.get_event_loop()
+        self.connection = None
+        self.reader = FrameReader(None)
+        self.in_flight = deque()
+        self.backlog = deque()
+        if device_path is None:
+            device_path = find_device()
+        if device_path is not None:
+            self.connection = serial.Serial(device_path, timeout=0)
+
+    async def open(self):
+        if self.connection is None:
+            raise ConnectionError()
+        self.loop.add_reader(self.connection.fileno(), self._on_readable)
+        if not ping_ok(await self.get('/ping')):
+            self.close()
+            raise ConnectionError()
+
+    def close(self):
+        if self.connection is not None:
+            self.loop.remove_reader(self.connection.fileno())
+            self.connection.close()
+            self.connection = None
+        self._fail(ConnectionError())
+
+    def _fail(self, exception):
+        pending = list(self.in_flight) + [f for _, f in self.backlog]
+        self.in_flight.clear()
+        self.backlog.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(exception)
+
+    def _write(self, frame, future):
+        self.connection.write(frame)
+        self.in_flight.append(future)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.connection.fileno(), 4096)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close()
+            return
+        if not data:
+            self.close()
+            return
+
+        self.reader.feed(data)
+        frame = self.reader.next_frame()
+        while frame is not None:
+            if self.in_flight:
+                future = self.in_flight.popleft()
+                if not future.cancelled():
+                    response = zr.Response()
+                    response.ParseFromString(frame)
+                    future.set_result(response)
+            frame = self.reader.next_frame()
+
+        while self.backlog and len(self.in_flight) < self.window:
+            self._write(*self.backlog.popleft())
+
+    def _send_serialized_and_await_response(self, payload):
+        frame = bytearray(cobs.encode(payload))
+        frame.append(0x00)
+        future = self.loop.create_future()
+        if len(self.in_flight) < self.window and not self.backlog:
+            self._write(frame, future)
+        else:
+            self.backlog.append((frame, future))
+        return future
+
+class AsyncStorage(Storage):
+    async def debug(self):
+        return self.zr._as_pretty_dict(await self.zr.get('/storage/debug'))
+
+    def __str__(self):
+        self.zr._error("use await client.storage.debug() on AsyncClient")
+
+class AsyncClient(Client):
+    # Requests are written as soon as they're issued and return futures,
+    # so independent requests overlap without any extra bookkeeping.
+    # Methods that read something out of a response are coroutines, as are
+    # Parameter realized, minimum and maximum, input and output phases,
+    # connect() and the lookup table's bounds and realized, e.g.
+    # await module.gain.realized or await gain.output.connect(out.input1).
+    #
+    # Assigning to a parameter or option of an added module, and listen(),
+    # send the request without waiting for it. An error response to one of
+    # those is raised from the next request or from drain(); use
+    # set_parameter/set_option to await the response directly.
+    def __init__(self):
+        super().__init__()
+        self._writes = set()
+        self._write_error = None
+
+    def _connected(self):
+        if self.connection is None:
+            self._error("issued request before connecting to remote device")
+        self._raise_write_error()
+        return self.connection
+
+    def _unawaited(self, future):
+        self._writes.add(future)
+        future.add_done_callback(self._write_done)
+        return future
+
+    def _write_done(self, future):
+        self._writes.discard(future)
+        if (self.connection is not None and not future.cancelled() and
+                future.exception() is not None and self._write_error is None):
+            self._write_error = future.exception()
+
+    def _raise_write_error(self):
+        if self._write_error is not None:
+            error, self._write_error = self._write_error, None
+            raise error
+
+    def flush(self):
+        self._raise_write_error()
+
+    async def drain(self):
+        # waits for every write that wasn't awaited
+        if self._writes:
+            await asyncio.wait(list(self._writes))
+        self._raise_write_error()
+
+    def _put_parameter(self, module_id, parameter_id, value):
+        return self._unawaited(Client._put_parameter(self, module_id, parameter_id, value))
+
+    def _put_option(self, module_id, option_id, value):
+        return self._unawaited(Client._put_option(self, module_id, option_id, value))
+
+    def _add_listener(self, listener):
+        return self._unawaited(Client._add_listener(self, listener))
+
+    def _checked(self, future):
+        checked = self.connection.loop.create_future()
+
+        def done(f):
+            if checked.cancelled():
+                return
+            if f.cancelled():
+                checked.cancel()
+            elif f.exception() is not None:
+                checked.set_exception(f.exception())
+            else:
+                try:
+                    self._is_ok(f.result())
+                    checked.set_result(f.result())
+                except ZrnaException as e:
+                    checked.set_exception(e)
+
+        future.add_done_callback(done)
+        return checked
+
+    def post(self, url, payload=None):
+        return self._checked(self._connected().post(url, payload))
+
+    def patch(self, url, payload, lookup_table=None):
+        return self._checked(self._connected().patch(url, payload, lookup_table))
+
+    def put(self, url, payload):
+        return self._checked(self._connected().put(url, payload))
+
+    def get(self, url):
+        return self._checked(self._connected().get(url))
+
+    def delete(self, url, filter_args=None):
+        return self._checked(self._connected().delete(url, filter_args))
+
+    def _send_serialized(self, payload, endpoint=None):
+        return self._checked(self._connected().send_serialized(payload))
+
+    def _completed(self, value):
+        future = self.connection.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def _table_pushed(self, module_id, digest, response):
+        # recorded once the PUT succeeds; this callback runs before the
+        # awaiting task resumes
+        def done(f):
+            if not f.cancelled() and f.exception() is None:
+                self._pushed_tables[module_id] = digest
+        response.add_done_callback(done)
+        return response
+
+    def pipeline(self, window=8):
+        self._error("AsyncClient requests are already pipelined")
+
+    def transaction(self):
+        self._error("transactions aren't available on AsyncClient")
+
+    async def diff(self, circuit):
+        return diff_circuits((await self.get('/circuit')).circuit, circuit,
+                             self._has_lookup_table)
+
+    async def apply(self, circuit):
+        changes = await self.diff(circuit)
+        requests = []
+        for change in changes:
+            send = getattr(self, change.method.lower())
+            if change.payload is None:
+                requests.append(send(change.url))
+            else:
+                requests.append(send(change.url, change.payload))
+        await asyncio.gather(*requests)
+        await self._sync()
+        return changes
+
+    def coalesce(self, max_rate=100.0):
+        self._error("write coalescing relies on a background thread and isn't available on AsyncClient")
+
+    def instrument(self, *sinks):
+        self._error("instrumentation isn't available on AsyncClient")
+
+    async def connect(self, device_path=None, debug=False, window=8,
+                      schema_cache=DEFAULT_SCHEMA_CACHE):
+        connection = AsyncConnection(device_path=device_path, debug=debug,
+                                     window=window)
+        await connection.open()
+        self._write_error = None
+        self.connection = connection
+        await self._enumerate_modules(schema_cache)
+        await self._sync()
+        await self.pause()
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            connection.close()
+        self._writes = set()
+        self._write_error = None
+
+    async def get_version(self):
+        return version_string(await self.get('/version'))
+
+    @property
+    def version(self):
+        return self.get_version()
+
+    async def _enumerate_modules(self, schema_cache=None):
+        # Module classes can't fetch their schema from inside an attribute
+        # access here, so everything the cache is missing is fetched up
+        # front. The classes themselves are still built on first access.
+        version = await self.get_version() if schema_cache is not None else None
+        if not self._load_module_types(schema_cache, version):
+            self._set_module_types((await self.get('/modules')).module_types.module_type)
+        missing = self._missing_module_types()
+        if missing:
+            self._store_module_schema(await self._fetch_module_schema(missing))
+
+    async def module_schema(self):
+        missing = self._missing_module_types()
+        if missing:
+            self._store_module_schema(await self._fetch_module_schema(missing))
+        return [self._module_schema[t] for t in self._module_types.values()]
+
+    async def _fetch_module_schema(self, module_types):
+        requests = []
+        for moduleType in module_types:
+            path_name = to_path_name(zr.AnalogModule.Type.Name(moduleType))
+            requests.extend([self.get('/module/%s' % path_name),
+                             self.get('/module/%s/inputs' % path_name),
+                             self.get('/module/%s/outputs' % path_name)])
+        responses = await asyncio.gather(*requests)
+
+        schema = []
+        for i, moduleType in enumerate(module_types):
+            module, inputs, outputs = responses[3 * i:3 * i + 3]
+            schema.append(ModuleSchema(moduleType, module.modules.module[0],
+                                       inputs.inputs, outputs.outputs))
+        return schema
+
+    async def _sync(self):
+        self._load_circuit((await self.get('/circuit')).circuit)
+
+    async def _parameter_state(self, module_id, parameter_id, field):
+        value = self._shadowed_state(module_id, parameter_id, field)
+        if value is not None:
+            return value
+        return self._store_parameter_state(
+            module_id, parameter_id, field,
+            await self.get(self._parameter_state_url(module_id, parameter_id, field)))
+
+    async def refresh_parameters(self):
+        self._fill_shadow((await self.get('/circuit')).circuit)
+
+    async def snapshot(self):
+        circuit = (await self.get('/circuit')).circuit
+        self._fill_shadow(circuit)
+        return CircuitSnapshot(circuit)
+
+    async def _get_phase(self, module_id, io_id, input_or_output):
+        phase = self._cached_phase(module_id, io_id, input_or_output)
+        if phase is not None:
+            return phase
+        return self._store_phase(
+            module_id, io_id, input_or_output,
+            await self.get(self._phase_url(module_id, io_id, input_or_output)))
+
+    async def prefetch_phases(self):
+        keys = list(self._phase_keys())
+        responses = await asyncio.gather(*[self.get(self._phase_url(*key)) for key in keys])
+        for key, response in zip(keys, responses):
+            self._store_phase(*(key + (response,)))
+
+    async def _connect(self, output, input):
+        output_phase, input_phase = await asyncio.gather(output.phase, input.phase)
+        self._assert_phase_ok(output_phase, input_phase)
+        await self._add_net(output.module.id, output.output_id,
+                            input.module.id, input.input_id)
+        output.connected_to = input
+        input.connected_to = output
+
+    async def module_instance_count(self):
+        return (await self.get('/circuit/modules/count')).module_count
+
+    async def add(self, module):
+        if module.id is not None:
+            self._error("tried to add a module already present in circuit")
+        module.id = await self.module_instance_count()
+        await self.post('/circuit/modules', self._module_message(module))
+        self.module_instances.append(module)
+
+        if hasattr(module, 'lookup_table'):
+            await module.lookup_table.push()
+
+    async def remove(self, module):
+        if module.id is None or module not in self.module_instances:
+            self._error("tried to remove a module not present in current circuit")
+        await self.delete('/circuit/module/%d' % module.id)
+        self._renumber_module_state(module.id)
+        self._invalidate_phases()
+        self.module_instances.remove(module)
+        module.id = None
+        for i, module_instance in enumerate(self.module_instances):
+            module_instance.id = i
+
+    async def set_parameter(self, module, parameter_id, value):
+        if parameter_id not in module._parameter_set:
+            self._error("%s doesn't have %s as a parameter" % (module.type_name, parameter_id))
+        if module.id is not None:
+            await Client._put_parameter(self, module.id, parameter_id, value)
+        module._store(parameter_id, value)
+
+    async def set_option(self, module, option_id, value):
+        if option_id not in module._option_set:
+            self._error("%s doesn't have %s as an option" % (module.type_name, option_id))
+        if module.id is None:
+            setattr(module, option_id, value)
+            return
+        await Client._put_option(self, module.id, option_id, value)
+        module._store(option_id, value)
+
+    async def clear(self):
+        await self.post('/circuit/default')
+        await self._sync()
+
+    async def load(self, circuit_name):
+        await self.post('/storage/circuit/%s/load' % circuit_name)
+        await self._sync()
+
+    async def _module_fits(self, module_type):
+        return (await self.get(self._module_type_url(module_type, 'analog/fits'))).module_fits
+
+    async def _analog_info(self, module_type):
+        return self._as_pretty_dict(
+            (await self.get(self._module_type_url(module_type, 'analog'))).analog_info)
+
+    async def _get_lookup_table_bounds(self, module):
+        if module.type not in self._lookup_table_bounds:
+            self._lookup_table_bounds[module.type] = table_bounds(
+                (await self.get(self._lookup_table_url(module))).lookup_table)
+        return self._lookup_table_bounds[module.type]
+
+    async def _get_realized_lookup_table(self, module_id):
+        if module_id is not None:
+            return numpy.array(
+                (await self.get('/circuit/module/%d/lookup-table' % module_id)).lookup_table.data,
+                dtype=numpy.float32)
+        return None
+
+    async def free_analog_resources(self):
+        return self._as_pretty_dict(await self.get('/system/resource/analog'))
+
+    async def debug_analog_resources(self):
+        return self._as_pretty_dict(await self.get('/system/resource/analog/debug'))
+
+    async def nets(self):
+        return self._as_pretty_dict(await self.get('/circuit/nets'))
+
+    async def net_count(self):
+        return (await self.get('/circuit/nets/count')).net_count
+
+    async def endpoints(self):
+        return (await self.get('/endpoints')).endpoints
+
+    async def modules(self):
+        return list(map(to_class_name, MessageToDict(
+            (await self.get('/modules')).module_types)['moduleType']))
+
+    async def circuit(self):
+        return self._as_pretty_dict((await self.get('/circuit')).circuit)
+
+    async def system_options(self):
+        return self._as_pretty_dict((await self.get('/system/options')).system_options)
+
+    @property
+    def storage(self):
+        return AsyncStorage(self)
+
+    async def midi_listeners(self):
+        return self._as_pretty_dict((await self.get('/circuit/midi/listeners')).midi_listeners)
@@ -18,19 +18,31 @@ from builtins import (ascii, bytes, chr, dict, filter, hex, input,
                       int, map, next, oct, open, pow, range, round,
                       str, super, zip)
 
-from .util import Connection
+from .diff import apply_changes, diff_circuits
+from .instrument import Aggregator, Instrument, request_endpoint
+from .util import Connection, ModuleSchema, DEFAULT_SCHEMA_CACHE
+from .util import WIRE_TYPE_FIXED32, WIRE_TYPE_LENGTH_DELIMITED, encode_varint, field_tag
+from .util import load_module_schema, save_module_schema, version_string
+from .util import module_class_attributes, update_module, within_tolerance
 from .util import to_path_name, to_field_name, to_class_name
 from collections import OrderedDict
 from functools import wraps
 from google.protobuf import text_format
-from google.protobuf.json_format import MessageToDict, MessageToJson
+from google.protobuf.json_format import MessageToDict, MessageToJson, ParseDict
 from inflection import camelize
+import hashlib
 import json
+import numpy
 import pprint
+import struct
 import sys
 import textwrap
+import threading
+import time
 import zrna.zr_pb2 as zr
 
+monotonic = getattr(time, 'monotonic', time.time)
+
 class Input(object):
     def __init__(self, zr, module, input_id, enabled):
         self.zr = zr
@@ -40,26 +52,17 @@ class Input(object):
         self.connected_to = None
 
     def connect(self, module_output):
-        output_phase = module_output.phase
-        input_phase = self.phase
-        self.zr._assert_phase_ok(output_phase, input_phase)
-
-        self.zr._add_net(
-            module_output.module.id,
-            module_output.output_id,
-            self.module.id,
-            self.input_id)
-        self.connected_to = module_output
-        module_output.connected_to = self
+        return self.zr._connect(module_output, self)
 
     @property
     def phase(self):
         return self.zr._get_input_phase(self.module.id, self.input_id)
 
     def disconnect(self):
-        self.zr._disconnect_input(self.module.id, self.input_id)
+        response = self.zr._disconnect_input(self.module.id, self.input_id)
         self.connected_to.connected_to = None
         self.connected_to = None
+        return response
 
 class Output(object):
     def __init__(self, zr, module, output_id):
@@ -69,28 +72,23 @@ class Output(object):
         self.connected_to = None
 
     def connect(self, module_input):
-        output_phase = self.phase
-        input_phase = module_input.phase
-        self.zr._assert_phase_ok(output_phase, input_phase)
-
-        self.zr._add_net(
-            self.module.id,
-            self.output_id,
-            module_input.module.id,
-            module_input.input_id)
-        self.connected_to = module_input
-        module_input.connected_to = self
+        return self.zr._connect(self, module_input)
 
     @property
     def phase(self):
         return self.zr._get_output_phase(self.module.id, self.output_id)
 
     def disconnect(self):
-        self.zr._disconnect_output(self.module.id, self.output_id)
+        response = self.zr._disconnect_output(self.module.id, self.output_id)
         self.connected_to.connected_to = None
         self.connected_to = None
+        return response
 
 class Parameter(float):
+    # Instances are cached on their module and replaced whenever the value
+    # changes, since floats are immutable.
+    __slots__ = ('zr', 'module', 'parameter_id', 'dummy_value')
+
     def __new__(self, zr, module, parameter_id, value):
         return float.__new__(self, value)
 
@@ -117,7 +115,7 @@ class Parameter(float):
             listener.trigger.parameter_value = self.dummy_value
         elif kwargs.get('midi') == self.zr.Gate:
             listener.gate.parameter_value_open = self.dummy_value
-        self.zr.delete('/circuit/midi/listener', listener)
+        return self.zr.delete('/circuit/midi/listener', listener)
 
     def listen(self, **kwargs):
         listener = zr.MidiListener()
@@ -145,7 +143,7 @@ class Parameter(float):
             listener.gate.parameter_value_closed = kwargs['closed']
 
         if listener.WhichOneof('type') is not None:
-            self.zr.post('/circuit/midi/listeners', listener)
+            self.zr._add_listener(listener)
         return self
 
     def sweep(self, **kwargs):
@@ -157,8 +155,14 @@ class Parameter(float):
         s.target_value = kwargs['target']
         s.duration_microseconds = kwargs['duration_ms'] * 1000
         s.step_count = kwargs['steps']
-        self.zr.post('/circuit/module/%d/parameter/%s/sweep' %
-                     (self.module.id, to_path_name(self.parameter_id)), s)
+        # a coalesced write of this parameter would land mid-sweep
+        self.zr.flush()
+        self.zr._start_sweep(self.module.id, self.parameter_id)
+        return self.zr.post('/circuit/module/%d/parameter/%s/sweep' %
+                            (self.module.id, to_path_name(self.parameter_id)), s)
+
+    def bind_writer(self):
+        return ParameterWriter(self.zr, self.module, self.parameter_id)
 
     @property
     def requested(self):
@@ -166,27 +170,266 @@ class Parameter(float):
 
     @property
     def realized(self):
-        response = self.zr.get('/circuit/module/%d/parameter/%s/realized' %
-                               (self.module.id, to_path_name(self.parameter_id)))
-        return response.realized
+        return self.zr._parameter_state(self.module.id, self.parameter_id, 'realized')
 
     @property
     def maximum(self):
-        response = self.zr.get('/circuit/module/%d/parameter/%s/maximum' %
-                               (self.module.id, to_path_name(self.parameter_id)))
-        return response.maximum
+        return self.zr._parameter_state(self.module.id, self.parameter_id, 'maximum')
 
     @property
     def minimum(self):
-        response = self.zr.get('/circuit/module/%d/parameter/%s/minimum' %
-                               (self.module.id, to_path_name(self.parameter_id)))
-        return response.minimum
+        return self.zr._parameter_state(self.module.id, self.parameter_id, 'minimum')
+
+class ParameterWriter(object):
+    # Serializes the PUT .../parameter/<id>/requested request once and
+    # only appends the fixed32 'requested' field on each write. Fields are
+    # serialized in field number order, so the result matches what
+    # Connection.put would produce.
+    requested_tag = field_tag(zr.Request, 'requested', WIRE_TYPE_FIXED32)
+    requested_format = struct.Struct('<f')
+
+    def __init__(self, zr, module, parameter_id):
+        self.zr = zr
+        self.module = module
+        self.parameter_id = parameter_id
+        self.module_id = None
+        self.prefix = None
+        self.endpoint = None
+
+    def _compile(self):
+        if self.module.id is None:
+            self.zr._error("module not yet added to circuit")
+        self.module_id = self.module.id
+        request = self.zr.connection._new_request(
+            'PUT', '/circuit/module/%d/parameter/%s/requested' %
+            (self.module_id, to_path_name(self.parameter_id)))
+        self.prefix = request.SerializeToString() + self.requested_tag
+        self.endpoint = request_endpoint(request)
+
+    def __call__(self, value):
+        if self.prefix is None or self.module.id != self.module_id:
+            self._compile()
+        if self.zr._transaction is not None:
+            return self.module._set_parameter(self.parameter_id, value)
+        self.zr._discard_coalesced(self.module_id, self.parameter_id)
+        self.zr._invalidate_shadow(self.module_id, self.parameter_id)
+        response = self.zr._send_serialized(
+            self.prefix + self.requested_format.pack(value), self.endpoint)
+        self.module._store(self.parameter_id, value)
+        return response
+
+class CoalescingWriter(object):
+    # Holds the latest pending value per (module, parameter or option) and
+    # sends them from a background thread at most max_rate times per second.
+    # Superseded values are never sent. Errors from the background thread
+    # are raised from the next submit() or flush().
+    def __init__(self, zr, max_rate=100.0):
+        self.zr = zr
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.last_flush = 0.0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, module_id, kind, attr_id, value):
+        self._raise_error()
+        with self.condition:
+            self.pending[(module_id, kind, attr_id)] = value
+            self.condition.notify()
+
+    def _send(self):
+        with self.send_lock:
+            with self.condition:
+                batch, self.pending = self.pending, OrderedDict()
+                self.last_flush = monotonic()
+            if not batch:
+                return
+            responses = []
+            with self.zr.pipeline() as p:
+                for (module_id, kind, attr_id), value in batch.items():
+                    if kind == 'parameter':
+                        self.zr._invalidate_shadow(module_id, attr_id)
+                        request = self.zr._parameter_request(module_id, attr_id, value)
+                    else:
+                        self.zr._invalidate_shadow(module_id)
+                        request = self.zr._option_request(module_id, attr_id, value)
+                    responses.append(p.put(*request))
+            for response in responses:
+                response.result()
+
+    def flush(self):
+        self._raise_error()
+        self._send()
+
+    def discard(self, module_id, kind, attr_id):
+        # Drops a pending value that a direct write is about to supersede.
+        # Waits for a batch that is already being sent so the direct write
+        # lands after it.
+        with self.send_lock:
+            with self.condition:
+                self.pending.pop((module_id, kind, attr_id), None)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.pending:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                delay = self.last_flush + self.interval - monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+            try:
+                self._send()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+class Transaction(object):
+    # Applies adds, nets, parameter and option writes and MIDI listeners to
+    # a local copy of the device circuit, then uploads it with a single
+    # POST /circuit on exit. Phase compatibility is left to the device
+    # since the new modules don't exist there yet.
+    def __init__(self, zr):
+        self.zr = zr
+        self.circuit = None
+
+    def __enter__(self):
+        if self.zr._transaction is not None:
+            self.zr._error("transactions can't be nested")
+        self.zr.flush()
+        self.circuit = zr.Circuit()
+        self.circuit.CopyFrom(self.zr.get('/circuit').circuit)
+        self.zr._transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.zr._transaction = None
+        try:
+            if exc_type is None:
+                self.zr.post('/circuit', self.circuit)
+        finally:
+            # the device may have rejected the circuit, so reload whatever
+            # it holds now
+            self.zr._sync()
+        return False
+
+    def add(self, module):
+        m = self.zr._module_message(module)
+        m.id = len(self.circuit.modules)
+        self.circuit.modules.add().CopyFrom(m)
+        if hasattr(module, 'lookup_table'):
+            self.set_lookup_table(module.lookup_table.requested)
+        return m.id
+
+    def set_lookup_table(self, table):
+        # the circuit holds the table of its one lookup table module
+        self.circuit.lookup_table.data[:] = table.tolist()
+
+    def add_net(self, net):
+        self.circuit.nets.add().CopyFrom(net)
+
+    def add_listener(self, listener):
+        self.circuit.midi_listeners.add().CopyFrom(listener)
+
+    def set_parameter(self, module_id, parameter_id, value):
+        parameter_id = zr.Parameter.Id.Value(parameter_id.upper())
+        for p in self.circuit.modules[module_id].parameters:
+            if p.id == parameter_id:
+                p.requested = value
+                return
+        p = self.circuit.modules[module_id].parameters.add()
+        p.id = parameter_id
+        p.requested = value
+
+    def set_option(self, module_id, option_id, value):
+        option_id = zr.Option.Id.Value(option_id.upper())
+        for o in self.circuit.modules[module_id].options:
+            if o.id == option_id:
+                o.value = value
+                return
+        o = self.circuit.modules[module_id].options.add()
+        o.id = option_id
+        o.value = value
+
+class CircuitSnapshot(object):
+    # Every parameter of every module in the circuit as parallel NumPy
+    # arrays, one row per parameter, from a single GET /circuit.
+    def __init__(self, circuit):
+        self.circuit = circuit
+        rows = [(module_id, p) for module_id, m in enumerate(circuit.modules)
+                for p in m.parameters]
+        self.module_id = numpy.array([r[0] for r in rows], dtype=numpy.int32)
+        self.parameter_id = numpy.array([p.id for _, p in rows], dtype=numpy.int32)
+        self.requested = numpy.array([p.requested for _, p in rows], dtype=numpy.float32)
+        self.realized = numpy.array([p.realized for _, p in rows], dtype=numpy.float32)
+        self.minimum = numpy.array([p.minimum for _, p in rows], dtype=numpy.float32)
+        self.maximum = numpy.array([p.maximum for _, p in rows], dtype=numpy.float32)
+        self.interpolation_in_progress = numpy.array(
+            [p.interpolation_in_progress for _, p in rows], dtype=bool)
+        self.current_interpolation_step = numpy.array(
+            [p.current_interpolation_step for _, p in rows], dtype=numpy.int32)
+        self.interpolation_step_count = numpy.array(
+            [p.interpolation_step_count for _, p in rows], dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.module_id)
+
+    @property
+    def parameter_names(self):
+        return [to_field_name(zr.Parameter.Id.Name(i)) for i in self.parameter_id]
+
+    def select(self, module_id=None, parameter_id=None):
+        # boolean mask over the rows; parameter_id is a field name
+        mask = numpy.ones(len(self), dtype=bool)
+        if module_id is not None:
+            mask &= self.module_id == module_id
+        if parameter_id is not None:
+            mask &= self.parameter_id == zr.Parameter.Id.Value(parameter_id.upper())
+        return mask
+
+    def within_tolerance(self, tolerance):
+        return within_tolerance(self.requested, self.realized, tolerance)
+
+def table_digest(data):
+    return hashlib.sha1(data).digest()
+
+def table_bounds(lookup_table):
+    if lookup_table.minimum_possible_value < lookup_table.maximum_possible_value:
+        return (lookup_table.minimum_possible_value, lookup_table.maximum_possible_value)
+    return None
 
 class LookupTable(object):
+    # The requested table is a float32 array. push() writes its buffer
+    # straight into the packed 'data' field of the request; 'lookup_table'
+    # is the highest numbered field that's set, so this matches what
+    # Connection.put would produce.
+    request_tag = field_tag(zr.Request, 'lookup_table', WIRE_TYPE_LENGTH_DELIMITED)
+    data_tag = field_tag(zr.LookupTable, 'data', WIRE_TYPE_LENGTH_DELIMITED)
+    endpoint = 'PUT /circuit/module/<n>/lookup-table'
+    size = 256
+
     def __init__(self, zr, module):
         self.zr = zr
         self.module = module
-        self.requested_lookup_table = [0.0] * 256
+        self.requested_lookup_table = numpy.zeros(self.size, dtype=numpy.float32)
 
     @property
     def requested(self):
@@ -194,21 +437,57 @@ class LookupTable(object):
 
     @requested.setter
     def requested(self, lookup_table):
-        self.requested_lookup_table = lookup_table
+        table = numpy.ascontiguousarray(lookup_table, dtype='<f4')
+        if table.shape != (self.size,) or not numpy.isfinite(table).all():
+            raise ValueError('lookup table must be %d finite values' % self.size)
+        self.requested_lookup_table = table
+
+    def _serialize(self, module_id, data):
+        table = b''
+        if data:
+            table = self.data_tag + encode_varint(len(data)) + data
+        request = self.zr.connection._new_request(
+            'PUT', '/circuit/module/%d/lookup-table' % module_id)
+        return (request.SerializeToString() +
+                self.request_tag + encode_varint(len(table)) + table)
 
     def push(self):
         if self.module.id is not None:
-            t = zr.LookupTable()
-            t.data[:] = self.requested_lookup_table
-            self.zr.put('/circuit/module/%d/lookup-table' % self.module.id, t)
+            if self.zr._transaction is not None:
+                return self.zr._transaction.set_lookup_table(self.requested_lookup_table)
+            data = self.requested_lookup_table.tobytes()
+            # stays dirty until the device has acknowledged the new table
+            self.zr._pushed_tables.pop(self.module.id, None)
+            response = self.zr._send_serialized(self._serialize(self.module.id, data),
+                                                self.endpoint)
+            return self.zr._table_pushed(self.module.id, table_digest(data), response)
+
+    @property
+    def dirty(self):
+        # whether the requested table differs from the last one pushed to
+        # (or loaded from) the device for this module
+        return (self.module.id is None or
+                self.zr._pushed_tables.get(self.module.id) !=
+                table_digest(self.requested_lookup_table.tobytes()))
+
+    def push_if_changed(self):
+        if self.module.id is not None and self.dirty:
+            return self.push()
+        return self.zr._completed(None)
+
+    @property
+    def bounds(self):
+        # (minimum, maximum) the firmware accepts for this module type's
+        # table, fetched once per type. None if the firmware doesn't say.
+        return self.zr._get_lookup_table_bounds(self.module)
 
     @property
     def realized(self):
-        if self.module.id is not None:
-            return self.zr.get('/circuit/module/%d/lookup-table' % self.module.id).lookup_table.data
-        return None
+        return self.zr._get_realized_lookup_table(self.module.id)
 
 class Option(int):
+    # Cached on the module like Parameter. Subclasses of int can't declare
+    # non-empty __slots__, so these keep their instance dict.
     def __new__(self, zr, module, option_id, value, valid_values):
         return int.__new__(self, value)
 
@@ -236,7 +515,7 @@ class Option(int):
             listener.trigger.option_value = self.dummy_value
         elif kwargs.get('midi') == self.zr.Gate:
             listener.gate.option_value_open = self.dummy_value
-        self.zr.delete('/circuit/midi/listener', listener)
+        return self.zr.delete('/circuit/midi/listener', listener)
 
     def listen(self, **kwargs):
         listener = zr.MidiListener()
@@ -263,7 +542,7 @@ class Option(int):
             listener.gate.option_value_closed = kwargs['closed']
 
         if listener.WhichOneof('type') is not None:
-            self.zr.post('/circuit/midi/listeners', listener)
+            self.zr._add_listener(listener)
         return self
 
     @property
@@ -277,6 +556,202 @@ class Option(int):
     def __str__(self):
         return zr.Option.Value.Name(self.value)
 
+# Module classes built at runtime expose parameters, options and inputs
+# through these descriptors. Classes written out by zrna.codegen use
+# equivalent properties instead.
+class ParameterDescriptor(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, module, owner):
+        if module is None:
+            return self
+        return module._values[self.name]
+
+    def __set__(self, module, value):
+        module._set_parameter(self.name, value)
+
+class OptionDescriptor(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, module, owner):
+        if module is None:
+            return self
+        return module._values[self.name]
+
+    def __set__(self, module, value):
+        module._set_option(self.name, value)
+
+class InputDescriptor(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, module, owner):
+        if module is None:
+            return self
+        return module._get_input(self.name)
+
+    def __set__(self, module, value):
+        raise AttributeError("can't set attribute")
+
+class Module(object):
+    # Base class of every module class. Subclasses carry the class level
+    # data from util.module_class_attributes() and are bound to a Client by
+    # setting _client. The Parameter and Option objects returned on access
+    # are kept in _values and only rebuilt by _store(), so reads don't
+    # allocate. Assigning to an attribute of a module that has been added
+    # to the circuit sends the new value to the device.
+    __slots__ = ('id', '_values', '_inputs')
+    _client = None
+
+    def __init__(self, **kwargs):
+        self.id = None
+        self._values = {}
+        self._inputs = {}
+
+        for option_id, value in self._option_defaults:
+            setattr(self, option_id, value)
+
+        for parameter_id, value in self._parameter_defaults:
+            setattr(self, parameter_id, value)
+
+        for input_id, condition in self._input_conditions:
+            self._inputs[input_id] = Input(self._client, self, input_id,
+                                           self._input_enabled(condition))
+
+        for output_id in self.outputs:
+            setattr(self, output_id, Output(self._client, self, output_id))
+
+        if self._has_lookup_table:
+            self.lookup_table = LookupTable(self._client, self)
+
+        if self._clock_configuration is not None:
+            self.clock_configuration = ParseDict(self._clock_configuration,
+                                                 zr.ModuleClockConfiguration())
+
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise ValueError("%s doesn't have %s as a parameter or option" % (self.type_name, key))
+            setattr(self, key, value)
+
+    def _input_enabled(self, condition):
+        if condition is None:
+            return lambda: True
+        option_id, option_value = condition
+        return lambda: self._values[option_id] == option_value
+
+    def _get_input(self, input_id):
+        i = self._inputs[input_id]
+        if i.enabled():
+            return i
+        self._client._error('%s input is currently disabled' % input_id)
+
+    def _set_parameter(self, parameter_id, value):
+        if self.id is not None:
+            self._client._put_parameter(self.id, parameter_id, value)
+        self._store(parameter_id, value)
+
+    def _set_option(self, option_id, value):
+        if self.id is not None:
+            self._client._put_option(self.id, option_id, value)
+        elif zr.Option.Value.Name(value) not in self._option_valid_values[option_id]:
+            self._client._error("'%s' isn't valid value for module option '%s'" % (
+                zr.Option.Value.Name(value), option_id))
+        self._store(option_id, value)
+
+    def update(self, **kwargs):
+        # Sends every changed parameter and option in one PATCH instead of
+        # a PUT per attribute.
+        for key in kwargs:
+            if key not in self._parameter_set and key not in self._option_set:
+                raise ValueError("%s doesn't have %s as a parameter or option" % (self.type_name, key))
+        if self.id is None:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+            return None
+
+        changed = dict((key, value) for key, value in kwargs.items()
+                       if value != self._values[key])
+        response = None
+        if changed:
+            response = self._client._patch_module(
+                self.id,
+                dict((k, v) for k, v in changed.items() if k in self._parameter_set),
+                dict((k, v) for k, v in changed.items() if k in self._option_set))
+        for key, value in changed.items():
+            self._store(key, value)
+        return response
+
+    def _store(self, attr, value):
+        # updates the local value without sending it to the device
+        if attr in self._parameter_set:
+            self._values[attr] = Parameter(self._client, self, attr, value)
+        else:
+            self._values[attr] = Option(self._client, self, attr, int(value),
+                                        self._option_valid_values[attr])
+
+    @property
+    def inputs(self):
+        return [i.input_id for i in self._inputs.values() if i.enabled()]
+
+    def set_clock(self, clock_id):
+        if hasattr(self, 'clock_configuration'):
+            self.clock_configuration.clock_a = clock_id
+            return self.put_clock_configuration()
+
+    def set_secondary_clock(self, clock_id):
+        if hasattr(self, 'clock_configuration'):
+            self.clock_configuration.clock_b = clock_id
+            return self.put_clock_configuration()
+
+    def get_clock_configuration(self):
+        if self.id is not None:
+            return self._client.get('/circuit/module/%d/clock' % self.id)
+
+    def put_clock_configuration(self):
+        if (self.id is not None and
+            hasattr(self, 'clock_configuration')):
+            self._client.flush()
+            self._client._invalidate_shadow(self.id)
+            return self._client.put('/circuit/module/%d/clock' % self.id,
+                                    getattr(self, 'clock_configuration'))
+
+    def has_lookup_table(self):
+        return hasattr(self, 'lookup_table')
+
+    def can_add(self):
+        return self._client._module_fits(self.type)
+
+    def analog(self):
+        return self._client._analog_info(self.type)
+
+    def __str__(self):
+        s = self.type_name + ' {' + '\n'
+        for field in ['parameters', 'options']:
+            f = getattr(self, field)
+            if f:
+                s += '  ' + field + ' {\n'
+                for foo in sorted(f):
+                    s += ('    ' + foo + ': ' + str(getattr(self, foo)) + '\n')
+                s += '  }\n'
+
+        for field in ['inputs', 'outputs']:
+            f = getattr(self, field)
+            if f:
+                s += '  ' + field + ' ' + str(sorted(f)) + '\n'
+        s += '}'
+        return s
+
+    def __repr__(self):
+        return '<%s from %s>' % (self.type_name, repr(self._client))
+
 class Storage(object):
     def __init__(self, zr):
         self.zr = zr
@@ -320,6 +795,19 @@ class Client(object):
     def __init__(self):
         self.connection = None
         self.module_instances = []
+        self._module_types = {}
+        self._module_schema = {}
+        self._module_classes = {}
+        self._lookup_table_bounds = {}
+        self._pushed_tables = {}
+        self._schema_cache = None
+        self._firmware_version = None
+        self._coalescer = None
+        self._transaction = None
+        self._instrument = None
+        self._shadow = {}
+        self._live_parameters = set()
+        self._phases = {}
 
         for k, v in zr.Option.Value.items():
             setattr(self, k, v)
@@ -331,6 +819,20 @@ class Client(object):
                 ['CC', 'Note', 'Trigger', 'Gate']):
             setattr(self, k, v)
 
+    def __getattr__(self, attr):
+        # Module classes are built on first access and then memoized as
+        # plain instance attributes, so this only runs once per type.
+        module_types = self.__dict__.get('_module_types', {})
+        if attr not in module_types:
+            raise AttributeError("'%s' object has no attribute '%s'" % (
+                type(self).__name__, attr))
+        if attr in self._module_classes:
+            return self._bind_module_class(attr, self._module_classes[attr], {'__slots__': ()})
+        return self._define_module_class(self._get_module_schema(module_types[attr]))
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) | set(self.__dict__) | set(self._module_types))
+
     def _error(self, msg):
         raise ZrnaException(msg)
 
@@ -371,211 +873,341 @@ class Client(object):
     def delete(self, url, filter_args=None):
         return self.connection.delete(url, filter_args)
 
+    @request
+    def _send_serialized(self, payload, endpoint=None):
+        return self.connection.send_serialized(payload, endpoint)
+
+    def pipeline(self, window=8):
+        if self.connection is None:
+            self._error("issued request before connecting to remote device")
+        return self.connection.pipeline(window, check=self._is_ok)
+
     @property
     def version(self):
-        d = MessageToDict(self.get('/version'), True)['version']
-        return '%d.%d.%d' % (
-            d['major'],
-            d['minor'],
-            d['patch'])
+        return version_string(self.get('/version'))
 
     def _transition_to(self, state):
-        self.put('/system/state', state)
-
-    def _get_module_dict(self, module_message, moduleType, moduleName):
-        d = MessageToDict(module_message, True)
-        m = {}
-
-        slots = ['id', '_option_valid_values', '_inputs']
-
-        if d.get('hasLookupTable'):
-            slots.append('lookup_table')
-        if 'clockConfiguration' in d:
-            slots.append('clock_configuration')
-
-        m['options'] = []
-        m['parameters'] = []
-        m['type'] = moduleType
-        m['type_name'] = to_class_name(moduleName)
-
-        for option in d.get('options', []):
-            option_id = to_field_name(option.get('id', zr.Option.Id.Name(0)))
-            slots.append(option_id)
-            m['options'].append(option_id)
-        for parameter in d.get('parameters', []):
-            parameter_id = to_field_name(parameter.get('id', zr.Parameter.Id.Name(0)))
-            slots.append(parameter_id)
-            m['parameters'].append(parameter_id)
-
-        response = self.get('/module/%s/inputs' % to_path_name(moduleName))
-        m['_all_inputs'] = response.inputs.input
-
-        response = self.get('/module/%s/outputs' % to_path_name(moduleName))
-        m['outputs'] = MessageToDict(response)['outputs']
-        if m['outputs']:
-            m['outputs'] = list(map(to_field_name, m['outputs']['output']))
-            slots.extend(m['outputs'])
-        else:
-            m['outputs'] = []
-
-        def module_init(module_self, **kwargs):
-            module_self.id = None
-            module_self._option_valid_values = {}
-            module_self._inputs = {}
-
-            for option in d.get('options', []):
-                option_id = to_field_name(option.get('id', zr.Option.Id.Name(0)))
-                module_self._option_valid_values[option_id] = option['validValues']
-                setattr(module_self, option_id, zr.Option.Value.Value(option.get('value', zr.Option.Value.Name(0))))
-
-            for parameter in d.get('parameters', []):
-                parameter_id = to_field_name(parameter.get('id', zr.Parameter.Id.Name(0)))
-                setattr(module_self, parameter_id, parameter['requested'])
-
-            for i in m['_all_inputs']:
-                module_input = to_field_name(zr.InputId.Name(i.id))
-                if i.conditionally_enabled:
-                    enabled = lambda: getattr(module_self, to_field_name(zr.Option.Id.Name(i.enabled_if.option_id))) == i.enabled_if.option_value
-                else:
-                    enabled = lambda: True
-
-                module_self._inputs[module_input] = Input(self, module_self, module_input, enabled)
-
-            for module_output in m['outputs']:
-                setattr(module_self,
-                        module_output,
-                        Output(self, module_self, module_output))
-
-            if d.get('hasLookupTable'):
-                setattr(module_self,
-                        'lookup_table',
-                        LookupTable(self, module_self))
-
-            if 'clockConfiguration' in d:
-                clock_configuration = zr.ModuleClockConfiguration()
-                clock_configuration.CopyFrom(module_message.clock_configuration)
-                setattr(module_self,
-                        'clock_configuration',
-                        clock_configuration)
+        return self.put('/system/state', state)
+
+    def _parameter_request(self, module_id, parameter_id, value):
+        return ('/circuit/module/%d/parameter/%s/requested' % (
+            module_id, to_path_name(parameter_id)), float(value))
+
+    def _option_request(self, module_id, option_id, value):
+        o = zr.Option()
+        o.value = value
+        return ('/circuit/module/%d/option/%s/value' % (
+            module_id, to_path_name(option_id)), o)
+
+    def _put_parameter(self, module_id, parameter_id, value):
+        self._invalidate_shadow(module_id, parameter_id)
+        if self._transaction is not None:
+            return self._transaction.set_parameter(module_id, parameter_id, value)
+        if self._coalescer is not None:
+            return self._coalescer.submit(module_id, 'parameter', parameter_id, value)
+        return self.put(*self._parameter_request(module_id, parameter_id, value))
+
+    def _put_option(self, module_id, option_id, value):
+        # options can change the range and quantization of every parameter
+        # on the module
+        self._invalidate_shadow(module_id)
+        self._invalidate_phases(module_id)
+        if self._transaction is not None:
+            return self._transaction.set_option(module_id, option_id, value)
+        if self._coalescer is not None:
+            return self._coalescer.submit(module_id, 'option', option_id, value)
+        return self.put(*self._option_request(module_id, option_id, value))
+
+    def _patch_module(self, module_id, parameters, options):
+        if self._transaction is not None:
+            for parameter_id, value in parameters.items():
+                self._transaction.set_parameter(module_id, parameter_id, value)
+            for option_id, value in options.items():
+                self._transaction.set_option(module_id, option_id, value)
+            return None
+        # coalesced writes still pending for this module would land after
+        # the PATCH and undo it
+        self.flush()
+        self._invalidate_shadow(module_id)
+        if options:
+            self._invalidate_phases(module_id)
+        m = zr.AnalogModule()
+        update_module(m, {'parameters': parameters, 'options': options})
+        return self.patch('/circuit/module/%d' % module_id, m)
 
-            for key, value in kwargs.items():
-                if not hasattr(module_self, key):
-                    raise ValueError("%s doesn't have %s as a parameter or option" % (to_class_name(moduleName), key))
-                setattr(module_self, key, value)
-
-        def module_setattr(module_self, attr, value):
-            if attr in m['parameters'] and module_self.id is not None:
-                self.put('/circuit/module/%d/parameter/%s/requested' % (module_self.id, to_path_name(attr)), float(value))
-            elif attr in m['options'] and module_self.id is not None:
-                o = zr.Option()
-                o.value = value
-                self.put('/circuit/module/%d/option/%s/value' % (module_self.id, to_path_name(attr)), o)
-            elif attr in m['options']:
-                if zr.Option.Value.Name(value) not in module_self._option_valid_values[attr]:
-                    self._error("'%s' isn't valid value for module option '%s'" % (
-                        zr.Option.Value.Name(value), attr))
-
-            object.__setattr__(module_self, attr, value)
-
-        def module_getattribute(module_self, attr):
-            if attr == 'inputs':
-                return [i.input_id for i in module_self._inputs.values() if i.enabled()]
-            elif attr in object.__getattribute__(module_self, '_inputs'):
-                i = object.__getattribute__(module_self, '_inputs')[attr]
-                if i.enabled():
-                    return i
-                else:
-                    self._error('%s input is currently disabled' % attr)
-            elif attr in m['parameters']:
-                return Parameter(self, module_self, attr, object.__getattribute__(module_self, attr))
-            elif attr in m['options']:
-                return Option(
-                    self, module_self, attr, object.__getattribute__(module_self, attr),
-                    module_self._option_valid_values[attr])
-            else:
-                return object.__getattribute__(module_self, attr)
-
-        def module_set_clock(module_self, clock_id):
-            if hasattr(module_self, 'clock_configuration'):
-                module_self.clock_configuration.clock_a = clock_id
-                module_self.put_clock_configuration()
-
-        def module_set_secondary_clock(module_self, clock_id):
-            if hasattr(module_self, 'clock_configuration'):
-                module_self.clock_configuration.clock_b = clock_id
-                module_self.put_clock_configuration()
-
-        def module_get_clock_configuration(module_self):
-            if module_self.id is not None:
-                return self.get('/circuit/module/%d/clock' % module_self.id)
-
-        def module_put_clock_configuration(module_self):
-            if (module_self.id is not None and
-                hasattr(module_self, 'clock_configuration')):
-                self.put('/circuit/module/%d/clock' % module_self.id,
-                         getattr(module_self, 'clock_configuration'))
-
-        def has_lookup_table(module_self):
-            return hasattr(module_self, 'lookup_table')
-
-        def module_can_add(module_self):
-            return self.get('/module/%s/analog/fits' % to_path_name(moduleName)).module_fits
-
-        def module_analog(module_self):
-            return self._as_pretty_dict(
-                self.get('/module/%s/analog' % to_path_name(moduleName)).analog_info)
-
-        def module_str(module_self):
-            s = m['type_name'] + ' {' + '\n'
-            for field in ['parameters', 'options']:
-                f = getattr(module_self, field)
-                if f:
-                    s += '  ' + field + ' {\n'
-                    for foo in sorted(f):
-                        s += ('    ' + foo + ': ' + str(getattr(module_self, foo)) + '\n')
-                    s += '  }\n'
-
-            for field in ['inputs', 'outputs']:
-                f = getattr(module_self, field)
-                if f:
-                    s += '  ' + field + ' ' + str(sorted(f)) + '\n'
-            s += '}'
-            return s
-
-        def module_repr(module_self):
-            return '<%s from %s>' % (m['type_name'], repr(self))
-
-        m['__init__'] = module_init
-        m['__slots__'] = slots
-        m['__getattribute__'] = module_getattribute
-        m['__setattr__'] = module_setattr
-        m['__str__'] = module_str
-        m['__repr__'] = module_repr
-        m['analog'] = module_analog
-        m['can_add'] = module_can_add
-        m['set_clock'] = module_set_clock
-        m['set_secondary_clock'] = module_set_secondary_clock
-        m['has_lookup_table'] = has_lookup_table
-        m['get_clock_configuration'] = module_get_clock_configuration
-        m['put_clock_configuration'] = module_put_clock_configuration
-        return m
+    def transaction(self):
+        return Transaction(self)
 
-    def _enumerate_modules(self):
-        response = self.get('/modules')
+    def _completed(self, value):
+        # result of a request that didn't need to be sent
+        return value
 
-        for moduleType in response.module_types.module_type:
-            moduleTypeName = zr.AnalogModule.Type.Name(moduleType)
-            response = self.get('/module/%s' % to_path_name(moduleTypeName))
-            module_class_name = to_class_name(moduleTypeName)
-            setattr(self, module_class_name,
-                    type(module_class_name, (object,),
-                         self._get_module_dict(response.modules.module[0], moduleType, moduleTypeName)))
+    def _table_pushed(self, module_id, digest, response):
+        self._pushed_tables[module_id] = digest
+        return response
 
-    def _sync(self):
+    def _has_lookup_table(self, module_message):
+        return getattr(self, to_class_name(
+            zr.AnalogModule.Type.Name(module_message.type)))._has_lookup_table
+
+    def diff(self, circuit):
+        return diff_circuits(self.get('/circuit').circuit, circuit,
+                             self._has_lookup_table)
+
+    def apply(self, circuit):
+        self._assert_no_transaction()
+        self.flush()
+        changes = self.diff(circuit)
+        apply_changes(self.pipeline(), changes)
+        self._sync()
+        return changes
+
+    def _assert_no_transaction(self):
+        if self._transaction is not None:
+            self._error("operation not supported inside a transaction")
+
+    def _add_listener(self, listener):
+        self._add_live_target(listener)
+        if self._transaction is not None:
+            return self._transaction.add_listener(listener)
+        return self.post('/circuit/midi/listeners', listener)
+
+    def _parameter_state(self, module_id, parameter_id, field):
+        # realized, minimum and maximum only change when the module is
+        # written to, so they're served from a shadow copy that's filled from
+        # GET /circuit and dropped on writes. Parameters driven by a MIDI
+        # listener or a sweep are always fetched from the device.
+        value = self._shadowed_state(module_id, parameter_id, field)
+        if value is not None:
+            return value
+        return self._store_parameter_state(
+            module_id, parameter_id, field,
+            self.get(self._parameter_state_url(module_id, parameter_id, field)))
+
+    def _shadowed_state(self, module_id, parameter_id, field):
+        entry = self._shadow.get((module_id, parameter_id))
+        if entry is not None:
+            return entry.get(field)
+        return None
+
+    def _parameter_state_url(self, module_id, parameter_id, field):
+        return '/circuit/module/%d/parameter/%s/%s' % (
+            module_id, to_path_name(parameter_id), field)
+
+    def _store_parameter_state(self, module_id, parameter_id, field, response):
+        value = getattr(response, field)
+        if self._is_shadowed(module_id, parameter_id):
+            self._shadow.setdefault((module_id, parameter_id), {})[field] = value
+        return value
+
+    def _is_shadowed(self, module_id, parameter_id):
+        return ((module_id, parameter_id) not in self._live_parameters and
+                (module_id, None) not in self._live_parameters)
+
+    def _add_live_target(self, listener):
+        # a None parameter id marks every parameter of the module as live
+        if listener.WhichOneof('target') == 'parameter_id':
+            parameter_id = to_field_name(zr.Parameter.Id.Name(listener.parameter_id))
+            self._invalidate_shadow(listener.module_id, parameter_id)
+            self._live_parameters.add((listener.module_id, parameter_id))
+        else:
+            self._invalidate_shadow(listener.module_id)
+            self._invalidate_phases(listener.module_id)
+            self._live_parameters.add((listener.module_id, None))
+
+    def _start_sweep(self, module_id, parameter_id):
+        # stays live until a refresh sees the interpolation has finished
+        self._invalidate_shadow(module_id, parameter_id)
+        self._live_parameters.add((module_id, parameter_id))
+
+    def _invalidate_shadow(self, module_id=None, parameter_id=None):
+        if module_id is None:
+            self._shadow = {}
+        elif parameter_id is None:
+            for key in list(self._shadow):
+                if key[0] == module_id:
+                    self._shadow.pop(key, None)
+        else:
+            self._shadow.pop((module_id, parameter_id), None)
+
+    def _renumber_module_state(self, removed_id):
+        # ids of the modules after the removed one shift down by one
+        def renumber(key):
+            module_id, attr = key
+            return (module_id - 1 if module_id > removed_id else module_id, attr)
+        self._shadow = dict((renumber(k), v) for k, v in self._shadow.items()
+                            if k[0] != removed_id)
+        self._live_parameters = set(renumber(k) for k in self._live_parameters
+                                    if k[0] != removed_id)
+        self._pushed_tables = dict(
+            (module_id - 1 if module_id > removed_id else module_id, digest)
+            for module_id, digest in self._pushed_tables.items()
+            if module_id != removed_id)
+
+    def _fill_shadow(self, circuit):
+        self._shadow = {}
+        self._live_parameters = set()
+        for listener in circuit.midi_listeners:
+            self._add_live_target(listener)
+        for i, m in enumerate(circuit.modules):
+            for p in m.parameters:
+                parameter_id = to_field_name(zr.Parameter.Id.Name(p.id))
+                if p.interpolation_in_progress:
+                    self._live_parameters.add((i, parameter_id))
+                elif self._is_shadowed(i, parameter_id):
+                    self._shadow[(i, parameter_id)] = {'realized': p.realized,
+                                                       'minimum': p.minimum,
+                                                       'maximum': p.maximum}
+
+    def refresh_parameters(self):
+        self._fill_shadow(self.get('/circuit').circuit)
+
+    def snapshot(self):
         circuit = self.get('/circuit').circuit
+        self._fill_shadow(circuit)
+        return CircuitSnapshot(circuit)
+
+    def coalesce(self, max_rate=100.0):
+        self.stop_coalescing()
+        self._coalescer = CoalescingWriter(self, max_rate)
+        return self._coalescer
+
+    def stop_coalescing(self):
+        if self._coalescer is not None:
+            coalescer, self._coalescer = self._coalescer, None
+            coalescer.close()
+
+    def _discard_coalesced(self, module_id, parameter_id):
+        if self._coalescer is not None:
+            self._coalescer.discard(module_id, 'parameter', parameter_id)
+
+    def flush(self):
+        if self._coalescer is not None:
+            self._coalescer.flush()
+
+    def instrument(self, *sinks):
+        # Records every request from here on, including across reconnects;
+        # see zrna.instrument. Defaults to a single Aggregator.
+        self._instrument = Instrument(*(sinks or (Aggregator(),)))
+        if self.connection is not None:
+            self.connection.instrument = self._instrument
+        return self._instrument
+
+    def stop_instrumenting(self):
+        self._instrument = None
+        if self.connection is not None:
+            self.connection.instrument = None
+
+    def _enumerate_modules(self, schema_cache=None, module_classes=None):
+        version = (self.version if schema_cache is not None or module_classes is not None
+                   else None)
+        loaded = self._load_module_types(schema_cache, version)
+        if self._load_module_classes(module_classes, version):
+            return
+        if not loaded:
+            self._set_module_types(self.get('/modules').module_types.module_type)
+            self._store_module_schema([])
+
+    def _load_module_classes(self, module_classes, version):
+        # classes generated by zrna.codegen are only used with the firmware
+        # version their schema snapshot was taken from
+        if module_classes is None or module_classes.VERSION != version:
+            return False
+        self._set_module_types(module_classes.MODULE_TYPES,
+                               list(self._module_schema.values()),
+                               module_classes.MODULE_CLASSES)
+        return True
+
+    def _load_module_types(self, schema_cache, version):
+        self._schema_cache = schema_cache
+        self._firmware_version = version
+        if schema_cache is None:
+            return False
+        cached = load_module_schema(schema_cache, version)
+        if cached is None:
+            return False
+        self._set_module_types(*cached)
+        return True
+
+    def _set_module_types(self, module_types, schema=(), module_classes=()):
+        for module_class_name in self._module_types:
+            self.__dict__.pop(module_class_name, None)
+        self._module_types = OrderedDict(
+            (to_class_name(zr.AnalogModule.Type.Name(t)), t) for t in module_types)
+        self._module_schema = dict((s.type, s) for s in schema)
+        self._module_classes = dict((c.type_name, c) for c in module_classes)
+
+    def _store_module_schema(self, schema):
+        for module_schema in schema:
+            self._module_schema[module_schema.type] = module_schema
+        if self._schema_cache is not None:
+            save_module_schema(self._schema_cache, self._firmware_version,
+                               list(self._module_types.values()),
+                               [self._module_schema[t] for t in self._module_types.values()
+                                if t in self._module_schema])
+
+    def _missing_module_types(self):
+        return [t for t in self._module_types.values() if t not in self._module_schema]
+
+    def _get_module_schema(self, moduleType):
+        if moduleType not in self._module_schema:
+            self._store_module_schema(self._fetch_module_schema([moduleType]))
+        return self._module_schema[moduleType]
+
+    def module_schema(self):
+        missing = self._missing_module_types()
+        if missing:
+            self._store_module_schema(self._fetch_module_schema(missing))
+        return [self._module_schema[t] for t in self._module_types.values()]
+
+    def _fetch_module_schema(self, module_types):
+        pending = []
+        with self.pipeline() as p:
+            for moduleType in module_types:
+                moduleTypeName = zr.AnalogModule.Type.Name(moduleType)
+                path_name = to_path_name(moduleTypeName)
+                pending.append((moduleType,
+                                p.get('/module/%s' % path_name),
+                                p.get('/module/%s/inputs' % path_name),
+                                p.get('/module/%s/outputs' % path_name)))
+
+        return [ModuleSchema(moduleType,
+                             module.result().modules.module[0],
+                             inputs.result().inputs,
+                             outputs.result().outputs)
+                for moduleType, module, inputs, outputs in pending]
+
+    def _define_module_class(self, schema):
+        class_dict = module_class_attributes(schema)
+        for parameter_id in class_dict['parameters']:
+            class_dict[parameter_id] = ParameterDescriptor(parameter_id)
+        for option_id in class_dict['options']:
+            class_dict[option_id] = OptionDescriptor(option_id)
+        for input_id, _ in class_dict['_input_conditions']:
+            class_dict[input_id] = InputDescriptor(input_id)
+        return self._bind_module_class(class_dict['type_name'], Module, class_dict)
+
+    def _bind_module_class(self, module_class_name, base, class_dict):
+        class_dict['_client'] = self
+        module_class = type(module_class_name, (base,), class_dict)
+        setattr(self, module_class_name, module_class)
+        return module_class
+
+    def _sync(self):
+        self._load_circuit(self.get('/circuit').circuit)
+
+    def _load_circuit(self, circuit):
+        # Module objects already at the same position with the same type are
+        # updated in place so references held by the caller stay valid.
+        previous = self.module_instances
         self.module_instances = []
-        for m in list(circuit.modules):
-            module = getattr(self, to_class_name(zr.AnalogModule.Type.Name(m.type)))()
+        for i, m in enumerate(circuit.modules):
+            module_class = getattr(self, to_class_name(zr.AnalogModule.Type.Name(m.type)))
+            if i < len(previous) and type(previous[i]) is module_class:
+                module = previous[i]
+                module.id = None
+            else:
+                module = module_class()
 
             for p in m.parameters:
                 setattr(module, to_field_name(zr.Parameter.Id.Name(p.id)),
@@ -590,8 +1222,24 @@ class Client(object):
 
             if hasattr(module, 'clock_configuration'):
                 module.clock_configuration.CopyFrom(m.clock_configuration)
+            module.id = i
             self.module_instances.append(module)
 
+        for module in previous:
+            if not any(module is m for m in self.module_instances):
+                module.id = None
+
+        self._fill_shadow(circuit)
+        self._invalidate_phases()
+
+        # the circuit carries the table of its lookup table module
+        self._pushed_tables = {}
+        for module in self.module_instances:
+            if hasattr(module, 'lookup_table'):
+                self._pushed_tables[module.id] = table_digest(
+                    numpy.array(circuit.lookup_table.data, dtype='<f4').tobytes())
+                break
+
     def _as_pretty_dict(self, message):
         d = MessageToDict(message, including_default_value_fields=True)
         return type('', (type(d),),
@@ -618,15 +1266,87 @@ class Client(object):
         n.input_address.module_id = input_module_id
         n.input_address.input_id = zr.InputId.Value(input_id.upper())
 
-        self.post('/circuit/nets', n)
+        if self._transaction is not None:
+            return self._transaction.add_net(n)
+        return self.post('/circuit/nets', n)
+
+    def _connect(self, output, input):
+        if self._transaction is None:
+            self._assert_phase_ok(output.phase, input.phase)
+        self._add_net(output.module.id, output.output_id,
+                      input.module.id, input.input_id)
+        output.connected_to = input
+        input.connected_to = output
+
+    def _phase_url(self, module_id, io_id, input_or_output):
+        return '/circuit/module/%d/%s/%s/phase' % (
+            module_id, input_or_output, to_path_name(io_id))
+
+    def _option_state(self, module_id):
+        if module_id >= len(self.module_instances):
+            return None
+        module = self.module_instances[module_id]
+        return tuple(int(getattr(module, o)) for o in module.options)
+
+    def _cache_phase(self, key, option_state, phase):
+        # modules whose options are driven by a MIDI listener can change
+        # phase behind our back
+        if option_state is not None and (key[0], None) not in self._live_parameters:
+            self._phases[key] = (option_state, phase)
+
+    def _invalidate_phases(self, module_id=None):
+        if module_id is None:
+            self._phases = {}
+        else:
+            for key in list(self._phases):
+                if key[0] == module_id:
+                    self._phases.pop(key, None)
 
     def _get_phase(self, module_id, io_id, input_or_output):
+        # Phase only depends on the module type and its option values, so
+        # it's cached per (module id, input or output, option values).
+        phase = self._cached_phase(module_id, io_id, input_or_output)
+        if phase is not None:
+            return phase
+        # pending option writes have to reach the device first
+        self.flush()
+        return self._store_phase(module_id, io_id, input_or_output,
+                                 self.get(self._phase_url(module_id, io_id, input_or_output)))
+
+    def _cached_phase(self, module_id, io_id, input_or_output):
         if module_id is None:
             self._error("module not yet added to circuit")
-        response = self.get(
-            '/circuit/module/%d/%s/%s/phase' %
-            (module_id, input_or_output, to_path_name(io_id)))
-        return zr.Option.Value.Name(response.option_value)
+        cached = self._phases.get((module_id, input_or_output, io_id))
+        if cached is not None and cached[0] == self._option_state(module_id):
+            return cached[1]
+        return None
+
+    def _store_phase(self, module_id, io_id, input_or_output, response):
+        phase = zr.Option.Value.Name(response.option_value)
+        self._cache_phase((module_id, input_or_output, io_id),
+                          self._option_state(module_id), phase)
+        return phase
+
+    def prefetch_phases(self):
+        # Fetches the phase of every input and output in the circuit in one
+        # pipelined batch, so wiring a patch doesn't cost two round trips
+        # per net.
+        self._assert_no_transaction()
+        self.flush()
+        pending = []
+        with self.pipeline() as p:
+            for module_id, io_id, input_or_output in self._phase_keys():
+                pending.append((module_id, io_id, input_or_output,
+                                p.get(self._phase_url(module_id, io_id, input_or_output))))
+        for module_id, io_id, input_or_output, response in pending:
+            self._store_phase(module_id, io_id, input_or_output, response.result())
+
+    def _phase_keys(self):
+        for module in self.module_instances:
+            for input_or_output, io_ids in (('inputs', module.inputs),
+                                            ('outputs', module.outputs)):
+                for io_id in io_ids:
+                    yield module.id, io_id, input_or_output
 
     def _get_input_phase(self, module_id, input_id):
         return self._get_phase(module_id, input_id, 'inputs')
@@ -635,19 +1355,28 @@ class Client(object):
         return self._get_phase(module_id, output_id, 'outputs')
 
     def _disconnect_input(self, module_id, input_id):
-        self.post('/circuit/module/%d/inputs/%s/disconnect' % (module_id, to_path_name(input_id)))
+        return self.post('/circuit/module/%d/inputs/%s/disconnect' % (module_id, to_path_name(input_id)))
 
     def _disconnect_output(self, module_id, output_id):
-        self.post('/circuit/module/%d/outputs/%s/disconnect' % (module_id, to_path_name(output_id)))
-
-    def connect(self, device_path=None, debug=False):
-        self.connection = Connection(device_path=device_path, debug=debug)
-        self._enumerate_modules()
+        return self.post('/circuit/module/%d/outputs/%s/disconnect' % (module_id, to_path_name(output_id)))
+
+    def connect(self, device_path=None, debug=False, schema_cache=DEFAULT_SCHEMA_CACHE,
+                module_classes=None, interface='usb_serial', record=None):
+        # record=path logs the session for replay with interface='replay';
+        # see zrna.session. The schema cache would change which requests are
+        # sent, so it's off for both.
+        if record is not None or interface == 'replay':
+            schema_cache = None
+        self.connection = Connection(interface=interface, device_path=device_path,
+                                     debug=debug, record=record)
+        self.connection.instrument = self._instrument
+        self._enumerate_modules(schema_cache, module_classes)
         self._sync()
         self.pause()
 
     def default_divisors(self):
-        self.post('/system/resource/analog/clock/default')
+        self._invalidate_shadow()
+        return self.post('/system/resource/analog/clock/default')
 
     def clocks(self):
         return self.get('/system/resource/analog/clock')
@@ -657,18 +1386,24 @@ class Client(object):
         sc = cc.sys_clock.add()
         sc.id = id
         sc.divisor = divisor
-        self.patch('/system/resource/analog/clock', cc)
+        self._invalidate_shadow()
+        return self.patch('/system/resource/analog/clock', cc)
 
     def run(self):
-        self._transition_to(zr.SystemState.Value('RUNNING'))
+        return self._transition_to(zr.SystemState.Value('RUNNING'))
 
     def pause(self):
-        self._transition_to(zr.SystemState.Value('PAUSED'))
+        return self._transition_to(zr.SystemState.Value('PAUSED'))
 
     def hard_reset(self):
-        self._transition_to(zr.SystemState.Value('RESETTING'))
+        self._invalidate_shadow()
+        self._invalidate_phases()
+        self._pushed_tables = {}
+        return self._transition_to(zr.SystemState.Value('RESETTING'))
 
     def clear(self):
+        self._assert_no_transaction()
+        self.flush()
         self.post('/circuit/default')
         self._sync()
 
@@ -679,22 +1414,24 @@ class Client(object):
         return self._as_pretty_dict(self.get('/system/resource/analog/debug'))
 
     def load(self, circuit_name):
+        self._assert_no_transaction()
+        self.flush()
         self.post('/storage/circuit/%s/load' % circuit_name)
         self._sync()
 
     def store(self, circuit_name):
         if len(circuit_name) > 32:
             self._error('stored circuit names are limited to 32 characters')
-        self.post('/storage/circuit/%s' % circuit_name)
+        return self.post('/storage/circuit/%s' % circuit_name)
 
     def set_startup_circuit(self, circuit_name):
-        self.post('/storage/circuit/startup/%s' % circuit_name)
+        return self.post('/storage/circuit/startup/%s' % circuit_name)
 
     def clear_startup_circuit(self):
-        self.delete('/storage/circuit/startup')
+        return self.delete('/storage/circuit/startup')
 
     def delete_stored(self, circuit_name):
-        self.delete('/storage/circuit/%s' % circuit_name)
+        return self.delete('/storage/circuit/%s' % circuit_name)
 
     def stored_circuits(self):
         return self.get('/storage/circuits')
@@ -714,7 +1451,46 @@ class Client(object):
     def add(self, module):
         if module.id is not None:
             self._error("tried to add a module already present in circuit")
+        if self._transaction is not None:
+            module.id = self._transaction.add(module)
+            self.module_instances.append(module)
+            return
         module.id = self.module_instance_count()
+        self.post('/circuit/modules', self._module_message(module))
+        self.module_instances.append(module)
+
+        if hasattr(module, 'lookup_table'):
+            module.lookup_table.push()
+
+    def _module_type_url(self, module_type, suffix):
+        return '/module/%s/%s' % (to_path_name(zr.AnalogModule.Type.Name(module_type)), suffix)
+
+    def _module_fits(self, module_type):
+        return self.get(self._module_type_url(module_type, 'analog/fits')).module_fits
+
+    def _analog_info(self, module_type):
+        return self._as_pretty_dict(
+            self.get(self._module_type_url(module_type, 'analog')).analog_info)
+
+    def _lookup_table_url(self, module):
+        if module.id is None:
+            self._error("module not yet added to circuit")
+        return '/circuit/module/%d/lookup-table' % module.id
+
+    def _get_lookup_table_bounds(self, module):
+        if module.type not in self._lookup_table_bounds:
+            self._lookup_table_bounds[module.type] = table_bounds(
+                self.get(self._lookup_table_url(module)).lookup_table)
+        return self._lookup_table_bounds[module.type]
+
+    def _get_realized_lookup_table(self, module_id):
+        if module_id is not None:
+            return numpy.array(
+                self.get('/circuit/module/%d/lookup-table' % module_id).lookup_table.data,
+                dtype=numpy.float32)
+        return None
+
+    def _module_message(self, module):
         m = zr.AnalogModule()
         m.type = module.type
         for param in module.parameters:
@@ -727,17 +1503,16 @@ class Client(object):
             o.value = getattr(module, to_field_name(option))
         if hasattr(module, 'clock_configuration'):
             m.clock_configuration.CopyFrom(module.clock_configuration)
-
-        self.post('/circuit/modules', m)
-        self.module_instances.append(module)
-
-        if hasattr(module, 'lookup_table'):
-            module.lookup_table.push()
+        return m
 
     def remove(self, module):
         if module.id is None or module not in self.module_instances:
             self._error("tried to remove a module not present in current circuit")
+        self._assert_no_transaction()
+        self.flush()
         self.delete('/circuit/module/%d' % module.id)
+        self._renumber_module_state(module.id)
+        self._invalidate_phases()
         self.module_instances.remove(module)
         module.id = None
         for i, module_instance in enumerate(self.module_instances):
@@ -0,0 +1,150 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# Writes the module classes the client would otherwise build at runtime out
+# as a plain Python module, from a schema snapshot in the same format as
+# the client's schema cache. Pass the generated module to
+# Client.connect(module_classes=...) to use it.
+
+import sys
+from .util import module_class_attributes, read_module_schema, write_module_schema
+import zrna.zr_pb2 as zr
+
+HEADER = '''# Generated by zrna.codegen from a module schema snapshot.  DO NOT EDIT!
+# firmware version: %s
+
+from zrna.api import Module
+
+VERSION = %r
+MODULE_TYPES = %r
+'''
+
+def usage():
+    print('usage: python -m zrna.codegen /path/to/schema.json /path/to/output.py')
+    print('       python -m zrna.codegen --snapshot /path/to/schema.json [device_path_or_com_port]')
+    sys.exit()
+
+def _literal(value):
+    # sorted so regenerating from the same snapshot gives the same file
+    if isinstance(value, frozenset):
+        return 'frozenset(%r)' % sorted(value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, _literal(v))
+                                  for k, v in sorted(value.items()))
+    return repr(value)
+
+def _option_names(values):
+    return ', '.join(str(v) for v in values)
+
+def _class_source(schema):
+    a = module_class_attributes(schema)
+    conditions = dict(a['_input_conditions'])
+    defaults = dict(a['_parameter_defaults'])
+    option_defaults = dict(a['_option_defaults'])
+
+    lines = ['class %s(Module):' % a['type_name'],
+             '    """%s module.' % zr.AnalogModule.Type.Name(schema.type),
+             '']
+    for title, names in (('Parameters', a['parameters']), ('Options', a['options']),
+                         ('Inputs', [i for i, _ in a['_input_conditions']]),
+                         ('Outputs', a['outputs'])):
+        if names:
+            lines.append('    %s: %s' % (title, ', '.join(names)))
+    lines.append('    """')
+    lines.append('    __slots__ = %r' % (tuple(a.pop('__slots__')),))
+    for key, value in a.items():
+        lines.append('    %s = %s' % (key, _literal(value)))
+
+    for parameter_id in a['parameters']:
+        lines.extend([
+            '',
+            '    @property',
+            '    def %s(self):' % parameter_id,
+            '        """%s parameter. Defaults to %r."""' % (parameter_id, defaults[parameter_id]),
+            '        return self._values[%r]' % parameter_id,
+            '',
+            '    @%s.setter' % parameter_id,
+            '    def %s(self, value):' % parameter_id,
+            '        self._set_parameter(%r, value)' % parameter_id])
+
+    for option_id in a['options']:
+        lines.extend([
+            '',
+            '    @property',
+            '    def %s(self):' % option_id,
+            '        """%s option, one of %s. Defaults to %s."""' % (
+                option_id, _option_names(a['_option_valid_values'][option_id]),
+                zr.Option.Value.Name(option_defaults[option_id])),
+            '        return self._values[%r]' % option_id,
+            '',
+            '    @%s.setter' % option_id,
+            '    def %s(self, value):' % option_id,
+            '        self._set_option(%r, value)' % option_id])
+
+    for input_id, condition in a['_input_conditions']:
+        if condition is None:
+            doc = '%s input.' % input_id
+        else:
+            doc = '%s input, enabled while %s is %s.' % (
+                input_id, condition[0], zr.Option.Value.Name(condition[1]))
+        lines.extend([
+            '',
+            '    @property',
+            '    def %s(self):' % input_id,
+            '        """%s"""' % doc,
+            '        return self._get_input(%r)' % input_id])
+
+    return '\n'.join(lines) + '\n'
+
+def generate(version, module_types, schema):
+    by_type = dict((s.type, s) for s in schema)
+    missing = [zr.AnalogModule.Type.Name(t) for t in module_types if t not in by_type]
+    if missing:
+        raise ValueError('schema snapshot is missing modules: %s' % ', '.join(missing))
+
+    source = [HEADER % (version, version, list(module_types))]
+    names = []
+    for t in module_types:
+        source.append(_class_source(by_type[t]))
+        names.append(module_class_attributes(by_type[t])['type_name'])
+    source.append('MODULE_CLASSES = [%s]\n' % ', '.join(names))
+    return '\n\n'.join(source)
+
+def snapshot(path, device_path=None):
+    from .api import Client
+    client = Client()
+    client.connect(device_path=device_path)
+    write_module_schema(path, client.version, list(client._module_types.values()),
+                        client.module_schema())
+
+def main():
+    if len(sys.argv) < 3:
+        usage()
+
+    if sys.argv[1] == '--snapshot':
+        snapshot(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        return
+
+    version, module_types, schema = read_module_schema(sys.argv[1])
+    with open(sys.argv[2], 'w') as f:
+        f.write(generate(version, module_types, schema))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+from collections import namedtuple
+from .util import to_path_name
+import zrna.zr_pb2 as zr
+
+Change = namedtuple('Change', ['method', 'url', 'payload'])
+
+def _net_key(net):
+    return (net.output_address.module_id, net.output_address.output_id,
+            net.input_address.module_id, net.input_address.input_id)
+
+def _listener_key(listener):
+    # listener ids are assigned by the device, so they don't take part in
+    # the comparison
+    l = zr.MidiListener()
+    l.CopyFrom(listener)
+    l.ClearField('id')
+    return l.SerializeToString(deterministic=True)
+
+def _kept_module_count(current, desired):
+    # module ids are positions, so only a common prefix of identically
+    # typed modules can be updated in place
+    keep = 0
+    while (keep < len(current.modules) and keep < len(desired.modules) and
+           current.modules[keep].type == desired.modules[keep].type):
+        keep += 1
+    return keep
+
+def _module_changes(module_id, current, desired):
+    changes = []
+    requested = dict((p.id, p.requested) for p in current.parameters)
+    for p in desired.parameters:
+        if requested.get(p.id) != p.requested:
+            changes.append(Change(
+                'PUT', '/circuit/module/%d/parameter/%s/requested' % (
+                    module_id, to_path_name(zr.Parameter.Id.Name(p.id))),
+                float(p.requested)))
+
+    values = dict((o.id, o.value) for o in current.options)
+    for o in desired.options:
+        if values.get(o.id) != o.value:
+            option = zr.Option()
+            option.value = o.value
+            changes.append(Change(
+                'PUT', '/circuit/module/%d/option/%s/value' % (
+                    module_id, to_path_name(zr.Option.Id.Name(o.id))),
+                option))
+
+    if (desired.HasField('clock_configuration') and
+        desired.clock_configuration != current.clock_configuration):
+        changes.append(Change('PUT', '/circuit/module/%d/clock' % module_id,
+                              desired.clock_configuration))
+    return changes
+
+def diff_circuits(current, desired, has_lookup_table=None):
+    if has_lookup_table is None:
+        has_lookup_table = lambda m: m.has_lookup_table
+
+    changes = []
+    keep = _kept_module_count(current, desired)
+
+    # Remove from the end so the ids of the modules being kept never move.
+    for module_id in reversed(range(keep, len(current.modules))):
+        changes.append(Change('DELETE', '/circuit/module/%d' % module_id, None))
+
+    current_nets = dict((_net_key(n), n) for n in current.nets
+                        if n.output_address.module_id < keep and
+                        n.input_address.module_id < keep)
+    desired_nets = dict((_net_key(n), n) for n in desired.nets)
+
+    # Disconnecting an input drops every net into it, so any surviving
+    # net into that input has to be re-added below.
+    disconnected = set()
+    for key in current_nets:
+        if key not in desired_nets:
+            disconnected.add((key[2], key[3]))
+    for module_id, input_id in sorted(disconnected):
+        changes.append(Change(
+            'POST', '/circuit/module/%d/inputs/%s/disconnect' % (
+                module_id, to_path_name(zr.InputId.Name(input_id))), None))
+    remaining_nets = set(key for key in current_nets
+                         if (key[2], key[3]) not in disconnected)
+
+    for module_id in range(keep):
+        changes.extend(_module_changes(module_id, current.modules[module_id],
+                                       desired.modules[module_id]))
+
+    for module_id in range(keep, len(desired.modules)):
+        m = zr.AnalogModule()
+        m.CopyFrom(desired.modules[module_id])
+        m.id = module_id
+        changes.append(Change('POST', '/circuit/modules', m))
+
+    for n in desired.nets:
+        if _net_key(n) not in remaining_nets:
+            changes.append(Change('POST', '/circuit/nets', n))
+
+    current_listeners = dict((_listener_key(l), l) for l in current.midi_listeners
+                             if l.module_id < keep)
+    desired_listeners = dict((_listener_key(l), l) for l in desired.midi_listeners)
+    for key, l in current_listeners.items():
+        if key not in desired_listeners:
+            changes.append(Change('DELETE', '/circuit/midi/listener', l))
+    for key, l in desired_listeners.items():
+        if key not in current_listeners:
+            changes.append(Change('POST', '/circuit/midi/listeners', l))
+
+    for module_id, m in enumerate(desired.modules):
+        if has_lookup_table(m):
+            if (module_id >= keep or
+                list(desired.lookup_table.data) != list(current.lookup_table.data)):
+                t = zr.LookupTable()
+                t.data[:] = desired.lookup_table.data
+                changes.append(Change(
+                    'PUT', '/circuit/module/%d/lookup-table' % module_id, t))
+            break
+
+    return changes
+
+def apply_changes(pipeline, changes):
+    responses = []
+    with pipeline:
+        for change in changes:
+            submit = getattr(pipeline, change.method.lower())
+            if change.payload is None:
+                responses.append(submit(change.url))
+            else:
+                responses.append(submit(change.url, change.payload))
+    for response in responses:
+        response.result()
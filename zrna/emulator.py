@@ -0,0 +1,713 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# A software stand-in for a Zrna board. It opens a pseudo-terminal, decodes
+# COBS framed zr.Requests from it and answers them from a model of the
+# circuit, MIDI listeners and stored circuits, so Client.connect() works
+# against emulator.device_path unchanged:
+#
+#   with Emulator(latency=0.001) as emulator:
+#       client = Client()
+#       client.connect(device_path=emulator.device_path)
+#
+# Module schemas come from a snapshot in the client's schema cache format
+# (see zrna.codegen --snapshot). Without one, a small built-in set of module
+# types is used; its parameters and ranges are placeholders, not what the
+# firmware reports. The analog side isn't modelled: realized values are the
+# requested ones clamped to the parameter range, and resource queries return
+# empty responses.
+
+from cobs import cobs
+from google.protobuf.message import DecodeError
+import os
+import select
+import sys
+import threading
+import time
+import tty
+from .util import FrameReader, enum_value_inflect, module_schema_from_dict
+from .util import read_module_schema, to_path_name
+import zrna.zr_pb2 as zr
+
+def usage():
+    print('usage: python -m zrna.emulator [/path/to/schema.json] [latency_seconds] [baud]')
+    sys.exit()
+
+def _module(type_name, parameters=(), options=(), inputs=(), outputs=(),
+            clocked=True, has_lookup_table=False):
+    # an entry in the schema cache's JSON format
+    module = {
+        'type': type_name,
+        'parameters': [{'id': p, 'requested': requested,
+                        'minimum': minimum, 'maximum': maximum}
+                       for p, requested, minimum, maximum in parameters],
+        'options': [{'id': o, 'value': values[0], 'validValues': list(values)}
+                    for o, values in options],
+        'hasLookupTable': has_lookup_table
+    }
+    if clocked:
+        module['clockConfiguration'] = {'clockA': 'CLOCK0'}
+    return {
+        'type': type_name,
+        'module': module,
+        'inputs': {'input': [{'id': i} for i in inputs]},
+        'outputs': {'output': list(outputs)}
+    }
+
+DEFAULT_VERSION = '0.0.0'
+DEFAULT_SCHEMA = [
+    _module('AUDIO_IN', outputs=['OUTPUT1', 'OUTPUT2'], clocked=False),
+    _module('AUDIO_OUT', inputs=['INPUT1', 'INPUT2'], clocked=False),
+    _module('GAIN_INV',
+            parameters=[('GAIN', 1.0, 0.01, 100.0)],
+            options=[('OUTPUT_PHASE', ['PHASE1', 'PHASE2'])],
+            inputs=['INPUT'], outputs=['OUTPUT']),
+    _module('FILTER_LOWPASS',
+            parameters=[('CORNER_FREQUENCY', 1.0, 0.01, 200.0),
+                        ('GAIN', 1.0, 0.01, 100.0)],
+            options=[('OUTPUT_PHASE', ['PHASE1', 'PHASE2'])],
+            inputs=['INPUT'], outputs=['OUTPUT']),
+    _module('SUM_TWO',
+            parameters=[('GAIN_INPUT1', 1.0, 0.01, 100.0),
+                        ('GAIN_INPUT2', 1.0, 0.01, 100.0)],
+            options=[('OUTPUT_PHASE', ['PHASE1', 'PHASE2'])],
+            inputs=['INPUT1', 'INPUT2'], outputs=['OUTPUT']),
+    _module('OSCILLATOR_SINE',
+            parameters=[('OSCILLATION_FREQUENCY', 1.0, 0.01, 100.0),
+                        ('PEAK_AMPLITUDE', 1.0, 0.0, 3.0)],
+            outputs=['OUTPUT']),
+    _module('TRANSFER_FUNCTION', inputs=['INPUT'], outputs=['OUTPUT'],
+            has_lookup_table=True),
+]
+
+LOOKUP_TABLE_RANGE = (-3.0, 3.0)
+ACKNOWLEDGE = b'\xc0\xff\xee'
+
+# Request routes. Literal path segments match resource ids; <name> segments
+# capture a path component of the given kind, or of any kind for <name>.
+ROUTES = [
+    ('GET', '/ping', 'ping'),
+    ('GET', '/version', 'version'),
+    ('GET', '/endpoints', 'endpoints'),
+    ('GET', '/modules', 'module_types'),
+    ('GET', '/module/<module_type>', 'module_description'),
+    ('GET', '/module/<module_type>/inputs', 'module_inputs'),
+    ('GET', '/module/<module_type>/outputs', 'module_outputs'),
+    ('GET', '/module/<module_type>/analog', 'empty'),
+    ('GET', '/module/<module_type>/analog/fits', 'module_fits'),
+    ('GET', '/circuit', 'get_circuit'),
+    ('POST', '/circuit', 'post_circuit'),
+    ('POST', '/circuit/default', 'clear_circuit'),
+    ('GET', '/circuit/bytestream', 'empty'),
+    ('GET', '/circuit/update-bytestream', 'empty'),
+    ('GET', '/circuit/modules', 'get_modules'),
+    ('POST', '/circuit/modules', 'add_module'),
+    ('GET', '/circuit/modules/count', 'module_count'),
+    ('GET', '/circuit/module/<integer_argument>', 'get_module'),
+    ('PATCH', '/circuit/module/<integer_argument>', 'patch_module'),
+    ('DELETE', '/circuit/module/<integer_argument>', 'remove_module'),
+    ('GET', '/circuit/module/<integer_argument>/parameter/<parameter_id>/<resource_id>',
+     'get_parameter'),
+    ('PUT', '/circuit/module/<integer_argument>/parameter/<parameter_id>/requested',
+     'put_parameter'),
+    ('POST', '/circuit/module/<integer_argument>/parameter/<parameter_id>/sweep', 'sweep'),
+    ('GET', '/circuit/module/<integer_argument>/option/<option_id>/value', 'get_option'),
+    ('PUT', '/circuit/module/<integer_argument>/option/<option_id>/value', 'put_option'),
+    ('GET', '/circuit/module/<integer_argument>/inputs/<input_id>/phase', 'input_phase'),
+    ('GET', '/circuit/module/<integer_argument>/outputs/<output_id>/phase', 'output_phase'),
+    ('POST', '/circuit/module/<integer_argument>/inputs/<input_id>/disconnect',
+     'disconnect_input'),
+    ('POST', '/circuit/module/<integer_argument>/outputs/<output_id>/disconnect',
+     'disconnect_output'),
+    ('GET', '/circuit/module/<integer_argument>/clock', 'get_clock'),
+    ('PUT', '/circuit/module/<integer_argument>/clock', 'put_clock'),
+    ('GET', '/circuit/module/<integer_argument>/lookup-table', 'get_lookup_table'),
+    ('PUT', '/circuit/module/<integer_argument>/lookup-table', 'put_lookup_table'),
+    ('GET', '/circuit/nets', 'get_nets'),
+    ('POST', '/circuit/nets', 'add_net'),
+    ('GET', '/circuit/nets/count', 'net_count'),
+    ('GET', '/circuit/midi/listeners', 'get_listeners'),
+    ('POST', '/circuit/midi/listeners', 'add_listener'),
+    ('DELETE', '/circuit/midi/listener', 'remove_listener'),
+    ('GET', '/system/state', 'get_state'),
+    ('PUT', '/system/state', 'put_state'),
+    ('GET', '/system/options', 'system_options'),
+    ('GET', '/system/resource/analog', 'empty'),
+    ('GET', '/system/resource/analog/debug', 'empty'),
+    ('GET', '/system/resource/analog/clock', 'get_clocks'),
+    ('PATCH', '/system/resource/analog/clock', 'patch_clocks'),
+    ('POST', '/system/resource/analog/clock/default', 'default_clocks'),
+    ('GET', '/system/resource/heap', 'empty'),
+    ('GET', '/system/resource/storage', 'empty'),
+    ('GET', '/storage/circuits', 'stored_circuits'),
+    ('GET', '/storage/debug', 'empty'),
+    ('POST', '/storage/debug', 'empty'),
+    ('POST', '/storage/circuit/startup/<name>', 'set_startup'),
+    ('DELETE', '/storage/circuit/startup', 'clear_startup'),
+    ('POST', '/storage/circuit/<name>', 'store'),
+    ('POST', '/storage/circuit/<name>/load', 'load'),
+    ('DELETE', '/storage/circuit/<name>', 'delete_stored'),
+]
+
+def _compile_route(pattern):
+    route = []
+    for segment in pattern.strip('/').split('/'):
+        if segment.startswith('<'):
+            route.append((segment[1:-1], None))
+        else:
+            route.append(('resource_id',
+                          zr.PathComponent.ResourceId.Value(enum_value_inflect(segment))))
+    return route
+
+def _component_name(kind, value):
+    # stored circuit names are parsed like any other path component, so a
+    # name that happens to be an enum value comes back as a number
+    field = zr.PathComponent.DESCRIPTOR.fields_by_name[kind]
+    if field.enum_type is not None:
+        return to_path_name(field.enum_type.values_by_number[value].name)
+    return str(value)
+
+class EmulatorError(Exception):
+    def __init__(self, status_code):
+        super().__init__(zr.StatusCode.Name(status_code))
+        self.status_code = status_code
+
+def _fail(status):
+    raise EmulatorError(zr.StatusCode.Value(status))
+
+class Emulator(object):
+    def __init__(self, schema=None, latency=0.0, baud=None):
+        # schema is the path of a schema snapshot. latency is added to every
+        # request; baud, if set, adds the time the request and response
+        # frames would take on a serial line at that rate.
+        if schema is None:
+            self.version = DEFAULT_VERSION
+            schema = [module_schema_from_dict(d) for d in DEFAULT_SCHEMA]
+            module_types = [s.type for s in schema]
+        else:
+            self.version, module_types, schema = read_module_schema(schema)
+        self.module_types = module_types
+        self.schema = dict((s.type, s) for s in schema)
+        self.latency = latency
+        self.baud = baud
+        self.routes = dict()
+        for method, pattern, handler in ROUTES:
+            self.routes.setdefault(zr.Method.Value(method), []).append(
+                (_compile_route(pattern), getattr(self, '_' + handler)))
+
+        self.lock = threading.Lock()
+        self.circuit = zr.Circuit()
+        self.lookup_tables = {}
+        self.stored = {}
+        self.startup = None
+        self.state = zr.SystemState.Value('PAUSED')
+        self.clocks = zr.ProcessorClockConfiguration()
+        self.next_listener_id = 1
+        self.request_count = 0
+
+        self.master = None
+        self.device_path = None
+        self.thread = None
+        self.stop_pipe = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.slave = slave
+        self.device_path = os.ttyname(slave)
+        self.stop_pipe = os.pipe()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.device_path
+
+    def stop(self):
+        if self.thread is None:
+            return
+        os.write(self.stop_pipe[1], b'x')
+        self.thread.join()
+        for fd in (self.master, self.slave) + self.stop_pipe:
+            os.close(fd)
+        self.thread = None
+
+    def _serve(self):
+        reader = FrameReader(None)
+        while True:
+            readable, _, _ = select.select([self.master, self.stop_pipe[0]], [], [])
+            if self.stop_pipe[0] in readable:
+                return
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            reader.feed(data)
+            while True:
+                size = reader.buffer.find(b'\x00') + 1
+                try:
+                    payload = reader.next_frame()
+                except cobs.DecodeError:
+                    self._respond(self._status_response('COBS_DECODE_ERROR'), size)
+                    continue
+                if payload is None:
+                    break
+                self._respond(self.handle_payload(payload), size)
+
+    def _respond(self, response, request_size):
+        out = bytearray(cobs.encode(response))
+        out.append(0x00)
+        delay = self.latency
+        if self.baud:
+            # 8N1: ten bits on the line per byte, both directions
+            delay += (request_size + len(out)) * 10.0 / self.baud
+        if delay > 0:
+            time.sleep(delay)
+        view = memoryview(out)
+        while view:
+            view = view[os.write(self.master, view):]
+
+    def _status_response(self, status):
+        response = zr.Response()
+        response.status_code = zr.StatusCode.Value(status)
+        return response.SerializeToString()
+
+    def handle_payload(self, payload):
+        # payload is a serialized zr.Request; returns the serialized response
+        request = zr.Request()
+        try:
+            request.ParseFromString(payload)
+        except DecodeError:
+            return self._status_response('PROTOBUF_DECODE_ERROR')
+        return self.handle(request).SerializeToString()
+
+    def handle(self, request):
+        response = zr.Response()
+        components = [(c.WhichOneof('type'), getattr(c, c.WhichOneof('type')))
+                      for c in request.url.path_components]
+        with self.lock:
+            self.request_count += 1
+            for route, handler in self.routes.get(request.method, []):
+                args = self._match(route, components)
+                if args is not None:
+                    try:
+                        handler(request, response, *args)
+                    except EmulatorError as e:
+                        response.Clear()
+                        response.status_code = e.status_code
+                    return response
+        response.status_code = zr.StatusCode.Value('NOT_FOUND')
+        return response
+
+    def _match(self, route, components):
+        if len(route) != len(components):
+            return None
+        args = []
+        for (kind, value), (component_kind, component_value) in zip(route, components):
+            if value is None:
+                if kind == 'name':
+                    component_value = _component_name(component_kind, component_value)
+                elif kind != component_kind:
+                    return None
+                args.append(component_value)
+            elif (kind, value) != (component_kind, component_value):
+                return None
+        return args
+
+    # module model
+
+    def _schema(self, module_type):
+        if module_type not in self.schema:
+            _fail('NOT_FOUND')
+        return self.schema[module_type]
+
+    def _module(self, module_id):
+        if module_id >= len(self.circuit.modules):
+            _fail('MODULE_NOT_FOUND')
+        return self.circuit.modules[module_id]
+
+    def _parameter(self, module, parameter_id):
+        for p in module.parameters:
+            if p.id == parameter_id:
+                return p
+        _fail('PARAMETER_NOT_FOUND')
+
+    def _option(self, module, option_id):
+        for o in module.options:
+            if o.id == option_id:
+                return o
+        _fail('OPTION_NOT_FOUND')
+
+    def _set_requested(self, p, value):
+        p.requested = value
+        p.realized = value
+        if p.minimum < p.maximum:
+            p.realized = min(max(value, p.minimum), p.maximum)
+
+    def _check_option_value(self, m, option_id, value):
+        valid_values = self._option(self._schema(m.type).module, option_id).valid_values
+        if valid_values and value not in valid_values:
+            _fail('INVALID_REQUEST_ERROR')
+
+    def _update_module(self, m, update):
+        for u in update.options:
+            self._check_option_value(m, u.id, u.value)
+        for u in update.parameters:
+            self._set_requested(self._parameter(m, u.id), u.requested)
+        for u in update.options:
+            self._option(m, u.id).value = u.value
+        if update.HasField('clock_configuration'):
+            m.clock_configuration.CopyFrom(update.clock_configuration)
+
+    def _new_module(self, module):
+        m = zr.AnalogModule()
+        m.CopyFrom(self._schema(module.type).module)
+        self._update_module(m, module)
+        for p in m.parameters:
+            self._set_requested(p, p.requested)
+        return m
+
+    def _load_circuit(self, circuit, lookup_table=None):
+        modules = [self._new_module(m) for m in circuit.modules]
+        self.circuit.Clear()
+        self.lookup_tables = {}
+        for i, m in enumerate(modules):
+            m.id = i
+            self.circuit.modules.add().CopyFrom(m)
+            if m.has_lookup_table and lookup_table is not None:
+                self.lookup_tables[i] = list(lookup_table.data)
+                lookup_table = None
+        for n in circuit.nets:
+            self._check_net(n)
+            self.circuit.nets.add().CopyFrom(n)
+        for l in circuit.midi_listeners:
+            self._insert_listener(l)
+
+    def _check_net(self, net):
+        self._module(net.output_address.module_id)
+        self._module(net.input_address.module_id)
+
+    def _insert_listener(self, listener):
+        m = self._module(listener.module_id)
+        if listener.WhichOneof('target') == 'parameter_id':
+            self._parameter(m, listener.parameter_id)
+        elif listener.WhichOneof('target') == 'option_id':
+            self._option(m, listener.option_id)
+        l = self.circuit.midi_listeners.add()
+        l.CopyFrom(listener)
+        l.id = self.next_listener_id
+        self.next_listener_id += 1
+
+    def _circuit(self):
+        circuit = zr.Circuit()
+        circuit.CopyFrom(self.circuit)
+        for module_id, data in sorted(self.lookup_tables.items()):
+            circuit.lookup_table.data[:] = data
+            break
+        return circuit
+
+    def _phase(self, module, option_id, default):
+        for o in module.options:
+            if o.id == zr.Option.Id.Value(option_id):
+                return o.value
+        return zr.Option.Value.Value(default)
+
+    # handlers
+
+    def _empty(self, request, response, *args):
+        pass
+
+    def _ping(self, request, response):
+        response.acknowledge.data = ACKNOWLEDGE
+
+    def _version(self, request, response):
+        major, minor, patch = (int(v) for v in self.version.split('.'))
+        response.version.major = major
+        response.version.minor = minor
+        response.version.patch = patch
+
+    def _endpoints(self, request, response):
+        for method, pattern, _ in ROUTES:
+            # placeholders have no value to put in the URL, so the pattern
+            # goes in the docstring
+            e = response.endpoints.endpoint.add()
+            e.method.append(zr.Method.Value(method))
+            for kind, value in _compile_route(pattern):
+                if value is not None:
+                    e.url.path_components.add().resource_id = value
+            e.docstring = pattern
+
+    def _module_types(self, request, response):
+        response.module_types.module_type[:] = self.module_types
+
+    def _module_description(self, request, response, module_type):
+        response.modules.module.add().CopyFrom(self._schema(module_type).module)
+
+    def _module_inputs(self, request, response, module_type):
+        response.inputs.CopyFrom(self._schema(module_type).inputs)
+
+    def _module_outputs(self, request, response, module_type):
+        response.outputs.CopyFrom(self._schema(module_type).outputs)
+
+    def _module_fits(self, request, response, module_type):
+        self._schema(module_type)
+        response.module_fits = True
+
+    def _get_circuit(self, request, response):
+        response.circuit.CopyFrom(self._circuit())
+
+    def _post_circuit(self, request, response):
+        self._load_circuit(request.circuit, request.circuit.lookup_table)
+
+    def _clear_circuit(self, request, response):
+        self.circuit.Clear()
+        self.lookup_tables = {}
+
+    def _get_modules(self, request, response):
+        response.modules.module.extend(self.circuit.modules)
+
+    def _add_module(self, request, response):
+        m = self.circuit.modules.add()
+        m.CopyFrom(self._new_module(request.module))
+        m.id = len(self.circuit.modules) - 1
+
+    def _module_count(self, request, response):
+        response.module_count = len(self.circuit.modules)
+
+    def _get_module(self, request, response, module_id):
+        response.modules.module.add().CopyFrom(self._module(module_id))
+
+    def _patch_module(self, request, response, module_id):
+        self._update_module(self._module(module_id), request.module)
+
+    def _remove_module(self, request, response, module_id):
+        self._module(module_id)
+        circuit = self._circuit()
+        del circuit.modules[module_id]
+
+        def renumber(i):
+            return i - 1 if i > module_id else i
+
+        nets = [n for n in circuit.nets
+                if module_id not in (n.output_address.module_id, n.input_address.module_id)]
+        for n in nets:
+            n.output_address.module_id = renumber(n.output_address.module_id)
+            n.input_address.module_id = renumber(n.input_address.module_id)
+        listeners = [l for l in circuit.midi_listeners if l.module_id != module_id]
+        for l in listeners:
+            l.module_id = renumber(l.module_id)
+        tables = dict((renumber(i), data) for i, data in self.lookup_tables.items()
+                      if i != module_id)
+
+        for i, m in enumerate(circuit.modules):
+            m.id = i
+        del circuit.nets[:]
+        circuit.nets.extend(nets)
+        del circuit.midi_listeners[:]
+        circuit.midi_listeners.extend(listeners)
+        circuit.ClearField('lookup_table')
+        self.circuit.CopyFrom(circuit)
+        self.lookup_tables = tables
+
+    def _get_parameter(self, request, response, module_id, parameter_id, field):
+        p = self._parameter(self._module(module_id), parameter_id)
+        name = zr.PathComponent.ResourceId.Name(field).lower()
+        if name not in ('requested', 'realized', 'minimum', 'maximum'):
+            _fail('NOT_FOUND')
+        setattr(response, name, getattr(p, name))
+
+    def _put_parameter(self, request, response, module_id, parameter_id):
+        self._set_requested(self._parameter(self._module(module_id), parameter_id),
+                            request.requested)
+
+    def _sweep(self, request, response, module_id, parameter_id):
+        # sweeps finish instantly
+        self._set_requested(self._parameter(self._module(module_id), parameter_id),
+                            request.parameter_sweep.target_value)
+
+    def _get_option(self, request, response, module_id, option_id):
+        response.option_value = self._option(self._module(module_id), option_id).value
+
+    def _put_option(self, request, response, module_id, option_id):
+        m = self._module(module_id)
+        o = self._option(m, option_id)
+        self._check_option_value(m, option_id, request.option_value)
+        o.value = request.option_value
+
+    def _input_phase(self, request, response, module_id, input_id):
+        response.option_value = self._phase(self._module(module_id), 'INPUT_PHASE', 'PHASE1')
+
+    def _output_phase(self, request, response, module_id, output_id):
+        response.option_value = self._phase(self._module(module_id), 'OUTPUT_PHASE', 'CONTINUOUS')
+
+    def _disconnect(self, keep):
+        nets = [n for n in self.circuit.nets if keep(n)]
+        del self.circuit.nets[:]
+        self.circuit.nets.extend(nets)
+
+    def _disconnect_input(self, request, response, module_id, input_id):
+        self._module(module_id)
+        self._disconnect(lambda n: (n.input_address.module_id, n.input_address.input_id) !=
+                         (module_id, input_id))
+
+    def _disconnect_output(self, request, response, module_id, output_id):
+        self._module(module_id)
+        self._disconnect(lambda n: (n.output_address.module_id, n.output_address.output_id) !=
+                         (module_id, output_id))
+
+    def _get_clock(self, request, response, module_id):
+        response.module_clock_configuration.CopyFrom(
+            self._module(module_id).clock_configuration)
+
+    def _put_clock(self, request, response, module_id):
+        self._module(module_id).clock_configuration.CopyFrom(
+            request.module_clock_configuration)
+
+    def _get_lookup_table(self, request, response, module_id):
+        if not self._module(module_id).has_lookup_table:
+            _fail('NOT_FOUND')
+        response.lookup_table.data[:] = self.lookup_tables.get(module_id, [])
+        response.lookup_table.minimum_possible_value = LOOKUP_TABLE_RANGE[0]
+        response.lookup_table.maximum_possible_value = LOOKUP_TABLE_RANGE[1]
+
+    def _put_lookup_table(self, request, response, module_id):
+        if not self._module(module_id).has_lookup_table:
+            _fail('NOT_FOUND')
+        data = list(request.lookup_table.data)
+        if any(v < LOOKUP_TABLE_RANGE[0] or v > LOOKUP_TABLE_RANGE[1] for v in data):
+            _fail('LOOKUP_TABLE_VALUE_OUT_OF_RANGE')
+        self.lookup_tables[module_id] = data
+
+    def _get_nets(self, request, response):
+        response.nets.net.extend(self.circuit.nets)
+
+    def _add_net(self, request, response):
+        self._check_net(request.net)
+        self.circuit.nets.add().CopyFrom(request.net)
+
+    def _net_count(self, request, response):
+        response.net_count = len(self.circuit.nets)
+
+    def _get_listeners(self, request, response):
+        response.midi_listeners.midi_listener.extend(self.circuit.midi_listeners)
+
+    def _add_listener(self, request, response):
+        self._insert_listener(request.midi_listener)
+
+    def _remove_listener(self, request, response):
+        # matched on module, target and listener kind, which is all the
+        # client's stop_listening() templates fill in; a template without a
+        # kind removes every listener on the target
+        t = request.midi_listener
+
+        def matches(l):
+            return (l.module_id == t.module_id and
+                    l.WhichOneof('target') == t.WhichOneof('target') and
+                    l.parameter_id == t.parameter_id and l.option_id == t.option_id and
+                    t.WhichOneof('type') in (None, l.WhichOneof('type')))
+
+        listeners = [l for l in self.circuit.midi_listeners if not matches(l)]
+        if len(listeners) == len(self.circuit.midi_listeners):
+            _fail('MIDI_LISTENER_NOT_FOUND')
+        del self.circuit.midi_listeners[:]
+        self.circuit.midi_listeners.extend(listeners)
+
+    def _get_state(self, request, response):
+        response.system_state = self.state
+
+    def _put_state(self, request, response):
+        self.state = request.system_state
+        if self.state == zr.SystemState.Value('RESETTING'):
+            self.circuit.Clear()
+            self.lookup_tables = {}
+            self.state = zr.SystemState.Value('PAUSED')
+            if self.startup in self.stored:
+                self._load_circuit(*self.stored[self.startup])
+
+    def _system_options(self, request, response):
+        for option_id in zr.SystemOption.Id.values():
+            response.system_options.system_option.add().id = option_id
+
+    def _get_clocks(self, request, response):
+        response.processor_clock_configuration.CopyFrom(self.clocks)
+
+    def _patch_clocks(self, request, response):
+        for update in request.processor_clock_configuration.sys_clock:
+            for clock in self.clocks.sys_clock:
+                if clock.id == update.id:
+                    clock.CopyFrom(update)
+                    break
+            else:
+                self.clocks.sys_clock.add().CopyFrom(update)
+
+    def _default_clocks(self, request, response):
+        self.clocks.Clear()
+
+    def _stored_circuits(self, request, response):
+        for name in sorted(self.stored):
+            response.storage_response.file_info.add().name = name
+
+    def _set_startup(self, request, response, name):
+        if name not in self.stored:
+            _fail('NOT_FOUND')
+        self.startup = name
+
+    def _clear_startup(self, request, response):
+        self.startup = None
+
+    def _store(self, request, response, name):
+        circuit = self._circuit()
+        self.stored[name] = (circuit, circuit.lookup_table)
+
+    def _load(self, request, response, name):
+        if name not in self.stored:
+            _fail('NOT_FOUND')
+        self._load_circuit(*self.stored[name])
+
+    def _delete_stored(self, request, response, name):
+        if name not in self.stored:
+            _fail('NOT_FOUND')
+        del self.stored[name]
+        if self.startup == name:
+            self.startup = None
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        usage()
+    schema = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != '-' else None
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    baud = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    with Emulator(schema, latency, baud) as emulator:
+        print('Emulating a Zrna board on %s' % emulator.device_path)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
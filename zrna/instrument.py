@@ -0,0 +1,229 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# Per-endpoint request statistics. While a Connection has an Instrument,
+# every request it sends is recorded as a Sample and handed to each sink.
+# A sink is any callable taking a Sample, so a plain function works as a
+# callback; Aggregator keeps totals and latency histograms in memory and
+# PrometheusFile writes them out in the Prometheus text format.
+#
+# Endpoints are the request method and URL with module ids and circuit
+# names replaced by placeholders, e.g.
+# 'PUT /circuit/module/<n>/parameter/gain/requested'. Times are in seconds:
+# encode is protobuf serialization, wire is framing plus the round trip to
+# the device, and decode is parsing the response. Byte counts are the
+# serialized request and response sizes, before COBS framing. The ping a
+# Connection sends while opening isn't recorded.
+
+from bisect import bisect_left
+from collections import namedtuple
+import os
+import threading
+import time
+from .util import lru_cache, to_path_name
+import zrna.zr_pb2 as zr
+
+Sample = namedtuple('Sample', ['endpoint', 'bytes_sent', 'bytes_received',
+                               'encode', 'wire', 'decode'])
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float('inf'))
+
+TIMINGS = ('encode', 'wire', 'decode', 'total')
+
+@lru_cache(maxsize=1024)
+def _endpoint(method, serialized_url):
+    url = zr.URL()
+    url.ParseFromString(serialized_url)
+    parts = []
+    for c in url.path_components:
+        kind = c.WhichOneof('type')
+        if kind == 'integer_argument':
+            parts.append('<n>')
+        elif kind == 'string_argument':
+            parts.append('<name>')
+        else:
+            enum_type = zr.PathComponent.DESCRIPTOR.fields_by_name[kind].enum_type
+            parts.append(to_path_name(enum_type.values_by_number[getattr(c, kind)].name))
+    return '%s /%s' % (zr.Method.Name(method), '/'.join(parts))
+
+def request_endpoint(request):
+    return _endpoint(request.method, request.url.SerializeToString())
+
+class Instrument(object):
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+
+    def endpoint(self, request):
+        return request_endpoint(request)
+
+    def payload_endpoint(self, payload):
+        request = zr.Request()
+        request.ParseFromString(payload)
+        return self.endpoint(request)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def record(self, endpoint, bytes_sent, bytes_received, encode, wire, decode):
+        sample = Sample(endpoint, bytes_sent, bytes_received, encode, wire, decode)
+        for sink in self.sinks:
+            sink(sample)
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the qth fraction of observations
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+class EndpointStats(object):
+    def __init__(self):
+        self.count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timings = dict((name, Histogram()) for name in TIMINGS)
+
+    def add(self, sample):
+        self.count += 1
+        self.bytes_sent += sample.bytes_sent
+        self.bytes_received += sample.bytes_received
+        self.timings['encode'].observe(sample.encode)
+        self.timings['wire'].observe(sample.wire)
+        self.timings['decode'].observe(sample.decode)
+        self.timings['total'].observe(sample.encode + sample.wire + sample.decode)
+
+class Aggregator(object):
+    # Totals and histograms per endpoint. Samples can come from the
+    # coalescing thread as well as the caller's, hence the lock.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __call__(self, sample):
+        with self.lock:
+            stats = self.endpoints.get(sample.endpoint)
+            if stats is None:
+                stats = self.endpoints[sample.endpoint] = EndpointStats()
+            stats.add(sample)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def by_total_time(self):
+        with self.lock:
+            return sorted(self.endpoints.items(),
+                          key=lambda e: e[1].timings['total'].sum, reverse=True)
+
+    def report(self):
+        # p99 is the upper bound of the histogram bucket it falls in
+        lines = ['%-56s %7s %10s %10s %9s %9s %9s' % (
+            'endpoint', 'count', 'sent', 'received', 'total ms', 'wire ms', 'p99 ms')]
+        for endpoint, stats in self.by_total_time():
+            total = stats.timings['total']
+            lines.append('%-56s %7d %10d %10d %9.2f %9.2f %9.2f' % (
+                endpoint, stats.count, stats.bytes_sent, stats.bytes_received,
+                total.sum * 1e3, stats.timings['wire'].sum * 1e3,
+                total.quantile(0.99) * 1e3))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+class PrometheusFile(object):
+    # Aggregates samples and rewrites `path` with the Prometheus text
+    # format at most once every `interval` seconds, e.g. for the node
+    # exporter's textfile collector. write() forces an update.
+    def __init__(self, path, interval=1.0, prefix='zrna_client'):
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self.aggregator = Aggregator()
+        self.lock = threading.Lock()
+        self.written = None
+
+    def __call__(self, sample):
+        self.aggregator(sample)
+        now = time.time()
+        if self.written is None or now - self.written >= self.interval:
+            self.write()
+
+    def exposition(self):
+        p = self.prefix
+        endpoints = self.aggregator.by_total_time()
+        lines = []
+        for name, help_text, value in (
+                ('requests_total', 'Requests sent.', lambda s: s.count),
+                ('sent_bytes_total', 'Serialized request bytes.', lambda s: s.bytes_sent),
+                ('received_bytes_total', 'Serialized response bytes.', lambda s: s.bytes_received)):
+            lines.append('# HELP %s_%s %s' % (p, name, help_text))
+            lines.append('# TYPE %s_%s counter' % (p, name))
+            for endpoint, stats in endpoints:
+                lines.append('%s_%s{endpoint="%s"} %d' % (p, name, _label(endpoint), value(stats)))
+
+        lines.append('# HELP %s_request_seconds Request latency by phase.' % p)
+        lines.append('# TYPE %s_request_seconds histogram' % p)
+        for endpoint, stats in endpoints:
+            for phase in TIMINGS:
+                h = stats.timings[phase]
+                labels = 'endpoint="%s",phase="%s"' % (_label(endpoint), phase)
+                for bound, total in h.cumulative():
+                    lines.append('%s_request_seconds_bucket{%s,le="%s"} %d' % (
+                        p, labels, _bound(bound), total))
+                lines.append('%s_request_seconds_sum{%s} %r' % (p, labels, h.sum))
+                lines.append('%s_request_seconds_count{%s} %d' % (p, labels, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        # written to a temporary file and renamed so readers never see a
+        # partial file
+        with self.lock:
+            self.written = time.time()
+            temporary = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(temporary, 'w') as f:
+                f.write(self.exposition())
+            os.rename(temporary, self.path)
@@ -0,0 +1,214 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# Recording and replaying device sessions. Client.connect(record=path)
+# logs every request and response payload the connection exchanges, and
+# Client.connect(device_path=path, interface='replay') serves a client the
+# recorded responses instead of talking to a device:
+#
+#   client.connect(device_path=ReplayPort(path, speed=None), interface='replay')
+#
+# replays without any device latency. The replaying client has to send the
+# same requests in the same order. Whether a module's schema is fetched
+# depends on what the schema cache already holds, so Client.connect
+# ignores schema_cache when recording or replaying.
+#
+# A session log starts with MAGIC, followed by one record per payload: a
+# little-endian header with the direction (REQUEST or RESPONSE), seconds
+# since recording started as a double and the payload length as a uint32,
+# then the payload itself, i.e. the serialized protobuf without COBS
+# framing.
+
+from cobs import cobs
+from google.protobuf import text_format
+import struct
+import threading
+import time
+from timeit import default_timer
+from .util import FrameReader, to_path_name
+import zrna.zr_pb2 as zr
+
+MAGIC = b'ZRNASES1'
+RECORD_HEADER = struct.Struct('<BdI')
+REQUEST = 0
+RESPONSE = 1
+
+class ReplayError(Exception):
+    pass
+
+class Recorder(object):
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.start = default_timer()
+
+    def record(self, direction, payload):
+        with self.lock:
+            self.file.write(RECORD_HEADER.pack(direction, default_timer() - self.start,
+                                               len(payload)))
+            self.file.write(payload)
+            if direction == RESPONSE:
+                # so an interrupted session still has every complete exchange
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_session(path):
+    # yields (direction, timestamp, payload) records
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ReplayError('%s is not a zrna session log' % path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            direction, timestamp, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield direction, timestamp, payload
+
+class RecordingPort(object):
+    # Wraps the serial port a Connection talks to and records each frame
+    # written to or read from it.
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.reader = FrameReader(None)
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def write(self, data):
+        # the client writes whole frames
+        for frame in bytes(data).split(b'\x00')[:-1]:
+            self.recorder.record(REQUEST, cobs.decode(frame))
+        return self.port.write(data)
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        self.reader.feed(data)
+        payload = self.reader.next_frame()
+        while payload is not None:
+            self.recorder.record(RESPONSE, payload)
+            payload = self.reader.next_frame()
+        return data
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def close(self):
+        self.port.close()
+        self.recorder.close()
+
+class ReplayPort(object):
+    # Stands in for the serial port. Every request written has to match
+    # the next recorded one (unless strict is False) and makes the recorded
+    # response readable after the recorded latency divided by speed, or
+    # straight away if speed is None.
+    def __init__(self, path, speed=1.0, strict=True):
+        self.speed = speed
+        self.strict = strict
+        requests = []
+        responses = []
+        for direction, timestamp, payload in read_session(path):
+            (requests if direction == REQUEST else responses).append((timestamp, payload))
+        self.exchanges = [(request, response[1], response[0] - request[0])
+                          for request, response in zip(requests, responses)]
+        self.position = 0
+        self.reader = FrameReader(None)
+        # (due time, framed response) in request order
+        self.scheduled = []
+        self.buffer = bytearray()
+
+    @property
+    def in_waiting(self):
+        self._release(default_timer())
+        return len(self.buffer)
+
+    def _release(self, now):
+        while self.scheduled and self.scheduled[0][0] <= now:
+            self.buffer.extend(self.scheduled.pop(0)[1])
+
+    def _parse(self, payload):
+        request = zr.Request()
+        request.ParseFromString(payload)
+        return request
+
+    def _describe(self, payload):
+        request = self._parse(payload)
+        parts = []
+        for c in request.url.path_components:
+            kind = c.WhichOneof('type')
+            enum_type = zr.PathComponent.DESCRIPTOR.fields_by_name[kind].enum_type
+            if enum_type is None:
+                parts.append(str(getattr(c, kind)))
+            else:
+                parts.append(to_path_name(enum_type.values_by_number[getattr(c, kind)].name))
+        return '%s /%s' % (zr.Method.Name(request.method), '/'.join(parts))
+
+    def _text(self, payload):
+        # URLs aren't included; they're in the METHOD /path description
+        request = self._parse(payload)
+        request.ClearField('url')
+        return text_format.MessageToString(request, as_one_line=True)
+
+    def write(self, data):
+        self.reader.feed(data)
+        payload = self.reader.next_frame()
+        while payload is not None:
+            if self.position >= len(self.exchanges):
+                raise ReplayError('request past the end of the recorded session: %s' %
+                                  self._describe(payload))
+            (_, recorded), response, latency = self.exchanges[self.position]
+            if self.strict and payload != recorded:
+                raise ReplayError(
+                    'request %d differs from the recorded session: sent %s, recorded %s\n'
+                    'sent:     %s\nrecorded: %s' % (
+                        self.position, self._describe(payload), self._describe(recorded),
+                        self._text(payload), self._text(recorded)))
+            self.position += 1
+            due = default_timer()
+            if self.speed is not None:
+                due += latency / self.speed
+            frame = bytearray(cobs.encode(response))
+            frame.append(0x00)
+            self.scheduled.append((due, frame))
+            payload = self.reader.next_frame()
+        return len(data)
+
+    def read(self, size=1):
+        now = default_timer()
+        self._release(now)
+        if not self.buffer:
+            if not self.scheduled:
+                raise ReplayError('read with no request awaiting a response')
+            time.sleep(max(0, self.scheduled[0][0] - now))
+            self._release(self.scheduled[0][0])
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        pass
@@ -0,0 +1,86 @@
+# Copyright 2019 Zrna Research LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+from __future__ import (absolute_import, division,
+                        print_function)
+from builtins import (ascii, bytes, chr, dict, filter, hex, input,
+                      int, map, next, oct, open, pow, range, round,
+                      str, super, zip)
+
+# Lookup table synthesis. Every function evaluates the table over `size`
+# evenly spaced inputs across `domain` and returns float32 values ready to
+# assign to LookupTable.requested. Passing bounds=module.lookup_table.bounds
+# clamps the result to the range the firmware accepts, so a push can't
+# fail with LOOKUP_TABLE_VALUE_OUT_OF_RANGE.
+#
+# polynomial, chebyshev and interpolate also take a batch: coefficient
+# arrays of shape (variants, terms), or an array of mix positions, give
+# one table per row.
+
+import numpy
+from numpy.polynomial import chebyshev as cheb
+from numpy.polynomial import polynomial as poly
+
+TABLE_SIZE = 256
+DOMAIN = (-1.0, 1.0)
+
+def inputs(size=TABLE_SIZE, domain=DOMAIN):
+    return numpy.linspace(domain[0], domain[1], size)
+
+def clamp(table, bounds):
+    table = numpy.asarray(table, dtype=numpy.float32)
+    if bounds is None:
+        return table
+    return numpy.clip(table, bounds[0], bounds[1]).astype(numpy.float32)
+
+def _batched(coefficients, evaluate, size, domain, bounds):
+    coefficients = numpy.asarray(coefficients, dtype=numpy.float64)
+    # numpy evaluates trailing coefficient axes as separate polynomials
+    return clamp(evaluate(inputs(size, domain), coefficients.T), bounds)
+
+def polynomial(coefficients, size=TABLE_SIZE, domain=DOMAIN, bounds=None):
+    # coefficients in increasing order: c[0] + c[1] x + c[2] x^2 ...
+    return _batched(coefficients, poly.polyval, size, domain, bounds)
+
+def chebyshev(coefficients, size=TABLE_SIZE, domain=DOMAIN, bounds=None):
+    # Coefficient n weights T_n, which turns a full scale sine into its
+    # nth harmonic, so the coefficients are the harmonic amplitudes of the
+    # shaped output.
+    return _batched(coefficients, cheb.chebval, size, domain, bounds)
+
+def piecewise(points, size=TABLE_SIZE, domain=DOMAIN, bounds=None):
+    # straight segments through (x, y) breakpoints, held flat outside them
+    points = sorted(points)
+    return clamp(numpy.interp(inputs(size, domain),
+                              [x for x, _ in points],
+                              [y for _, y in points]), bounds)
+
+def sampled(f, size=TABLE_SIZE, domain=DOMAIN, bounds=None):
+    # f is called once with the whole input array; callables that only
+    # take scalars are vectorized
+    x = inputs(size, domain)
+    try:
+        table = numpy.asarray(f(x), dtype=numpy.float64)
+    except (TypeError, ValueError):
+        table = None
+    if table is None or table.shape != x.shape:
+        table = numpy.vectorize(f, otypes=[numpy.float64])(x)
+    return clamp(table, bounds)
+
+def interpolate(a, b, t, bounds=None):
+    # t = 0 gives a and t = 1 gives b; an array of t gives one table per row
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    t = numpy.asarray(t, dtype=numpy.float64)[..., numpy.newaxis]
+    return clamp(a + (b - a) * t, bounds)
@@ -22,29 +22,139 @@ import serial
 import serial.tools.list_ports
 import sys
 import os
-import math
+import mmap
 import platform
+import struct
+import zlib
+
+# The bootloader takes the image size as a big endian uint32, then the image
+# in PACKET_SIZE packets, acknowledging each with one byte once it's
+# written. Packets are written up to `window` ahead of their acks. The
+# default of 1 is the lockstep transfer the bootloader has always seen;
+# larger windows (--window N) rely on USB flow control holding back
+# whatever the bootloader isn't ready to read yet and are opt-in until
+# they've been checked against hardware.
+#
+# The bootloader can't report what it has flashed or pick up part way
+# through an image, so verification is limited to checking the image
+# before it's sent (size and, with --crc, its CRC32) and that every packet
+# was acknowledged. An interrupted transfer has to be restarted from the
+# beginning.
+
+PACKET_SIZE = 1024
+DEFAULT_WINDOW = 1
+# seconds to wait for an acknowledgement; erasing a flash sector can take a while
+ACK_TIMEOUT = 30
+
+class FirmwareUpdateError(Exception):
+    pass
 
 def usage():
-    print('usage: python -m zrna.update_firmware /path/to/m.sfb [device_path_or_com_port]')
+    print('usage: python -m zrna.update_firmware [--window N] [--crc CRC32] /path/to/m.sfb [device_path_or_com_port]')
     sys.exit()
 
+def find_bootloader():
+    for com_port in serial.tools.list_ports.comports():
+        if com_port.description == 'zrna bootloader':
+            return com_port.device
+    return None
+
+def image_crc(image):
+    return zlib.crc32(image) & 0xffffffff
+
+class ProgressBar(object):
+    # one line, redrawn only when the percentage changes
+    def __init__(self, width=40):
+        self.width = width
+        self.percent = None
+
+    def __call__(self, done, total):
+        percent = 100 * done // total
+        if percent == self.percent:
+            return
+        self.percent = percent
+        filled = self.width * done // total
+        sys.stdout.write('\r[%s%s] %3d%% %d/%d packets' % (
+            '#' * filled, ' ' * (self.width - filled), percent, done, total))
+        if done == total:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+
+def upload(s, image, window=DEFAULT_WINDOW, packet_size=PACKET_SIZE, progress=None):
+    # Sends image (anything sliceable, e.g. an mmap) and returns the number
+    # of packets acknowledged. progress(acked, packet_count) is called
+    # whenever acknowledgements arrive.
+    if window < 1:
+        raise ValueError('window must be at least 1')
+    size = len(image)
+    packet_count = (size + packet_size - 1) // packet_size
+    s.write(struct.pack('>I', size))
+
+    sent = 0
+    acked = 0
+    while acked < packet_count:
+        while sent < packet_count and sent - acked < window:
+            s.write(image[sent * packet_size:(sent + 1) * packet_size])
+            sent += 1
+        acks = s.read(max(1, min(s.in_waiting, sent - acked)))
+        if not acks:
+            raise FirmwareUpdateError(
+                'no acknowledgement for packet %d of %d' % (acked + 1, packet_count))
+        acked += len(acks)
+        if progress is not None:
+            progress(acked, packet_count)
+    return acked
+
+def _option(args, name, parse):
+    if name not in args:
+        return None
+    i = args.index(name)
+    if i + 1 >= len(args):
+        usage()
+    value = args[i + 1]
+    del args[i:i + 2]
+    try:
+        return parse(value)
+    except ValueError:
+        usage()
+
 def main():
-    if not (len(sys.argv) > 1):
+    args = sys.argv[1:]
+    window = _option(args, '--window', int)
+    if window is None:
+        window = DEFAULT_WINDOW
+    elif window < 1:
+        usage()
+    expected_crc = _option(args, '--crc', lambda v: int(v, 16))
+    if not args:
         usage()
 
-    device = sys.argv[2] if len(sys.argv) == 3 else None
-    if device is None:
-        for com_port in serial.tools.list_ports.comports():
-            if com_port.description == 'zrna bootloader':
-                device = com_port.device
+    path = args[0]
+    if not os.path.exists(path):
+        print("Couldn't find the specified firmware image.")
+        sys.exit()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            print('The specified firmware image is empty.')
+            sys.exit()
+        image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    size = len(image)
+    crc = image_crc(image)
+    packet_count = (size + PACKET_SIZE - 1) // PACKET_SIZE
+    print('Firmware image size: %d bytes, CRC32: %08x' % (size, crc))
+    if expected_crc is not None and crc != expected_crc:
+        print('Firmware image CRC32 %08x does not match the expected %08x. Not flashing.' %
+              (crc, expected_crc))
+        sys.exit(1)
 
+    device = args[1] if len(args) > 1 else find_bootloader()
     if device is None:
         print("Couldn't connect to the zrna bootloader. Check connections and try specifying the device path:")
         usage()
 
     try:
-        s = serial.Serial(device)
+        s = serial.Serial(device, timeout=ACK_TIMEOUT)
         if platform.system() == 'Darwin':
             os.system('stty -f %s 1200' % device)
     except serial.serialutil.SerialException:
@@ -52,36 +162,19 @@ def main():
         sys.exit()
 
     print('Connected to bootloader.')
+    print('Writing %d packets, up to %d ahead of acknowledgements.' % (packet_count, window))
 
-    path = sys.argv[1]
-    if not os.path.exists(path):
-        print("Couldn't find the specified firmware image.")
-    filesize = os.path.getsize(path)
-    packet_size = 1024
-    packet_count = math.ceil(filesize / packet_size)
-
-    filesize_bytes = bytearray()
-    filesize_bytes.append((filesize & 0xff000000) >> 24)
-    filesize_bytes.append((filesize & 0xff0000) >> 16)
-    filesize_bytes.append((filesize & 0xff00) >> 8)
-    filesize_bytes.append((filesize & 0xff))
-
-    print('Firmware image size: %d bytes' % filesize)
-    print('Pushing image size to device.')
-
-    s.write(filesize_bytes)
+    try:
+        acked = upload(s, image, window, progress=ProgressBar())
+    except (FirmwareUpdateError, serial.serialutil.SerialException) as e:
+        print('\nFirmware flash failed: %s' % e)
+        print('Reset the device into the bootloader and flash the image again.')
+        sys.exit(1)
+    finally:
+        image.close()
 
-    packet_index = 0
-    with open(path, 'rb') as f:
-        while True:
-            packet = f.read(packet_size)
-            if not packet:
-                break
-            print('Writing packet %d of %d.' % (packet_index + 1, packet_count))
-            s.write(packet)
-            s.read(1)
-            packet_index += 1
-        print('Firmware flash complete. Device rebooting.')
+    print('All %d packets (%d bytes) acknowledged.' % (acked, size))
+    print('Firmware flash complete. Device rebooting.')
 
 if __name__ == "__main__":
     main()
@@ -19,14 +19,27 @@ from builtins import (ascii, bytes, chr, dict, filter, hex, input,
                       str, super, zip)
 
 from cobs import cobs
-from google.protobuf.json_format import ParseDict
+from collections import OrderedDict, deque, namedtuple
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
 from time import sleep
+from timeit import default_timer
 import inflection
+import json
+import numpy
+import os
 import serial
 import serial.tools.list_ports
 import sys
+import threading
 import zrna.zr_pb2 as zr
 
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2 has no lru_cache; URLs are just built on every request there.
+    def lru_cache(maxsize=128):
+        return lambda f: f
+
 FT232H_ENABLED = False
 
 if FT232H_ENABLED:
@@ -34,37 +47,50 @@ if FT232H_ENABLED:
     # which supports UART, I2C and SPI
     import Adafruit_GPIO.FT232H as FT232H
 
+DEFAULT_SCHEMA_CACHE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'zrna')
+
+ModuleSchema = namedtuple('ModuleSchema', ['type', 'module', 'inputs', 'outputs'])
+
 class Connection(object):
-    def __init__(self, interface='usb_serial', device_path=None, debug=False):
+    # interface='replay' serves a session recorded with record=path back
+    # from device_path, a log path or a zrna.session.ReplayPort.
+    def __init__(self, interface='usb_serial', device_path=None, debug=False, record=None):
         self.debug = debug
         self.connection = None
+        # a zrna.instrument.Instrument recording every request, if set
+        self.instrument = None
+        self.lock = threading.RLock()
         if interface == 'usb_serial' and device_path is None:
-            for com_port in serial.tools.list_ports.comports():
-                if com_port.description == 'zrna midi/cdc':
-                    if self.debug:
-                        print(com_port.device)
-                    self.connection = self._get_connection(interface, com_port.device)
-                    break
+            device_path = find_device()
+            if device_path is not None:
+                if self.debug:
+                    print(device_path)
+                self.connection = self._get_connection(interface, device_path)
         else:
             self.connection = self._get_connection(interface, device_path)
+        if record is not None and self.connection is not None:
+            from .session import Recorder, RecordingPort
+            self.connection = RecordingPort(self.connection, Recorder(record))
+        self.reader = FrameReader(self.connection)
         if not self._ping_ok():
             raise ConnectionError()
 
     def _ping_ok(self):
         if self.connection is None:
             return False
-        response = self.get('/ping')
-        ack_bytes = bytearray(response.acknowledge.data)
-        return all(
-            [response.status_code == zr.StatusCode.Value('OK'),
-             ack_bytes[0] == 0xc0,
-             ack_bytes[1] == 0xff,
-             ack_bytes[2] == 0xee])
+        return ping_ok(self.get('/ping'))
 
     def _get_connection(self, connection_type, device_path):
         if connection_type == 'usb_serial':
             if device_path is not None:
                 return serial.Serial(device_path)
+        elif connection_type == 'replay':
+            from .session import ReplayPort
+            if isinstance(device_path, ReplayPort):
+                return device_path
+            return ReplayPort(device_path)
         elif sys.argv[1] == 'uart':
             # FT232H, D0 <-> PA9, USART1_TX
             # FT232H, D1 <-> PA10, USART1_RX
@@ -87,31 +113,11 @@ class Connection(object):
             return FT232H.I2CDevice(self.ft232h, 0x15)
 
     def _as_path_component(self, url_substring):
-        enum_inflected = enum_value_inflect(url_substring)
-        path_component_type = {
-            'resource_id': (lambda: zr.PathComponent.ResourceId.Value(enum_inflected)),
-            'module_type': (lambda: zr.AnalogModule.Type.Value(enum_inflected.replace('Lf', 'LF'))),
-            'parameter_id': (lambda: zr.Parameter.Id.Value(enum_inflected)),
-            'option_id': (lambda: zr.Option.Id.Value(enum_inflected)),
-            'input_id': (lambda: zr.InputId.Value(enum_inflected)),
-            'output_id': (lambda: zr.OutputId.Value(enum_inflected)),
-            'system_option_id': (lambda: zr.SystemOption.Id.Value(enum_inflected)),
-            'integer_argument': (lambda: int(url_substring))
-        }
-        for name, from_string in path_component_type.items():
-            try:
-                return (name, from_string())
-            except ValueError:
-                continue
-
-        return 'string_argument', url_substring
+        return as_path_component(url_substring)
 
     def _build_protobuf_url(self, url_string):
         url = zr.URL()
-        for url_substring in filter(None, url_string.split('/')):
-            path_component = url.path_components.add()
-            path_component_type, value = self._as_path_component(url_substring)
-            setattr(path_component, path_component_type, value)
+        url.CopyFrom(compile_url(url_string))
         return url
 
     def _populate_post_payload(self, request, payload):
@@ -129,9 +135,35 @@ class Connection(object):
                 getattr(request, name).CopyFrom(payload)
 
     def _send_and_await_response(self, request):
-        raw_response = write_and_wait(self.connection, request, get_payload=True)
+        if self.instrument is not None:
+            return self._send_instrumented(self.instrument.endpoint(request),
+                                           request.SerializeToString)
+        return self._send_serialized_and_await_response(request.SerializeToString())
+
+    def _exchange(self, payload):
+        with self.lock:
+            return write_serialized_and_wait(self.connection, payload,
+                                             get_payload=True, reader=self.reader)
+
+    def _send_serialized_and_await_response(self, payload):
+        response = zr.Response()
+        response.ParseFromString(self._exchange(payload))
+        return response
+
+    def _send_instrumented(self, endpoint, payload):
+        # payload is the serialized request, or a function returning it so
+        # serialization is timed too
+        start = default_timer()
+        if callable(payload):
+            payload = payload()
+        encoded = default_timer()
+        raw_response = self._exchange(payload)
+        received = default_timer()
         response = zr.Response()
         response.ParseFromString(raw_response)
+        decoded = default_timer()
+        self.instrument.record(endpoint, len(payload), len(raw_response),
+                               encoded - start, received - encoded, decoded - received)
         return response
 
     def _new_request(self, method, url):
@@ -139,13 +171,17 @@ class Connection(object):
             print('%s %s' % (method, url))
         request = zr.Request()
         request.method = zr.Method.Value(method)
-        request.url.CopyFrom(self._build_protobuf_url(url))
+        request.url.CopyFrom(compile_url(url))
         return request
 
-    def post(self, url, payload=None):
+    def _post_request(self, url, payload=None):
         request = self._new_request('POST', url)
         self._populate_post_payload(request, payload)
-        return self._send_and_await_response(request)
+        return request
+
+    def post(self, url, payload=None):
+        return self._send_and_await_response(
+            self._post_request(url, payload))
 
     def get(self, url):
         return self._send_and_await_response(
@@ -171,12 +207,16 @@ class Connection(object):
                 else:
                     getattr(request, name).CopyFrom(payload)
 
-    def put(self, url, payload):
+    def _put_request(self, url, payload):
         request = self._new_request('PUT', url)
         self._populate_put_payload(request, payload)
-        return self._send_and_await_response(request)
+        return request
 
-    def patch(self, url, payload, lookupTable=None):
+    def put(self, url, payload):
+        return self._send_and_await_response(
+            self._put_request(url, payload))
+
+    def _patch_request(self, url, payload, lookupTable=None):
         request = self._new_request('PATCH', url)
 
         if isinstance(payload, zr.AnalogModule):
@@ -187,15 +227,146 @@ class Connection(object):
         if lookupTable is not None:
             request.lookup_table.data[:] = lookupTable
 
-        return self._send_and_await_response(request)
+        return request
 
-    def delete(self, url, filter_args=None):
+    def patch(self, url, payload, lookupTable=None):
+        return self._send_and_await_response(
+            self._patch_request(url, payload, lookupTable))
+
+    def _delete_request(self, url, filter_args=None):
         request = self._new_request('DELETE', url)
 
         if isinstance(filter_args, zr.MidiListener):
-            request.midiListener.CopyFrom(filter_args)
+            request.midi_listener.CopyFrom(filter_args)
+
+        return request
+
+    def delete(self, url, filter_args=None):
+        return self._send_and_await_response(
+            self._delete_request(url, filter_args))
+
+    def send_serialized(self, payload, endpoint=None):
+        # endpoint saves the instrument from parsing the payload to find it
+        if self.instrument is not None:
+            if endpoint is None:
+                endpoint = self.instrument.payload_endpoint(payload)
+            return self._send_instrumented(endpoint, payload)
+        return self._send_serialized_and_await_response(payload)
+
+    def pipeline(self, window=8, check=None):
+        return Pipeline(self, window, check)
+
+class PendingResponse(object):
+    def __init__(self, pipeline, check=None):
+        self.pipeline = pipeline
+        self.check = check
+        self.response = None
+        self.error = None
+        # (endpoint, bytes sent, encode time, write time) when instrumented
+        self.sample = None
+
+    def done(self):
+        return self.response is not None or self.error is not None
+
+    def result(self):
+        while self.response is None:
+            if self.error is not None:
+                raise self.error
+            self.pipeline._collect_one()
+        if self.check is not None:
+            self.check(self.response)
+        return self.response
+
+class Pipeline(object):
+    # Writes up to `window` framed requests before reading any response.
+    # Responses arrive in request order, so each one resolves the oldest
+    # PendingResponse still in flight. The connection lock is held while
+    # anything is in flight so other threads can't interleave requests.
+    def __init__(self, connection, window=8, check=None):
+        if window < 1:
+            raise ValueError('pipeline window must be at least 1')
+        self.connection = connection
+        self.window = window
+        self.check = check
+        self.in_flight = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _collect_one(self):
+        pending = self.in_flight.popleft()
+        try:
+            raw_response = self.connection.reader.read()
+            received = default_timer()
+            response = zr.Response()
+            response.ParseFromString(raw_response)
+            pending.response = response
+            if pending.sample is not None:
+                # wire time includes waiting behind earlier responses
+                endpoint, sent, encode, written = pending.sample
+                self.connection.instrument.record(
+                    endpoint, sent, len(raw_response), encode,
+                    received - written, default_timer() - received)
+        except Exception as e:
+            # the responses still in flight can't be paired with their
+            # requests any more
+            pending.error = e
+            while self.in_flight:
+                self.in_flight.popleft().error = e
+            raise
+        finally:
+            if not self.in_flight:
+                self.connection.lock.release()
+
+    def submit(self, request):
+        pending = PendingResponse(self, self.check)
+        z = self.connection.connection
+        if FT232H_ENABLED and isinstance(z, (FT232H.SPI, FT232H.I2CDevice)):
+            pending.response = self.connection._send_and_await_response(request)
+            return pending
+        while len(self.in_flight) >= self.window:
+            self._collect_one()
+        instrument = self.connection.instrument
+        if instrument is not None:
+            start = default_timer()
+            payload = request.SerializeToString()
+            written = default_timer()
+            pending.sample = (instrument.endpoint(request), len(payload),
+                              written - start, written)
+        else:
+            payload = request.SerializeToString()
+        if not self.in_flight:
+            self.connection.lock.acquire()
+        try:
+            write_framed(z, payload)
+        except:
+            if not self.in_flight:
+                self.connection.lock.release()
+            raise
+        self.in_flight.append(pending)
+        return pending
+
+    def flush(self):
+        while self.in_flight:
+            self._collect_one()
+
+    def post(self, url, payload=None):
+        return self.submit(self.connection._post_request(url, payload))
+
+    def get(self, url):
+        return self.submit(self.connection._new_request('GET', url))
+
+    def put(self, url, payload):
+        return self.submit(self.connection._put_request(url, payload))
+
+    def patch(self, url, payload, lookupTable=None):
+        return self.submit(self.connection._patch_request(url, payload, lookupTable))
 
-        return self._send_and_await_response(request)
+    def delete(self, url, filter_args=None):
+        return self.submit(self.connection._delete_request(url, filter_args))
 
 class ConnectionError(Exception):
     def __init__(self):
@@ -207,6 +378,193 @@ class StatusCodeError(Exception):
         super().__init__(
             'Expected OK status code in response but received %s' % (zr.StatusCode.Name(status_code)))
 
+def ping_ok(response):
+    ack_bytes = bytearray(response.acknowledge.data)
+    return all(
+        [response.status_code == zr.StatusCode.Value('OK'),
+         ack_bytes[0] == 0xc0,
+         ack_bytes[1] == 0xff,
+         ack_bytes[2] == 0xee])
+
+def find_device(description='zrna midi/cdc'):
+    for com_port in serial.tools.list_ports.comports():
+        if com_port.description == description:
+            return com_port.device
+    return None
+
+@lru_cache(maxsize=1024)
+def as_path_component(url_substring):
+    enum_inflected = enum_value_inflect(url_substring)
+    path_component_type = [
+        ('resource_id', (lambda: zr.PathComponent.ResourceId.Value(enum_inflected))),
+        ('module_type', (lambda: zr.AnalogModule.Type.Value(enum_inflected.replace('Lf', 'LF')))),
+        ('parameter_id', (lambda: zr.Parameter.Id.Value(enum_inflected))),
+        ('option_id', (lambda: zr.Option.Id.Value(enum_inflected))),
+        ('input_id', (lambda: zr.InputId.Value(enum_inflected))),
+        ('output_id', (lambda: zr.OutputId.Value(enum_inflected))),
+        ('system_option_id', (lambda: zr.SystemOption.Id.Value(enum_inflected))),
+        ('integer_argument', (lambda: int(url_substring)))
+    ]
+    for name, from_string in path_component_type:
+        try:
+            return (name, from_string())
+        except ValueError:
+            continue
+
+    return 'string_argument', url_substring
+
+@lru_cache(maxsize=256)
+def url_template(pattern):
+    # pattern holds the URL's path components with every integer argument
+    # replaced by None; those positions are returned as substitution slots.
+    url = zr.URL()
+    slots = []
+    for i, url_substring in enumerate(pattern):
+        path_component = url.path_components.add()
+        if url_substring is None:
+            slots.append(i)
+            path_component.integer_argument = 0
+        else:
+            path_component_type, value = as_path_component(url_substring)
+            setattr(path_component, path_component_type, value)
+    return url, tuple(slots)
+
+@lru_cache(maxsize=1024)
+def compile_url(url_string):
+    # The returned URL is shared between callers and must only be copied.
+    components = [c for c in url_string.split('/') if c]
+    template, slots = url_template(
+        tuple(None if c.isdigit() else c for c in components))
+    if not slots:
+        return template
+    url = zr.URL()
+    url.CopyFrom(template)
+    for i in slots:
+        url.path_components[i].integer_argument = int(components[i])
+    return url
+
+def encode_varint(value):
+    b = bytearray()
+    while value > 0x7f:
+        b.append((value & 0x7f) | 0x80)
+        value >>= 7
+    b.append(value)
+    return bytes(b)
+
+def field_tag(message_type, field_name, wire_type):
+    number = message_type.DESCRIPTOR.fields_by_name[field_name].number
+    return encode_varint((number << 3) | wire_type)
+
+WIRE_TYPE_LENGTH_DELIMITED = 2
+WIRE_TYPE_FIXED32 = 5
+
+def version_string(response):
+    return '%d.%d.%d' % (
+        response.version.major,
+        response.version.minor,
+        response.version.patch)
+
+def module_schema_to_dict(schema):
+    return {
+        'type': zr.AnalogModule.Type.Name(schema.type),
+        'module': MessageToDict(schema.module),
+        'inputs': MessageToDict(schema.inputs),
+        'outputs': MessageToDict(schema.outputs)
+    }
+
+def module_schema_from_dict(d):
+    return ModuleSchema(
+        zr.AnalogModule.Type.Value(d['type']),
+        ParseDict(d['module'], zr.AnalogModule()),
+        ParseDict(d['inputs'], zr.Inputs()),
+        ParseDict(d['outputs'], zr.Outputs()))
+
+def schema_cache_path(directory, version):
+    return os.path.join(directory, 'schema-%s.json' % version)
+
+def read_module_schema(path):
+    # returns (version, module_types, schema)
+    with open(path) as f:
+        d = json.load(f)
+    return (d['version'],
+            [zr.AnalogModule.Type.Value(t) for t in d['module_types']],
+            [module_schema_from_dict(m) for m in d['modules']])
+
+def write_module_schema(path, version, module_types, schema):
+    d = {
+        'version': version,
+        'module_types': [zr.AnalogModule.Type.Name(t) for t in module_types],
+        'modules': [module_schema_to_dict(s) for s in schema]
+    }
+    with open(path, 'w') as f:
+        json.dump(d, f, indent=1, sort_keys=True)
+
+def load_module_schema(directory, version):
+    try:
+        cached_version, module_types, schema = read_module_schema(
+            schema_cache_path(directory, version))
+        if cached_version != version:
+            return None
+        return (module_types, schema)
+    except (IOError, OSError, ValueError, KeyError, ParseError):
+        return None
+
+def save_module_schema(directory, version, module_types, schema):
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_module_schema(schema_cache_path(directory, version),
+                            version, module_types, schema)
+    except (IOError, OSError):
+        # a missing cache only costs a slower connect
+        pass
+
+def module_class_attributes(schema):
+    # Class level data of a module class, shared by the classes the client
+    # builds at runtime and the ones written out by zrna.codegen. Everything
+    # in here has to survive a round trip through repr().
+    d = MessageToDict(schema.module, True)
+    a = OrderedDict()
+    a['type'] = schema.type
+    a['type_name'] = to_class_name(zr.AnalogModule.Type.Name(schema.type))
+
+    options = [(to_field_name(o.get('id', zr.Option.Id.Name(0))), o)
+               for o in d.get('options', [])]
+    parameters = [(to_field_name(p.get('id', zr.Parameter.Id.Name(0))), p)
+                  for p in d.get('parameters', [])]
+    a['parameters'] = [parameter_id for parameter_id, _ in parameters]
+    a['options'] = [option_id for option_id, _ in options]
+    a['outputs'] = [to_field_name(zr.OutputId.Name(o)) for o in schema.outputs.output]
+    a['_parameter_set'] = frozenset(a['parameters'])
+    a['_option_set'] = frozenset(a['options'])
+    a['_parameter_defaults'] = [(parameter_id, p['requested'])
+                                for parameter_id, p in parameters]
+    a['_option_defaults'] = [
+        (option_id, zr.Option.Value.Value(o.get('value', zr.Option.Value.Name(0))))
+        for option_id, o in options]
+    a['_option_valid_values'] = dict((option_id, o['validValues'])
+                                     for option_id, o in options)
+
+    input_conditions = []
+    for i in schema.inputs.input:
+        condition = None
+        if i.conditionally_enabled:
+            condition = (to_field_name(zr.Option.Id.Name(i.enabled_if.option_id)),
+                         i.enabled_if.option_value)
+        input_conditions.append((to_field_name(zr.InputId.Name(i.id)), condition))
+    a['_input_conditions'] = input_conditions
+
+    a['_has_lookup_table'] = bool(d.get('hasLookupTable'))
+    a['_clock_configuration'] = d.get('clockConfiguration')
+
+    slots = list(a['outputs'])
+    if a['_has_lookup_table']:
+        slots.append('lookup_table')
+    if a['_clock_configuration'] is not None:
+        slots.append('clock_configuration')
+    a['__slots__'] = slots
+    return a
+
 def i2c_scan():
     if FT232H_ENABLED:
         for address in range(127):
@@ -258,21 +616,52 @@ def handle_spi(z, payload, get_payload=False):
                 return cobs.decode(bytes(b[:-1]))
         sleep(0.02)
 
-def read_framed(z):
-    b = bytearray()
-    b.append(z.read(1)[0])
-    while b[-1] != 0x00:
-        b.append(z.read(1)[0])
-    return cobs.decode(bytes(b[:-1]))
+class FrameReader(object):
+    # Reads whatever the port has available in one call and splits COBS
+    # frames on the 0x00 delimiter, keeping any trailing bytes buffered
+    # for the next frame.
+    def __init__(self, z):
+        self.z = z
+        self.buffer = bytearray()
+        self.scanned = 0
+
+    def _fill(self):
+        available = getattr(self.z, 'in_waiting', 0)
+        self.feed(self.z.read(max(1, available)))
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def next_frame(self):
+        delimiter = self.buffer.find(b'\x00', self.scanned)
+        if delimiter == -1:
+            self.scanned = len(self.buffer)
+            return None
+        frame = bytes(self.buffer[:delimiter])
+        del self.buffer[:delimiter + 1]
+        self.scanned = 0
+        return cobs.decode(frame)
+
+    def read(self):
+        frame = self.next_frame()
+        while frame is None:
+            self._fill()
+            frame = self.next_frame()
+        return frame
+
+def read_framed(z, reader=None):
+    if reader is None:
+        reader = FrameReader(z)
+    return reader.read()
 
 def write_framed(z, payload):
     b = bytearray(cobs.encode(payload))
     b.append(0x00)
     z.write(b)
 
-def wait_for_ok(z):
+def wait_for_ok(z, reader=None):
     response = zr.Response()
-    response.ParseFromString(read_framed(z))
+    response.ParseFromString(read_framed(z, reader))
     if response.status_code != zr.OK:
         raise StatusCodeError(response.status_code)
 
@@ -295,34 +684,41 @@ def wait_for_ok_i2c(z):
     if response.status_code != zr.OK:
         raise StatusCodeError(response.status_code)
 
-def write_and_wait(z, r, get_payload=False):
+def write_and_wait(z, r, get_payload=False, reader=None):
+    return write_serialized_and_wait(z, r.SerializeToString(), get_payload, reader)
+
+def write_serialized_and_wait(z, payload, get_payload=False, reader=None):
     spi = FT232H_ENABLED and isinstance(z, FT232H.SPI)
     i2c = FT232H_ENABLED and isinstance(z, FT232H.I2CDevice)
     if spi:
         if get_payload:
-            return handle_spi(z, r.SerializeToString(), get_payload)
+            return handle_spi(z, payload, get_payload)
         else:
-            handle_spi(z, r.SerializeToString())
+            handle_spi(z, payload)
     elif i2c:
-        write_framed_i2c(z, r.SerializeToString())
+        write_framed_i2c(z, payload)
         sleep(0.1)
         if get_payload:
             return read_framed_i2c(z)
         else:
             wait_for_ok_i2c(z)
     else:
-        write_framed(z, r.SerializeToString())
+        write_framed(z, payload)
         if get_payload:
-            return read_framed(z)
+            return read_framed(z, reader)
         else:
-            wait_for_ok(z)
+            wait_for_ok(z, reader)
 
 def within_tolerance(requested, realized, tolerance):
-    if requested != 0:
-        return ((abs(realized - requested)
-                 / float(requested) * 100) < tolerance)
-    else:
-        return requested == realized
+    # works elementwise on arrays, e.g. the columns of a CircuitSnapshot
+    requested = numpy.asarray(requested, dtype=numpy.float64)
+    realized = numpy.asarray(realized, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        relative = numpy.abs(realized - requested) / requested * 100 < tolerance
+    result = numpy.where(requested != 0, relative, requested == realized)
+    if result.ndim == 0:
+        return bool(result)
+    return result
 
 def update_lookup_table(obj, module_description):
     if 'lookupTable' in module_description: